@@ -1,6 +1,10 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from app.services.supabase_service import supabase
+from app.services.lexical_index import delete_bot_index
+from app.services.document_centroids import delete_bot_centroids
+from app.services.embedding_arena import invalidate_segment
+from app.services.gemini_service import EMBEDDING_MODEL_ID
 from uuid import uuid4
 from datetime import datetime
 
@@ -19,6 +23,7 @@ def create_bot(request: BotCreateRequest):
     data = {
         "id": bot_id,
         "name": request.name,
+        "embedding_model": EMBEDDING_MODEL_ID,
         "created_at": created_at
     }
     try:
@@ -80,8 +85,14 @@ def delete_bot(bot_id: str):
         # Delete related documents
         supabase.table("documents").delete().eq("bot_id", bot_id).execute()
         
-        # Delete chat history
+        # Delete chat history and conversation memory
         supabase.table("chat_history").delete().eq("bot_id", bot_id).execute()
+        supabase.table("chat_sessions").delete().eq("bot_id", bot_id).execute()
+        
+        # Delete the lexical index and document centroids
+        delete_bot_index(bot_id)
+        delete_bot_centroids(bot_id)
+        invalidate_segment(bot_id)
         
         # Delete embed tokens
         supabase.table("embed_tokens").delete().eq("bot_id", bot_id).execute()
@@ -94,9 +105,12 @@ def delete_bot(bot_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/bots/{bot_id}/history")
-def get_chat_history(bot_id: str):
+def get_chat_history(bot_id: str, session_id: str = None):
     try:
-        res = supabase.table("chat_history").select("*").eq("bot_id", bot_id).order("created_at", desc=False).execute()
+        query = supabase.table("chat_history").select("*").eq("bot_id", bot_id)
+        if session_id:
+            query = query.eq("session_id", session_id)
+        res = query.order("created_at", desc=False).execute()
         return res.data
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -116,6 +130,11 @@ def clear_bot_content(bot_id: str):
         # Delete documents
         supabase.table("documents").delete().eq("bot_id", bot_id).execute()
         
+        # Delete the lexical index and document centroids
+        delete_bot_index(bot_id)
+        delete_bot_centroids(bot_id)
+        invalidate_segment(bot_id)
+        
         return {"message": "Bot content cleared successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -1,106 +1,221 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from app.services.supabase_service import supabase
-from app.services.gemini_service import get_text_embeddings, get_gemini_model
+from app.services.gemini_service import get_text_embeddings
+from app.services.embedding_versions import get_active_model
+from app.services.generation_client import generate_text, GenerationError, GEMINI_MAX_CONCURRENCY_PER_BOT
+from app.services.retrieval import retrieve, HIERARCHICAL_TOP_DOCUMENTS, batch_dense_search, LEXICAL_CANDIDATES
+from app.services.context_packer import pack_context, build_prompt, prompt_token_count, CONTEXT_TOKEN_BUDGET, PACK_CANDIDATE_POOL, MAX_CONTEXT_TOKEN_BUDGET, MAX_TOP_K
+from app.services.metrics import stage
+from app.services.admission import admit_chat
+from app.services.conversation import load_session, memory_prompt, record_turn
+from app.services.log import get_logger
 import numpy as np
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from uuid import uuid4
 
 router = APIRouter()
+logger = get_logger("chat")
+
+# Largest number of queries accepted by /chat/batch
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "5000"))
 
 class ChatRequest(BaseModel):
     bot_id: str
     user_query: str
-    top_k: int = 3  # Number of context chunks to use
+    top_k: int = Field(3, gt=0, le=MAX_TOP_K)  # Number of context chunks to use
+    retrieval_mode: str = "dense"  # "dense", "hybrid" (BM25 prefilter + dense scoring + RRF) or "hierarchical" (best documents first)
+    lexical_candidates: int = LEXICAL_CANDIDATES  # BM25 candidates dense-scored in hybrid mode
+    top_documents: int = HIERARCHICAL_TOP_DOCUMENTS  # Documents whose chunks are scored in hierarchical mode
+    token_budget: Optional[int] = Field(None, gt=0, le=MAX_CONTEXT_TOKEN_BUDGET)  # Fill this many context tokens in score order instead of using exactly top_k chunks
+    session_id: Optional[str] = Field(None, max_length=128)  # Conversation to continue; without it every message stands alone
+
+class BatchChatRequest(BaseModel):
+    bot_id: str
+    queries: List[str]
+    top_k: int = Field(3, gt=0, le=MAX_TOP_K)
+    token_budget: Optional[int] = Field(None, gt=0, le=MAX_CONTEXT_TOKEN_BUDGET)
+    concurrency: int = GEMINI_MAX_CONCURRENCY_PER_BOT  # Gemini calls in flight for this batch
+    store_history: bool = False  # Batch jobs (evaluation, FAQ generation) usually should not show up in chat history
 
-@router.post("/chat")
+@router.post("/chat", dependencies=[Depends(admit_chat)])
 def chat(request: ChatRequest):
-    print("/chat called with:", request)
+    logger.info("/chat called", extra={"bot_id": request.bot_id, "query_chars": len(request.user_query), "retrieval_mode": request.retrieval_mode})
     # 1. Embed the user query
     try:
-        query_embedding = get_text_embeddings([request.user_query])[0]
-        query_embedding = np.array(query_embedding)
-        print("Query embedding computed.")
+        with stage("embed"):
+            query_embedding = get_text_embeddings([request.user_query], model_id=get_active_model(request.bot_id))[0]
+            query_embedding = np.array(query_embedding)
     except Exception as e:
-        print("Error in embedding user query:", e)
+        logger.error("Error in embedding user query", extra={"bot_id": request.bot_id, "error": str(e)})
         raise HTTPException(status_code=500, detail=f"Embedding error: {str(e)}")
 
-    # 2. Retrieve all embeddings for the bot
+    # 2. Retrieve the most similar chunks for the bot (dense, or BM25 prefilter + dense in hybrid mode)
     try:
-        res = supabase.table("embeddings").select("chunk_text,embedding").eq("bot_id", request.bot_id).execute()
-        print("Embeddings fetched:", res.data)
-        if not res.data or len(res.data) == 0:
-            print("No embeddings found for this bot.")
+        candidates = max(request.top_k, PACK_CANDIDATE_POOL) if request.token_budget else request.top_k
+        hits = retrieve(request.bot_id, request.user_query, query_embedding, candidates, mode=request.retrieval_mode, lexical_candidates=request.lexical_candidates, top_documents=request.top_documents)
+        if not hits:
+            logger.info("No embeddings found for this bot", extra={"bot_id": request.bot_id})
             raise HTTPException(status_code=404, detail="No embeddings found for this bot.")
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print("Error fetching embeddings:", e)
-        raise HTTPException(status_code=500, detail=f"Failed to fetch embeddings: {str(e)}")
+        logger.error("Error retrieving context chunks", extra={"bot_id": request.bot_id, "error": str(e)})
+        raise HTTPException(status_code=500, detail=f"Retrieval error: {str(e)}")
 
-    # 3. Compute cosine similarity
-    chunk_texts = []
-    similarities = []
+    # 3. Send context, conversation memory and user query to Gemini
+    session = None
+    if request.session_id:
+        try:
+            with stage("memory"):
+                session = load_session(request.bot_id, request.session_id)
+        except Exception as e:
+            logger.error("Error loading conversation memory", extra={"bot_id": request.bot_id, "error": str(e)})
+    with stage("prompt"):
+        # Merge adjacent chunks, drop their overlap and cap the context at the token budget
+        context_chunks, context_tokens = pack_context(hits, request.token_budget or CONTEXT_TOKEN_BUDGET)
+        prompt = build_prompt(context_chunks, request.user_query, memory_prompt(session))
     try:
-        for row in res.data:
-            chunk_embedding = np.array(row["embedding"])
-            sim = np.dot(query_embedding, chunk_embedding) / (np.linalg.norm(query_embedding) * np.linalg.norm(chunk_embedding) + 1e-8)
-            similarities.append(sim)
-            chunk_texts.append(row["chunk_text"])
-        print("Similarities computed.")
+        with stage("llm"):
+            response = generate_text(prompt, bot_id=request.bot_id)
+        answer = response.text if hasattr(response, 'text') else str(response)
+        prompt_tokens = prompt_token_count(response, prompt)
+    except GenerationError as e:
+        logger.error("Gemini API error", extra={"bot_id": request.bot_id, "error": str(e), "status": e.status_code})
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
-        print("Error computing similarities:", e)
-        raise HTTPException(status_code=500, detail=f"Similarity computation error: {str(e)}")
+        logger.error("Gemini API error", extra={"bot_id": request.bot_id, "error": str(e)})
+        raise HTTPException(status_code=500, detail=f"Gemini API error: {str(e)}")
+
+    # 4. Store the conversation in chat_history table
+    with stage("history"):
+        try:
+            timestamp = datetime.utcnow().isoformat()
+            
+            # Store user message (let Supabase auto-generate UUID for id)
+            user_message = {
+                "bot_id": request.bot_id,  # This should be a UUID string that matches bots.id
+                "session_id": request.session_id,
+                "role": "user",
+                "message": request.user_query,
+                "created_at": timestamp
+            }
+            supabase.table("chat_history").insert(user_message).execute()
+            
+            # Store bot response (let Supabase auto-generate UUID for id)
+            bot_message = {
+                "bot_id": request.bot_id,  # This should be a UUID string that matches bots.id
+                "session_id": request.session_id,
+                "role": "bot",
+                "message": answer,
+                "created_at": datetime.utcnow().isoformat()  # Later than the question, so a session replays in order
+            }
+            supabase.table("chat_history").insert(bot_message).execute()
+        except Exception as e:
+            logger.error("Error storing chat history", extra={"bot_id": request.bot_id, "error": str(e)})
+            # Don't fail the request if storing history fails
+            pass
+        if session is not None:
+            try:
+                record_turn(session, request.user_query, answer)
+            except Exception as e:
+                logger.error("Error updating conversation memory", extra={"bot_id": request.bot_id, "error": str(e)})
+
+    return {
+        "answer": answer,
+        "context_chunks": context_chunks,
+        "context_tokens": context_tokens,
+        "prompt_tokens": prompt_tokens,
+        "session_id": request.session_id
+    } 
+
+@router.post("/chat/batch", dependencies=[Depends(admit_chat)])
+def chat_batch(request: BatchChatRequest):
+    """
+    Answer many questions for one bot. All queries are embedded in one encode call and scored against
+    the bot's vectors with one matrix-matrix product; answers stream back as NDJSON lines as they complete.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries given.")
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} queries per batch.")
+    logger.info("/chat/batch called", extra={"bot_id": request.bot_id, "queries": len(request.queries)})
 
-    # 4. Select top-k most similar chunks
+    # 1. Embed all queries at once
     try:
-        top_k = min(request.top_k, len(similarities))
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
-        context_chunks = [chunk_texts[i] for i in top_indices]
-        context = "\n".join(context_chunks)
-        print("Context chunks selected.")
+        with stage("embed"):
+            query_embeddings = np.array(get_text_embeddings(request.queries, model_id=get_active_model(request.bot_id)))
     except Exception as e:
-        print("Error selecting context chunks:", e)
-        raise HTTPException(status_code=500, detail=f"Context selection error: {str(e)}")
+        logger.error("Error in embedding batch queries", extra={"bot_id": request.bot_id, "error": str(e)})
+        raise HTTPException(status_code=500, detail=f"Embedding error: {str(e)}")
 
-    # 5. Send context and user query to Gemini
-    prompt = f"Context:\n{context}\n\nUser question: {request.user_query}\nAnswer:"
+    # 2. Fetch the bot's vectors once and take the top-k chunks for every query
+    candidates = max(request.top_k, PACK_CANDIDATE_POOL) if request.token_budget else request.top_k
     try:
-        gemini = get_gemini_model()
-        response = gemini.generate_content(prompt)
-        answer = response.text if hasattr(response, 'text') else str(response)
-        print("Gemini response received.")
+        all_hits = batch_dense_search(request.bot_id, query_embeddings, candidates)
     except Exception as e:
-        print("Gemini API error:", e)
-        raise HTTPException(status_code=500, detail=f"Gemini API error: {str(e)}")
+        logger.error("Error retrieving batch context chunks", extra={"bot_id": request.bot_id, "error": str(e)})
+        raise HTTPException(status_code=500, detail=f"Retrieval error: {str(e)}")
+    if not all_hits[0]:
+        raise HTTPException(status_code=404, detail="No embeddings found for this bot.")
 
-    # 6. Store the conversation in chat_history table
-    try:
-        timestamp = datetime.utcnow().isoformat()
-        
-        # Store user message (let Supabase auto-generate UUID for id)
-        user_message = {
-            "bot_id": request.bot_id,  # This should be a UUID string that matches bots.id
-            "role": "user",
-            "message": request.user_query,
-            "created_at": timestamp
-        }
-        supabase.table("chat_history").insert(user_message).execute()
-        
-        # Store bot response (let Supabase auto-generate UUID for id)
-        bot_message = {
-            "bot_id": request.bot_id,  # This should be a UUID string that matches bots.id
-            "role": "bot",
-            "message": answer,
-            "created_at": timestamp
+    def answer(index: int) -> dict:
+        query = request.queries[index]
+        context_chunks, context_tokens = pack_context(all_hits[index], request.token_budget or CONTEXT_TOKEN_BUDGET)
+        prompt = build_prompt(context_chunks, query)
+        response = generate_text(prompt, bot_id=request.bot_id)
+        return {
+            "index": index,
+            "query": query,
+            "answer": response.text if hasattr(response, 'text') else str(response),
+            "context_chunks": context_chunks,
+            "context_tokens": context_tokens,
+            "prompt_tokens": prompt_token_count(response, prompt),
         }
-        supabase.table("chat_history").insert(bot_message).execute()
-        
-        print("Chat history stored successfully.")
-    except Exception as e:
-        print("Error storing chat history:", e)
-        # Don't fail the request if storing history fails
-        pass
 
-    return {
-        "answer": answer,
-        "context_chunks": context_chunks
-    } 
\ No newline at end of file
+    # 3. Generate answers with bounded concurrency and stream each one as soon as it is done.
+    # The generation client also caps calls per bot, so more threads than that would only queue.
+    concurrency = max(1, min(request.concurrency, GEMINI_MAX_CONCURRENCY_PER_BOT))
+
+    def stream():
+        history = []
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        pending = {}
+        next_index = 0
+        try:
+            # Only `concurrency` calls are queued at a time, so a client that disconnects stops the batch
+            # after the calls already running instead of after every remaining query
+            while next_index < len(request.queries) or pending:
+                while next_index < len(request.queries) and len(pending) < concurrency:
+                    pending[executor.submit(answer, next_index)] = next_index
+                    next_index += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except GenerationError as e:
+                        result = {"index": index, "query": request.queries[index], "error": str(e), "status": e.status_code}
+                    except Exception as e:
+                        result = {"index": index, "query": request.queries[index], "error": str(e), "status": 500}
+                    if request.store_history and "answer" in result:
+                        timestamp = datetime.utcnow().isoformat()
+                        history.append({"bot_id": request.bot_id, "role": "user", "message": result["query"], "created_at": timestamp})
+                        history.append({"bot_id": request.bot_id, "role": "bot", "message": result["answer"], "created_at": timestamp})
+                    yield json.dumps(result) + "\n"
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if history:
+                try:
+                    supabase.table("chat_history").insert(history).execute()
+                except Exception as e:
+                    logger.error("Error storing batch chat history", extra={"bot_id": request.bot_id, "error": str(e)})
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from urllib.parse import quote
+from app.services.document_store import get_document, list_documents, load_document_body, iter_document_content, raw_blob
+
+router = APIRouter()
+
+@router.get("/bots/{bot_id}/documents")
+def get_bot_documents(bot_id: str):
+    """List a bot's documents without their bodies"""
+    try:
+        return list_documents(bot_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/documents/{document_id}")
+def get_document_metadata(document_id: str):
+    try:
+        document = get_document(document_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document
+
+@router.get("/documents/{document_id}/content")
+def download_document_content(document_id: str, request: Request):
+    """Download a document's extracted text, streamed as it is decompressed"""
+    try:
+        body = load_document_body(document_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if body is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    filename = f"{body['name']}.txt"
+    headers = {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}", "Vary": "Accept-Encoding"}
+    encoding = body.get("content_encoding")
+    accepted = {value.split(";")[0].strip() for value in request.headers.get("accept-encoding", "").split(",")}
+    if encoding and encoding in accepted:
+        # The client can decode the stored blob itself, so send it without decompressing
+        return Response(content=raw_blob(body), media_type="text/plain; charset=utf-8", headers={**headers, "Content-Encoding": encoding})
+    if body.get("content_size") is not None:
+        headers["Content-Length"] = str(body["content_size"])
+    return StreamingResponse(iter_document_content(body), media_type="text/plain; charset=utf-8", headers=headers)
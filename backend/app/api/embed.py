@@ -1,20 +1,40 @@
-from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse, HTMLResponse
+from pydantic import BaseModel, Field
 from app.services.supabase_service import supabase
-from app.services.gemini_service import get_text_embeddings, get_gemini_model
+from app.services.data_access import get_data_access
+from app.services.gemini_service import get_text_embeddings
+from app.services.embedding_versions import get_active_model
+from app.services.generation_client import generate_text, GenerationError
+from app.services.retrieval import retrieve, HIERARCHICAL_TOP_DOCUMENTS, LEXICAL_CANDIDATES
+from app.services.context_packer import pack_context, build_prompt, prompt_token_count, CONTEXT_TOKEN_BUDGET, PACK_CANDIDATE_POOL, MAX_CONTEXT_TOKEN_BUDGET, MAX_TOP_K
+from app.services.metrics import stage
+from app.services.admission import admit_embed_chat
+from app.services.conversation import load_session, memory_prompt, record_turn
+from app.services.widget_assets import asset_url, resolve_asset, resolve_source
+from app.services.log import get_logger
+from html import escape
 import numpy as np
 from datetime import datetime
 import secrets
 from typing import Optional
 
 router = APIRouter()
+logger = get_logger("embed")
+
+# Hashed widget assets never change, so they are cached for a year
+ASSET_MAX_AGE = 365 * 24 * 3600
 
 class EmbedChatRequest(BaseModel):
     bot_id: str
     user_query: str
     embed_token: str
-    top_k: int = 3
+    top_k: int = Field(3, gt=0, le=MAX_TOP_K)
+    retrieval_mode: str = "dense"  # "dense", "hybrid" (BM25 prefilter + dense scoring + RRF) or "hierarchical" (best documents first)
+    lexical_candidates: int = LEXICAL_CANDIDATES
+    top_documents: int = HIERARCHICAL_TOP_DOCUMENTS
+    token_budget: Optional[int] = Field(None, gt=0, le=MAX_CONTEXT_TOKEN_BUDGET)  # Fill this many context tokens in score order instead of using exactly top_k chunks
+    session_id: Optional[str] = Field(None, max_length=128)  # Conversation to continue; without it every message stands alone
 
 class GenerateEmbedRequest(BaseModel):
     bot_id: str
@@ -57,7 +77,7 @@ def generate_embed_code(request: GenerateEmbedRequest):
 <script>
 (function() {{
     const script = document.createElement('script');
-    script.src = '{base_url}/embed/widget.js';
+    script.src = '{base_url}{asset_url('loader.js')}';
     script.onload = function() {{
         window.ChatbotWidget.init({{
             token: '{embed_token}',
@@ -85,21 +105,20 @@ def generate_embed_code(request: GenerateEmbedRequest):
 def get_embed_widget(embed_token: str):
     """Serve the embeddable chat widget HTML"""
     try:
-        # Verify embed token
-        embed_res = supabase.table("embed_tokens").select("*").eq("embed_token", embed_token).eq("is_active", True).execute()
-        if not embed_res.data:
+        # Verify embed token; concurrent widget loads share these lookups through the data-access layer
+        embed_data = get_data_access().get_one("embed_tokens", "embed_token", embed_token, filters={"is_active": True})
+        if embed_data is None:
             raise HTTPException(status_code=404, detail="Invalid or expired embed token")
         
-        embed_data = embed_res.data[0]
         bot_id = embed_data["bot_id"]
         
         # Get bot info
-        bot_res = supabase.table("bots").select("*").eq("id", bot_id).execute()
-        if not bot_res.data:
+        bot = get_data_access().get_one("bots", "id", bot_id)
+        if bot is None:
             raise HTTPException(status_code=404, detail="Bot not found")
         
-        bot = bot_res.data[0]
-        bot_name = bot.get("name", f"Bot #{bot_id[:8]}")
+        bot_name = escape(bot.get("name", f"Bot #{bot_id[:8]}"))
+        base_url = "http://localhost:8000"  # In production, use your actual domain
         
         html_content = f'''<!DOCTYPE html>
 <html lang="en">
@@ -107,179 +126,9 @@ def get_embed_widget(embed_token: str):
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>{bot_name} Chat Widget</title>
-    <style>
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }}
-        
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            height: 100vh;
-            overflow: hidden;
-        }}
-        
-        .chat-container {{
-            display: flex;
-            flex-direction: column;
-            height: 100vh;
-            background: white;
-            border-radius: 0;
-        }}
-        
-        .chat-header {{
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            padding: 15px;
-            text-align: center;
-            font-weight: 600;
-            font-size: 16px;
-            border-bottom: 2px solid rgba(255,255,255,0.1);
-        }}
-        
-        .chat-messages {{
-            flex: 1;
-            overflow-y: auto;
-            padding: 20px;
-            background: #f8fafc;
-        }}
-        
-        .message {{
-            margin-bottom: 15px;
-            display: flex;
-            align-items: flex-start;
-            gap: 10px;
-        }}
-        
-        .message.user {{
-            flex-direction: row-reverse;
-        }}
-        
-        .message-bubble {{
-            max-width: 80%;
-            padding: 12px 16px;
-            border-radius: 18px;
-            word-wrap: break-word;
-            line-height: 1.4;
-        }}
-        
-        .message.user .message-bubble {{
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-        }}
-        
-        .message.bot .message-bubble {{
-            background: white;
-            color: #2d3748;
-            border: 1px solid #e2e8f0;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-        }}
-        
-        .avatar {{
-            width: 32px;
-            height: 32px;
-            border-radius: 50%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            font-size: 14px;
-            flex-shrink: 0;
-        }}
-        
-        .avatar.user {{
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-        }}
-        
-        .avatar.bot {{
-            background: #e2e8f0;
-            color: #4a5568;
-        }}
-        
-        .chat-input {{
-            padding: 15px;
-            background: white;
-            border-top: 1px solid #e2e8f0;
-        }}
-        
-        .input-container {{
-            display: flex;
-            gap: 10px;
-            align-items: center;
-        }}
-        
-        .message-input {{
-            flex: 1;
-            padding: 12px 16px;
-            border: 1px solid #e2e8f0;
-            border-radius: 25px;
-            outline: none;
-            font-size: 14px;
-            transition: border-color 0.2s;
-        }}
-        
-        .message-input:focus {{
-            border-color: #667eea;
-            box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);
-        }}
-        
-        .send-button {{
-            width: 40px;
-            height: 40px;
-            border: none;
-            border-radius: 50%;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            cursor: pointer;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            transition: transform 0.2s;
-        }}
-        
-        .send-button:hover {{
-            transform: scale(1.05);
-        }}
-        
-        .send-button:disabled {{
-            opacity: 0.5;
-            cursor: not-allowed;
-            transform: none;
-        }}
-        
-        .typing-indicator {{
-            display: none;
-            padding: 15px;
-            font-style: italic;
-            color: #64748b;
-            font-size: 14px;
-        }}
-        
-        .welcome-message {{
-            text-align: center;
-            padding: 30px 20px;
-            color: #64748b;
-        }}
-        
-        .welcome-message h3 {{
-            color: #2d3748;
-            margin-bottom: 10px;
-        }}
-        
-        .error-message {{
-            background: #fed7d7;
-            color: #c53030;
-            padding: 10px;
-            border-radius: 8px;
-            margin: 10px;
-            text-align: center;
-            font-size: 14px;
-        }}
-    </style>
+    <link rel="stylesheet" href="{asset_url('widget.css')}">
 </head>
-<body>
+<body data-api-url="{base_url}" data-embed-token="{escape(embed_token)}" data-bot-id="{escape(bot_id)}">
     <div class="chat-container">
         <div class="chat-header">
             🤖 {bot_name}
@@ -315,104 +164,7 @@ def get_embed_widget(embed_token: str):
         </div>
     </div>
 
-    <script>
-        const API_URL = 'http://localhost:8000';
-        const EMBED_TOKEN = '{embed_token}';
-        const BOT_ID = '{bot_id}';
-        
-        const chatMessages = document.getElementById('chatMessages');
-        const messageInput = document.getElementById('messageInput');
-        const sendButton = document.getElementById('sendButton');
-        const chatForm = document.getElementById('chatForm');
-        const typingIndicator = document.getElementById('typingIndicator');
-        
-        function addMessage(content, isUser = false) {{
-            const messageDiv = document.createElement('div');
-            messageDiv.className = `message ${{isUser ? 'user' : 'bot'}}`;
-            
-            messageDiv.innerHTML = `
-                <div class="avatar ${{isUser ? 'user' : 'bot'}}">
-                    ${{isUser ? '👤' : '🤖'}}
-                </div>
-                <div class="message-bubble">
-                    ${{content}}
-                </div>
-            `;
-            
-            chatMessages.appendChild(messageDiv);
-            chatMessages.scrollTop = chatMessages.scrollHeight;
-        }}
-        
-        function showTyping() {{
-            typingIndicator.style.display = 'block';
-            chatMessages.scrollTop = chatMessages.scrollHeight;
-        }}
-        
-        function hideTyping() {{
-            typingIndicator.style.display = 'none';
-        }}
-        
-        function showError(message) {{
-            const errorDiv = document.createElement('div');
-            errorDiv.className = 'error-message';
-            errorDiv.textContent = message;
-            chatMessages.appendChild(errorDiv);
-            chatMessages.scrollTop = chatMessages.scrollHeight;
-        }}
-        
-        async function sendMessage(userMessage) {{
-            try {{
-                showTyping();
-                sendButton.disabled = true;
-                
-                const response = await fetch(`${{API_URL}}/embed/chat`, {{
-                    method: 'POST',
-                    headers: {{
-                        'Content-Type': 'application/json',
-                    }},
-                    body: JSON.stringify({{
-                        bot_id: BOT_ID,
-                        user_query: userMessage,
-                        embed_token: EMBED_TOKEN
-                    }})
-                }});
-                
-                if (!response.ok) {{
-                    throw new Error('Failed to get response');
-                }}
-                
-                const data = await response.json();
-                hideTyping();
-                addMessage(data.answer, false);
-                
-            }} catch (error) {{
-                hideTyping();
-                showError('Sorry, I encountered an error. Please try again.');
-                console.error('Chat error:', error);
-            }} finally {{
-                sendButton.disabled = false;
-            }}
-        }}
-        
-        chatForm.addEventListener('submit', async (e) => {{
-            e.preventDefault();
-            
-            const message = messageInput.value.trim();
-            if (!message) return;
-            
-            addMessage(message, true);
-            messageInput.value = '';
-            
-            await sendMessage(message);
-        }});
-        
-        messageInput.addEventListener('keypress', (e) => {{
-            if (e.key === 'Enter' && !e.shiftKey) {{
-                e.preventDefault();
-                chatForm.dispatchEvent(new Event('submit'));
-            }}
-        }});
-    </script>
+    <script src="{asset_url('widget.js')}"></script>
 </body>
 </html>'''
         
@@ -427,124 +179,118 @@ def get_embed_widget(embed_token: str):
 </body></html>'''
         return HTMLResponse(content=error_html, status_code=500)
 
-@router.post("/embed/chat")
+@router.post("/embed/chat", dependencies=[Depends(admit_embed_chat)])
 def embed_chat(request: EmbedChatRequest):
     """Handle chat requests from embedded widgets"""
     try:
         # Verify embed token
-        embed_res = supabase.table("embed_tokens").select("*").eq("embed_token", request.embed_token).eq("is_active", True).execute()
-        if not embed_res.data:
+        embed_data = get_data_access().get_one("embed_tokens", "embed_token", request.embed_token, filters={"is_active": True})
+        if embed_data is None:
             raise HTTPException(status_code=401, detail="Invalid or expired embed token")
         
-        embed_data = embed_res.data[0]
         if embed_data["bot_id"] != request.bot_id:
             raise HTTPException(status_code=401, detail="Bot ID mismatch")
         
         # Use the same chat logic as the main chat endpoint
         # 1. Embed the user query
-        query_embedding = get_text_embeddings([request.user_query])[0]
-        query_embedding = np.array(query_embedding)
+        with stage("embed"):
+            query_embedding = get_text_embeddings([request.user_query], model_id=get_active_model(request.bot_id))[0]
+            query_embedding = np.array(query_embedding)
 
-        # 2. Retrieve all embeddings for the bot
-        res = supabase.table("embeddings").select("chunk_text,embedding").eq("bot_id", request.bot_id).execute()
-        if not res.data or len(res.data) == 0:
+        # 2. Retrieve the most similar chunks for the bot
+        candidates = max(request.top_k, PACK_CANDIDATE_POOL) if request.token_budget else request.top_k
+        try:
+            hits = retrieve(request.bot_id, request.user_query, query_embedding, candidates, mode=request.retrieval_mode, lexical_candidates=request.lexical_candidates, top_documents=request.top_documents)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not hits:
             raise HTTPException(status_code=404, detail="No embeddings found for this bot.")
 
-        # 3. Compute cosine similarity
-        chunk_texts = []
-        similarities = []
-        for row in res.data:
-            chunk_embedding = np.array(row["embedding"])
-            sim = np.dot(query_embedding, chunk_embedding) / (np.linalg.norm(query_embedding) * np.linalg.norm(chunk_embedding) + 1e-8)
-            similarities.append(sim)
-            chunk_texts.append(row["chunk_text"])
-
-        # 4. Select top-k most similar chunks
-        top_k = min(request.top_k, len(similarities))
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
-        context_chunks = [chunk_texts[i] for i in top_indices]
-        context = "\n".join(context_chunks)
-
-        # 5. Send context and user query to Gemini
-        prompt = f"Context:\n{context}\n\nUser question: {request.user_query}\nAnswer:"
-        gemini = get_gemini_model()
-        response = gemini.generate_content(prompt)
+        # 3. Send context, conversation memory and user query to Gemini
+        session = None
+        if request.session_id:
+            try:
+                with stage("memory"):
+                    session = load_session(request.bot_id, request.session_id)
+            except Exception as e:
+                logger.error("Error loading conversation memory", extra={"bot_id": request.bot_id, "error": str(e)})
+        with stage("prompt"):
+            context_chunks, context_tokens = pack_context(hits, request.token_budget or CONTEXT_TOKEN_BUDGET)
+            prompt = build_prompt(context_chunks, request.user_query, memory_prompt(session))
+        with stage("llm"):
+            response = generate_text(prompt, bot_id=request.bot_id)
         answer = response.text if hasattr(response, 'text') else str(response)
+        prompt_tokens = prompt_token_count(response, prompt)
 
-        # 6. Store the conversation in chat_history table
-        try:
-            timestamp = datetime.utcnow().isoformat()
+        # 4. Store the conversation in chat_history table
+        with stage("history"):
+            try:
+                timestamp = datetime.utcnow().isoformat()
             
-            # Store user message
-            user_message = {
-                "bot_id": request.bot_id,
-                "role": "user",
-                "message": request.user_query,
-                "created_at": timestamp
-            }
-            supabase.table("chat_history").insert(user_message).execute()
+                # Store user message
+                user_message = {
+                    "bot_id": request.bot_id,
+                    "session_id": request.session_id,
+                    "role": "user",
+                    "message": request.user_query,
+                    "created_at": timestamp
+                }
+                supabase.table("chat_history").insert(user_message).execute()
             
-            # Store bot response
-            bot_message = {
-                "bot_id": request.bot_id,
-                "role": "bot",
-                "message": answer,
-                "created_at": timestamp
-            }
-            supabase.table("chat_history").insert(bot_message).execute()
-        except Exception as e:
-            print("Error storing chat history:", e)
-            # Don't fail the request if storing history fails
-            pass
+                # Store bot response
+                bot_message = {
+                    "bot_id": request.bot_id,
+                    "session_id": request.session_id,
+                    "role": "bot",
+                    "message": answer,
+                    "created_at": datetime.utcnow().isoformat()
+                }
+                supabase.table("chat_history").insert(bot_message).execute()
+            except Exception as e:
+                logger.error("Error storing chat history", extra={"bot_id": request.bot_id, "error": str(e)})
+                # Don't fail the request if storing history fails
+                pass
+            if session is not None:
+                try:
+                    record_turn(session, request.user_query, answer)
+                except Exception as e:
+                    logger.error("Error updating conversation memory", extra={"bot_id": request.bot_id, "error": str(e)})
 
         return {
             "answer": answer,
-            "context_chunks": context_chunks
+            "context_chunks": context_chunks,
+            "context_tokens": context_tokens,
+            "prompt_tokens": prompt_tokens,
+            "session_id": request.session_id
         }
         
+    except HTTPException:
+        raise
+    except GenerationError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/embed/widget.js")
-def get_widget_js():
-    """Serve the JavaScript widget for embedding"""
-    js_content = '''
-(function() {
-    'use strict';
-    
-    window.ChatbotWidget = {
-        init: function(config) {
-            const { token, containerId, apiUrl } = config;
-            const container = document.getElementById(containerId);
-            
-            if (!container) {
-                console.error('Chatbot widget container not found:', containerId);
-                return;
-            }
-            
-            // Create iframe
-            const iframe = document.createElement('iframe');
-            iframe.src = `${apiUrl}/embed/widget/${token}`;
-            iframe.style.width = '100%';
-            iframe.style.height = '600px';
-            iframe.style.border = 'none';
-            iframe.style.borderRadius = '10px';
-            iframe.style.boxShadow = '0 4px 12px rgba(0,0,0,0.15)';
-            
-            container.appendChild(iframe);
-        }
-    };
-})();
-'''
-    
-    return JSONResponse(
-        content=js_content,
-        media_type="application/javascript",
-        headers={
-            "Cache-Control": "public, max-age=3600",
-            "Content-Type": "application/javascript"
-        }
-    )
+def get_widget_js(request: Request):
+    """Serve the widget loader for snippets generated before the hashed URLs"""
+    path, media_type, encoding = resolve_source("loader.js", request.headers.get("accept-encoding", ""))
+    headers = {"Cache-Control": "public, max-age=3600", "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@router.get("/embed/static/{filename}")
+def get_widget_asset(filename: str, request: Request):
+    """Serve a content-hashed widget asset; its URL changes whenever its content does"""
+    asset = resolve_asset(filename, request.headers.get("accept-encoding", ""))
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    path, media_type, encoding = asset
+    headers = {"Cache-Control": f"public, max-age={ASSET_MAX_AGE}, immutable", "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(path, media_type=media_type, headers=headers)
 
 @router.get("/embed/tokens/{bot_id}")
 def list_embed_tokens(bot_id: str):
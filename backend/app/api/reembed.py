@@ -0,0 +1,45 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from app.services.supabase_service import supabase
+from app.services.gemini_service import EMBEDDING_MODEL_ID
+from app.services.embeddings import EMBEDDING_MODEL_ALLOWLIST, is_allowed_model
+from app.services.embedding_versions import get_active_model
+from app.services.reembed import start_reembed, get_job, ReembedError
+
+router = APIRouter()
+
+class ReembedRequest(BaseModel):
+    model_id: str = EMBEDDING_MODEL_ID  # Embedding model to migrate to; defaults to the server's configured model
+
+@router.post("/bots/{bot_id}/reembed")
+def reembed_bot(bot_id: str, request: ReembedRequest):
+    """Start re-embedding the bot's chunks into a shadow version; chat keeps using the current one until it is done"""
+    if not is_allowed_model(request.model_id):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Model {request.model_id} is not allowed; choose one of {', '.join(sorted(EMBEDDING_MODEL_ALLOWLIST))} (see EMBEDDING_MODEL_ALLOWLIST)",
+        )
+    bot_res = supabase.table("bots").select("id").eq("id", bot_id).execute()
+    if not bot_res.data:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    try:
+        job = start_reembed(bot_id, request.model_id)
+    except ReembedError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse(status_code=202, content=job)
+
+@router.get("/bots/{bot_id}/reembed")
+def reembed_progress(bot_id: str):
+    """Progress of the bot's latest re-embedding job and the model it is currently served from"""
+    try:
+        job = get_job(bot_id)
+        active_model = get_active_model(bot_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if job is None:
+        return {"bot_id": bot_id, "active_model": active_model, "status": None}
+    progress = job["done_chunks"] / job["total_chunks"] if job["total_chunks"] else 0.0
+    return {**job, "active_model": active_model, "progress": round(progress, 4)}
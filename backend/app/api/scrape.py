@@ -3,10 +3,15 @@ from pydantic import BaseModel
 from app.services.supabase_service import supabase
 from uuid import uuid4
 from datetime import datetime
-from bs4 import BeautifulSoup
 import requests
 from app.services.file_parser import chunk_text
-from app.services.gemini_service import get_text_embeddings  # Embeddings use HuggingFace bge-base-en
+from app.services.html_extractor import extract_text
+from app.services.gemini_service import get_text_embeddings, EMBEDDING_MODEL_ID  # Embeddings use HuggingFace bge-base-en
+from app.services.lexical_index import rebuild_bot_index, delete_bot_index
+from app.services.embedding_arena import invalidate_segment
+from app.services.embedding_versions import get_active_model
+from app.services.document_store import encode_content
+from app.services.document_centroids import store_document_centroids, delete_bot_centroids
 
 router = APIRouter()
 
@@ -15,6 +20,8 @@ class ScrapeRequest(BaseModel):
     bot_id: str = None
     bot_name: str = None
     replace_content: bool = False
+    main_content_only: bool = None  # Drop nav/footer/cookie banners; defaults to HTML_MAIN_CONTENT_ONLY
+    extractor: str = None  # "selectolax", "lxml" or "bs4"; defaults to HTML_EXTRACTOR
 
 def create_new_bot(name: str = None):
     bot_id = str(uuid4())
@@ -22,6 +29,7 @@ def create_new_bot(name: str = None):
     bot_data = {
         "id": bot_id,
         "name": name,
+        "embedding_model": EMBEDDING_MODEL_ID,
         "created_at": created_at
     }
     supabase.table("bots").insert(bot_data).execute()
@@ -34,6 +42,8 @@ def scrape_url(request: ScrapeRequest):
         bot_id = request.bot_id
         supabase.table("embeddings").delete().eq("bot_id", bot_id).execute()
         supabase.table("documents").delete().eq("bot_id", bot_id).execute()
+        delete_bot_index(bot_id)
+        delete_bot_centroids(bot_id)
     elif not request.bot_id:
         # Create a meaningful bot name from the URL if not provided
         bot_name = request.bot_name or f"Web Bot: {request.url}"
@@ -44,11 +54,8 @@ def scrape_url(request: ScrapeRequest):
     try:
         response = requests.get(request.url, timeout=10)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
         # Extract visible text from the page
-        for script in soup(["script", "style", "noscript"]):
-            script.extract()
-        text = " ".join(soup.stripped_strings)
+        text = extract_text(response.text, backend=request.extractor, main_content=request.main_content_only)
         if not text.strip():
             raise ValueError("No text content found on the page.")
     except Exception as e:
@@ -60,14 +67,15 @@ def scrape_url(request: ScrapeRequest):
         "bot_id": bot_id,
         "name": request.url,
         "type": "url",
-        "content": text,
+        **encode_content(text),  # Stored compressed; read it back through document_store
         "created_at": created_at
     }
     try:
         supabase.table("documents").insert(data).execute()
         # Chunk and embed text, store in embeddings table
         chunks = chunk_text(text)
-        embeddings = get_text_embeddings(chunks)
+        model_id = get_active_model(bot_id)
+        embeddings = get_text_embeddings(chunks, model_id=model_id)
         for idx, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
             embedding_data = {
                 "id": str(uuid4()),
@@ -76,9 +84,15 @@ def scrape_url(request: ScrapeRequest):
                 "chunk_index": idx,
                 "chunk_text": chunk,
                 "embedding": embedding,
+                "model_id": model_id,
                 "created_at": created_at
             }
             supabase.table("embeddings").insert(embedding_data).execute()
+        # Document centroids let hierarchical retrieval skip documents unrelated to a query
+        store_document_centroids(bot_id, doc_id, model_id, embeddings)
+        # Rebuild the bot's BM25 index so hybrid retrieval sees the new chunks
+        rebuild_bot_index(bot_id)
+        invalidate_segment(bot_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     return {"id": doc_id, "name": request.url, "type": "url", "created_at": created_at, "bot_id": bot_id} 
\ No newline at end of file
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import Response
+from pydantic import BaseModel
+from app.services.snapshot import export_bot, load_snapshot, import_snapshot, clone_bot, SnapshotError
+
+router = APIRouter()
+
+class CloneBotRequest(BaseModel):
+    name: str = None
+
+@router.get("/bots/{bot_id}/export")
+def export_bot_snapshot(bot_id: str):
+    """Download the bot's documents, chunks and embeddings as a compressed NPZ snapshot"""
+    try:
+        data = export_bot(bot_id)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return Response(
+        content=data,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="bot-{bot_id}.npz"'}
+    )
+
+@router.post("/bots/import")
+def import_bot_snapshot(file: UploadFile = File(...), bot_name: str = Form(None)):
+    """Create a new bot from a snapshot without re-embedding its content"""
+    try:
+        snapshot = load_snapshot(file.file.read())
+    except SnapshotError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        return import_snapshot(snapshot, bot_name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/bots/{bot_id}/clone")
+def clone_bot_snapshot(bot_id: str, request: CloneBotRequest):
+    """Copy a bot, including its embeddings, into a new bot"""
+    try:
+        return clone_bot(bot_id, request.name)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except SnapshotError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -2,7 +2,12 @@ from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from fastapi.responses import JSONResponse
 from app.services.supabase_service import supabase
 from app.services.file_parser import extract_text_from_pdf, extract_text_from_docx, extract_text_from_txt, chunk_text
-from app.services.gemini_service import get_text_embeddings  # Embeddings use HuggingFace bge-base-en
+from app.services.gemini_service import get_text_embeddings, EMBEDDING_MODEL_ID  # Embeddings use HuggingFace bge-base-en
+from app.services.lexical_index import rebuild_bot_index, delete_bot_index
+from app.services.embedding_arena import invalidate_segment
+from app.services.embedding_versions import get_active_model
+from app.services.document_store import encode_content
+from app.services.document_centroids import store_document_centroids, delete_bot_centroids
 from uuid import uuid4
 from datetime import datetime
 
@@ -14,6 +19,7 @@ def create_new_bot(name: str = None):
     bot_data = {
         "id": bot_id,
         "name": name,
+        "embedding_model": EMBEDDING_MODEL_ID,
         "created_at": created_at
     }
     supabase.table("bots").insert(bot_data).execute()
@@ -25,6 +31,8 @@ def upload_document(file: UploadFile = File(...), bot_id: str = Form(None), bot_
         # Clear existing content for this bot
         supabase.table("embeddings").delete().eq("bot_id", bot_id).execute()
         supabase.table("documents").delete().eq("bot_id", bot_id).execute()
+        delete_bot_index(bot_id)
+        delete_bot_centroids(bot_id)
     elif not bot_id:
         # Create a meaningful bot name from the filename if not provided
         if not bot_name:
@@ -52,14 +60,15 @@ def upload_document(file: UploadFile = File(...), bot_id: str = Form(None), bot_
         "bot_id": bot_id,
         "name": filename,
         "type": ext,
-        "content": text,
+        **encode_content(text),  # Stored compressed; read it back through document_store
         "created_at": created_at
     }
     try:
         supabase.table("documents").insert(data).execute()
         # Chunk and embed text, store in embeddings table
         chunks = chunk_text(text)
-        embeddings = get_text_embeddings(chunks)
+        model_id = get_active_model(bot_id)
+        embeddings = get_text_embeddings(chunks, model_id=model_id)
         for idx, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
             embedding_data = {
                 "id": str(uuid4()),
@@ -68,9 +77,15 @@ def upload_document(file: UploadFile = File(...), bot_id: str = Form(None), bot_
                 "chunk_index": idx,
                 "chunk_text": chunk,
                 "embedding": embedding,
+                "model_id": model_id,
                 "created_at": created_at
             }
             supabase.table("embeddings").insert(embedding_data).execute()
+        # Document centroids let hierarchical retrieval skip documents unrelated to a query
+        store_document_centroids(bot_id, doc_id, model_id, embeddings)
+        # Rebuild the bot's BM25 index so hybrid retrieval sees the new chunks
+        rebuild_bot_index(bot_id)
+        invalidate_segment(bot_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     return JSONResponse(content={"id": doc_id, "name": filename, "type": ext, "created_at": created_at, "bot_id": bot_id}) 
\ No newline at end of file
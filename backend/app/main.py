@@ -1,10 +1,16 @@
-from fastapi import FastAPI
+import time
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from app.api.bots import router as bots_router
 from app.api.upload import router as upload_router
 from app.api.scrape import router as scrape_router
 from app.api.chat import router as chat_router
 from app.api.embed import router as embed_router
+from app.api.snapshots import router as snapshots_router
+from app.api.reembed import router as reembed_router
+from app.api.documents import router as documents_router
+from app.services.metrics import start_request, observe_request, server_timing_header, render_metrics
 
 app = FastAPI()
 
@@ -15,14 +21,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
 )
 
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """Export per-stage timings as a Server-Timing header and Prometheus histograms"""
+    timings = start_request()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    response.headers["Timing-Allow-Origin"] = "*"
+    # Label by route template so /embed/widget/{embed_token} is one series, not one per token
+    route = request.scope.get("route")
+    endpoint = getattr(route, "path", "unmatched")
+    observe_request(endpoint, request.method, response.status_code, elapsed, timings)
+    return response
+
 app.include_router(bots_router)
 app.include_router(upload_router)
 app.include_router(scrape_router)
 app.include_router(chat_router)
 app.include_router(embed_router)
+app.include_router(snapshots_router)
+app.include_router(reembed_router)
+app.include_router(documents_router)
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok"} 
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type) 
\ No newline at end of file
@@ -0,0 +1,199 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from app.services.rate_limit import TokenBucket
+from app.services.metrics import ADMISSION_REJECTED, record_stage
+
+# Requests per second and burst allowed per embed token, and per client IP, on /embed/chat (0 disables a limit)
+EMBED_TOKEN_RATE = float(os.getenv("EMBED_TOKEN_RATE", "1"))
+EMBED_TOKEN_BURST = float(os.getenv("EMBED_TOKEN_BURST", "10"))
+EMBED_IP_RATE = float(os.getenv("EMBED_IP_RATE", "0.5"))
+EMBED_IP_BURST = float(os.getenv("EMBED_IP_BURST", "5"))
+# Take the client IP from X-Forwarded-For; only enable behind a proxy that sets it
+ADMISSION_TRUST_PROXY = os.getenv("ADMISSION_TRUST_PROXY", "false").lower() == "true"
+# Most tokens/IPs whose buckets are kept; the least recently seen are dropped first
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", "10000"))
+
+# Chat requests running at once in this worker, and how many of those slots only /chat may use
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))
+ADMISSION_RESERVED_FOR_CHAT = int(os.getenv("ADMISSION_RESERVED_FOR_CHAT", "8"))
+# Waiting requests beyond which new ones are shed with 429 instead of queued
+EMBED_MAX_QUEUE = int(os.getenv("EMBED_MAX_QUEUE", "32"))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "128"))
+# Seconds a request may wait for a slot before it is shed
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+
+# Lower value is served first
+PRIORITY_CHAT = 0
+PRIORITY_EMBED = 1
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class KeyedBuckets:
+    """One token bucket per key (embed token, client IP), bounded to the most recently seen keys."""
+
+    def __init__(self, capacity: float, rate: float, max_keys: int = ADMISSION_MAX_KEYS):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def acquire(self, key: str) -> float:
+        """Take one token for key; returns 0 if allowed, otherwise the seconds until a token is available."""
+        if self.rate <= 0:
+            return 0.0
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.capacity, self.rate)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return 0.0 if bucket.try_acquire() else bucket.wait_time()
+
+
+class AdmissionController:
+    """
+    Caps the requests in flight in this worker. Requests that cannot start wait in a queue per priority;
+    waiting /chat requests always start before waiting /embed/chat ones, and /embed/chat can never
+    use the slots reserved for /chat. When a queue is already too deep new requests are shed at once.
+    Runs on the event loop, so queued requests hold no threadpool thread.
+    """
+
+    def __init__(self, max_in_flight: int, reserved_for_chat: int, max_queue: dict, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.limits = {PRIORITY_CHAT: max_in_flight, PRIORITY_EMBED: max(1, max_in_flight - reserved_for_chat)}
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = {PRIORITY_CHAT: deque(), PRIORITY_EMBED: deque()}
+        # Moving average of how long an admitted request runs, used for Retry-After
+        self._service_seconds = 1.0
+
+    def queue_depth(self, priority: int = None) -> int:
+        if priority is None:
+            return sum(len(waiters) for waiters in self._waiters.values())
+        return len(self._waiters[priority])
+
+    def retry_after(self) -> int:
+        """Rough seconds until the current queue has drained."""
+        return max(1, math.ceil((self.queue_depth() + 1) * self._service_seconds / self.max_in_flight))
+
+    def _ahead_of(self, priority: int) -> bool:
+        return any(self._waiters[p] for p in self._waiters if p <= priority)
+
+    def _wake(self):
+        for priority in sorted(self._waiters):
+            waiters = self._waiters[priority]
+            while waiters and self.in_flight < self.limits[priority]:
+                future = waiters.popleft()
+                if not future.done():
+                    self.in_flight += 1
+                    future.set_result(True)
+
+    async def acquire(self, priority: int):
+        if not self._ahead_of(priority) and self.in_flight < self.limits[priority]:
+            self.in_flight += 1
+            return
+        if len(self._waiters[priority]) >= self.max_queue[priority]:
+            raise AdmissionRejected("overloaded", self.retry_after())
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(future)
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as the wait ended; hand it on
+                self.release()
+            elif future in self._waiters[priority]:
+                self._waiters[priority].remove(future)
+            if isinstance(e, asyncio.TimeoutError):
+                raise AdmissionRejected("queue_timeout", self.retry_after())
+            raise
+
+    def release(self, seconds: Optional[float] = None):
+        self.in_flight -= 1
+        if seconds is not None:
+            self._service_seconds = 0.9 * self._service_seconds + 0.1 * seconds
+        self._wake()
+
+
+controller = AdmissionController(
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_RESERVED_FOR_CHAT,
+    {PRIORITY_CHAT: CHAT_MAX_QUEUE, PRIORITY_EMBED: EMBED_MAX_QUEUE},
+    ADMISSION_QUEUE_TIMEOUT,
+)
+token_buckets = KeyedBuckets(EMBED_TOKEN_BURST, EMBED_TOKEN_RATE)
+ip_buckets = KeyedBuckets(EMBED_IP_BURST, EMBED_IP_RATE)
+
+
+def client_ip(request: Request) -> str:
+    if ADMISSION_TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def _reject(endpoint: str, reason: str, retry_after: float):
+    ADMISSION_REJECTED.labels(endpoint, reason).inc()
+    raise HTTPException(
+        status_code=429,
+        detail="Too many requests, please retry later.",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+async def _acquire(endpoint: str, priority: int) -> float:
+    """Wait for a slot, recording the wait as the "queue" stage; returns when the request started."""
+    queued_at = time.perf_counter()
+    try:
+        await controller.acquire(priority)
+    except AdmissionRejected as e:
+        _reject(endpoint, e.reason, e.retry_after)
+    started_at = time.perf_counter()
+    record_stage("queue", started_at - queued_at)
+    return started_at
+
+
+async def admit_chat():
+    """Dependency for /chat: high priority, no per-caller limits."""
+    started_at = await _acquire("/chat", PRIORITY_CHAT)
+    try:
+        yield
+    finally:
+        controller.release(time.perf_counter() - started_at)
+
+
+async def admit_embed_chat(request: Request):
+    """Dependency for /embed/chat: per-IP and per-embed-token rate limits, then a low-priority slot."""
+    wait = ip_buckets.acquire(client_ip(request))
+    if wait:
+        _reject("/embed/chat", "ip_rate", wait)
+    try:
+        body = await request.json()
+        embed_token = body.get("embed_token") if isinstance(body, dict) else None
+    except ValueError:
+        embed_token = None
+    if embed_token:
+        wait = token_buckets.acquire(str(embed_token))
+        if wait:
+            _reject("/embed/chat", "token_rate", wait)
+    started_at = await _acquire("/embed/chat", PRIORITY_EMBED)
+    try:
+        yield
+    finally:
+        controller.release(time.perf_counter() - started_at)
@@ -0,0 +1,107 @@
+import math
+import os
+from typing import List, Tuple
+
+# Default number of prompt tokens spent on retrieved context
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Largest token_budget and top_k a chat request may ask for
+MAX_CONTEXT_TOKEN_BUDGET = int(os.getenv("MAX_CONTEXT_TOKEN_BUDGET", "8000"))
+MAX_TOP_K = int(os.getenv("MAX_TOP_K", "20"))
+# How many chunks are retrieved when a request asks for a token budget instead of a fixed top_k
+PACK_CANDIDATE_POOL = int(os.getenv("PACK_CANDIDATE_POOL", "20"))
+# Rough characters-per-token ratio for English text with Gemini's tokenizer
+CHARS_PER_TOKEN = 4
+# chunk_text overlaps neighbours by 50 characters; look a little further in case that setting changes
+MAX_OVERLAP_CHARS = 200
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def strip_overlap(previous: str, current: str, max_overlap: int = MAX_OVERLAP_CHARS) -> str:
+    """Drop the prefix of current that repeats the end of previous."""
+    for size in range(min(len(previous), len(current), max_overlap), 0, -1):
+        if previous.endswith(current[:size]):
+            return current[size:]
+    return current
+
+
+def truncate_tokens(text: str, tokens: int) -> str:
+    return text[: tokens * CHARS_PER_TOKEN]
+
+
+def pack_context(hits: List[dict], token_budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[List[str], int]:
+    """
+    Fill token_budget with hits in score order and return (passages, context_tokens).
+    Adjacent chunks of the same document are merged into one passage with their overlap removed,
+    and exact duplicate chunks are skipped. Passages are ordered by their best hit.
+    """
+    if token_budget <= 0:
+        return [], 0
+    selected = {}  # (document_id, chunk_index) or hit id -> (rank, text)
+    seen_texts = set()
+    used = 0
+    for rank, hit in enumerate(hits):
+        text = hit["chunk_text"]
+        if text in seen_texts:
+            continue
+        document_id, chunk_index = hit.get("document_id"), hit.get("chunk_index")
+        adjacent = document_id is not None and chunk_index is not None
+        key = (document_id, chunk_index) if adjacent else hit.get("id", rank)
+        # Only the part not already covered by a selected neighbour costs tokens
+        novel = text
+        if adjacent and (document_id, chunk_index - 1) in selected:
+            novel = strip_overlap(selected[(document_id, chunk_index - 1)][1], novel)
+        if adjacent and (document_id, chunk_index + 1) in selected:
+            following = selected[(document_id, chunk_index + 1)][1]
+            overlap = len(following) - len(strip_overlap(text, following))
+            novel = novel[: max(0, len(novel) - overlap)]
+        cost = estimate_tokens(novel)
+        if used + cost > token_budget:
+            if selected:
+                continue
+            # Always send at least part of the best chunk
+            text = truncate_tokens(text, token_budget)
+            cost = estimate_tokens(text)
+        selected[key] = (rank, text)
+        seen_texts.add(text)
+        used += cost
+
+    passages = []  # (best_rank, text)
+    current_key, current_rank, current_text = None, None, None
+    for key in sorted(selected, key=lambda k: (str(k[0]), k[1]) if isinstance(k, tuple) else (str(k), -1)):
+        rank, text = selected[key]
+        if (
+            current_key is not None
+            and isinstance(key, tuple)
+            and isinstance(current_key, tuple)
+            and key[0] == current_key[0]
+            and key[1] == current_key[1] + 1
+        ):
+            current_text += strip_overlap(current_text, text)
+            current_rank = min(current_rank, rank)
+        else:
+            if current_key is not None:
+                passages.append((current_rank, current_text))
+            current_rank, current_text = rank, text
+        current_key = key
+    if current_key is not None:
+        passages.append((current_rank, current_text))
+    passages.sort(key=lambda passage: passage[0])
+    texts = [text for _, text in passages]
+    return texts, sum(estimate_tokens(text) for text in texts)
+
+
+def build_prompt(passages: List[str], user_query: str, memory: str = "") -> str:
+    """Prompt with the retrieved passages and, for a conversation, its summary and recent turns."""
+    context = "\n".join(passages)
+    prompt = f"Context:\n{context}\n\nUser question: {user_query}\nAnswer:"
+    return f"{memory}\n\n{prompt}" if memory else prompt
+
+
+def prompt_token_count(response, prompt: str) -> int:
+    """Prompt tokens reported by Gemini, or an estimate when the response carries no usage metadata."""
+    usage = getattr(response, "usage_metadata", None)
+    count = getattr(usage, "prompt_token_count", None) if usage is not None else None
+    return int(count) if count else estimate_tokens(prompt)
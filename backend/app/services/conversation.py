@@ -0,0 +1,159 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+
+from app.services.supabase_service import supabase
+from app.services.context_packer import truncate_tokens
+from app.services.generation_client import generate_text
+from app.services.log import get_logger
+
+# Most recent turns (question + answer) kept verbatim in the prompt
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "3"))
+# Older turns are folded into the rolling summary in groups of this many, so it is not rewritten every turn
+MEMORY_SUMMARY_EVERY = int(os.getenv("MEMORY_SUMMARY_EVERY", "2"))
+# Token caps for the summary and for each verbatim message in the prompt
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "250"))
+MEMORY_MESSAGE_TOKENS = int(os.getenv("MEMORY_MESSAGE_TOKENS", "200"))
+# Summaries being written at once; they run after the answer has been returned
+MEMORY_SUMMARY_WORKERS = int(os.getenv("MEMORY_SUMMARY_WORKERS", "2"))
+# Times a session write is retried after losing a race with another write to the same session
+_WRITE_ATTEMPTS = 5
+_SESSION_COLUMNS = ("bot_id", "session_id", "summary", "summarized_turns", "turns")
+
+logger = get_logger("conversation")
+
+_summary_executor = ThreadPoolExecutor(max_workers=MEMORY_SUMMARY_WORKERS, thread_name_prefix="summary")
+# Sessions with a summary update in progress in this worker
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+
+def load_session(bot_id: str, session_id: str) -> dict:
+    """
+    Memory of one conversation: the rolling summary of everything older than the unsummarized turns,
+    and those turns as [{"user": ..., "bot": ...}]. A new session starts empty, with no version.
+    """
+    res = supabase.table("chat_sessions").select("*").eq("bot_id", bot_id).eq("session_id", session_id).execute()
+    if res.data:
+        session = res.data[0]
+        session["turns"] = session.get("turns") or []
+        return session
+    return {"bot_id": bot_id, "session_id": session_id, "summary": "", "summarized_turns": 0, "turns": [], "version": None}
+
+
+def _write_session(session: dict) -> bool:
+    """
+    Store session unless the row changed since it was read (its version moved on); returns False
+    when it did, and the caller re-reads and tries again. On success session gets the new version.
+    """
+    row = {column: session[column] for column in _SESSION_COLUMNS}
+    row["updated_at"] = datetime.utcnow().isoformat()
+    version = session.get("version")
+    if version is None:
+        row["version"] = 0
+        try:
+            supabase.table("chat_sessions").insert(row).execute()
+        except Exception:
+            # A concurrent request created the session first; anything else is a real error
+            if load_session(session["bot_id"], session["session_id"])["version"] is None:
+                raise
+            return False
+    else:
+        row["version"] = version + 1
+        res = (
+            supabase.table("chat_sessions")
+            .update(row)
+            .eq("bot_id", session["bot_id"])
+            .eq("session_id", session["session_id"])
+            .eq("version", version)
+            .execute()
+        )
+        if not res.data:
+            return False
+    session.update(row)
+    return True
+
+
+def memory_prompt(session: Optional[dict]) -> str:
+    """Prompt section with the summary and the last MEMORY_RECENT_TURNS turns; bounded however long the session is."""
+    if not session:
+        return ""
+    parts = []
+    if session.get("summary"):
+        parts.append(f"Conversation summary:\n{truncate_tokens(session['summary'], MEMORY_SUMMARY_TOKENS)}")
+    recent = session["turns"][-MEMORY_RECENT_TURNS:] if MEMORY_RECENT_TURNS > 0 else []
+    if recent:
+        lines = []
+        for turn in recent:
+            lines.append(f"User: {truncate_tokens(turn['user'], MEMORY_MESSAGE_TOKENS)}")
+            lines.append(f"Assistant: {truncate_tokens(turn['bot'], MEMORY_MESSAGE_TOKENS)}")
+        parts.append("Recent conversation:\n" + "\n".join(lines))
+    return "\n\n".join(parts)
+
+
+def _summary_prompt(summary: str, turns: List[dict]) -> str:
+    lines = "\n".join(f"User: {turn['user']}\nAssistant: {turn['bot']}" for turn in turns)
+    words = MEMORY_SUMMARY_TOKENS * 3 // 4
+    return (
+        f"Current summary of a support conversation:\n{summary or '(empty)'}\n\n"
+        f"Newer messages:\n{lines}\n\n"
+        f"Rewrite the summary so it also covers the newer messages. Keep names, numbers, products and open "
+        f"questions the user mentioned. At most {words} words. Summary:"
+    )
+
+
+def _fold_turns(bot_id: str, session_id: str):
+    """Fold the turns that fell out of the verbatim window into the summary with one Gemini call."""
+    try:
+        session = load_session(bot_id, session_id)
+        folded = len(session["turns"]) - MEMORY_RECENT_TURNS
+        if folded <= 0:
+            return
+        before, folded_turns = session["summarized_turns"], session["turns"][:folded]
+        response = generate_text(_summary_prompt(session["summary"], folded_turns), bot_id=bot_id)
+        summary = truncate_tokens((response.text if hasattr(response, "text") else str(response)).strip(), MEMORY_SUMMARY_TOKENS)
+        for _ in range(_WRITE_ATTEMPTS):
+            # Turns answered while the summary was written are appended to the row; keep them. If the
+            # folded turns are gone, another summary already covered them and this one is dropped.
+            latest = load_session(bot_id, session_id)
+            if latest["summarized_turns"] != before or latest["turns"][:folded] != folded_turns:
+                return
+            latest["summary"] = summary
+            latest["summarized_turns"] = before + folded
+            latest["turns"] = latest["turns"][folded:]
+            if _write_session(latest):
+                return
+        logger.warning("Conversation summary dropped after conflicting writes", extra={"bot_id": bot_id, "session_id": session_id})
+    except Exception as e:
+        logger.error("Error updating conversation summary", extra={"bot_id": bot_id, "session_id": session_id, "error": str(e)})
+    finally:
+        with _summarizing_lock:
+            _summarizing.discard((bot_id, session_id))
+
+
+def record_turn(session: dict, user_query: str, answer: str):
+    """
+    Append a turn to the session and, once enough turns have aged out, update the summary in the background.
+    If the row changed since session was loaded (a summary or another turn was written), the turn is
+    appended to the re-read row instead; session is updated to what was stored.
+    """
+    turn = {"user": user_query, "bot": answer}
+    for _ in range(_WRITE_ATTEMPTS):
+        updated = dict(session, turns=session["turns"] + [turn])
+        if _write_session(updated):
+            session.update(updated)
+            break
+        session.update(load_session(session["bot_id"], session["session_id"]))
+    else:
+        raise RuntimeError("Conversation turn not saved: the session kept changing")
+    if len(session["turns"]) - MEMORY_RECENT_TURNS < max(1, MEMORY_SUMMARY_EVERY):
+        return
+    key = (session["bot_id"], session["session_id"])
+    with _summarizing_lock:
+        if key in _summarizing:
+            return
+        _summarizing.add(key)
+    _summary_executor.submit(_fold_turns, *key)
+
@@ -0,0 +1,243 @@
+"""
+Read path to Supabase for hot, repeated lookups.
+
+Queries go straight to PostgREST over a pooled keep-alive httpx.AsyncClient that runs on a private
+event loop thread, so sync endpoints in the threadpool and async code share one connection pool.
+On top of that:
+  - single flight: concurrent identical reads share one query in flight; nothing is cached after
+    it returns, so results are never staler than a direct query
+  - batching: get_one/get_many lookups by a column that arrive within DATA_BATCH_WAIT_MS are sent
+    as one column=in.(...) query and the rows handed back to each caller
+  - paging: select without a limit reads PAGE_SIZE rows at a time until a short page, since
+    PostgREST never returns more than its max-rows setting in one response
+Every query is timed in botverse_db_query_seconds. Writes keep using supabase_service.supabase.
+
+Results are shared between callers and must not be modified.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from app.services.supabase_service import SUPABASE_URL, SUPABASE_KEY, PAGE_SIZE
+from app.services.metrics import DB_QUERY_SECONDS, DB_READS_SHARED
+
+# Connections kept open to PostgREST per worker
+DATA_ACCESS_POOL_SIZE = int(os.getenv("DATA_ACCESS_POOL_SIZE", "20"))
+# Seconds allowed per query, including time spent waiting for a pooled connection
+DATA_ACCESS_TIMEOUT = float(os.getenv("DATA_ACCESS_TIMEOUT", "10"))
+# How long a lookup waits for others to join its in_() query, and the most values per query
+DATA_BATCH_WAIT_MS = float(os.getenv("DATA_BATCH_WAIT_MS", "2"))
+DATA_BATCH_MAX = int(os.getenv("DATA_BATCH_MAX", "100"))
+
+
+class DataAccessError(RuntimeError):
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _literal(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _quote(value) -> str:
+    # Values inside in.(...) are double-quoted so commas and parentheses in them are taken literally
+    text = _literal(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def _params(columns: str, filters: Tuple[tuple, ...], order: Optional[str], limit: Optional[int], offset: int = 0) -> List[tuple]:
+    params = [("select", columns)]
+    params.extend((column, f"eq.{_literal(value)}") for column, value in filters)
+    if order:
+        params.append(("order", order))
+    if limit is not None:
+        params.append(("limit", str(limit)))
+    if offset:
+        params.append(("offset", str(offset)))
+    return params
+
+
+class _Batch:
+    def __init__(self):
+        self.waiters: Dict[str, List[asyncio.Future]] = {}
+
+
+class DataAccess:
+    """Pooled async PostgREST reads with single-flight coalescing and in_() batching; see the module docstring."""
+
+    def __init__(self, url: str, key: str, transport: httpx.AsyncBaseTransport = None):
+        self.base_url = f"{url.rstrip('/')}/rest/v1/"
+        self.headers = {"apikey": key, "Authorization": f"Bearer {key}", "Accept": "application/json"}
+        self.transport = transport
+        self._loop = None
+        self._client = None
+        self._started = threading.Lock()
+        # Owned by the private loop, so no locking: query key -> shared future, batch key -> open batch
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+        self._batches: Dict[tuple, _Batch] = {}
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        # Started on first use rather than at import, so every uvicorn worker gets its own after forking
+        with self._started:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="data-access", daemon=True).start()
+                limits = httpx.Limits(max_connections=DATA_ACCESS_POOL_SIZE, max_keepalive_connections=DATA_ACCESS_POOL_SIZE, keepalive_expiry=30)
+                self._client = httpx.AsyncClient(base_url=self.base_url, headers=self.headers, limits=limits, timeout=DATA_ACCESS_TIMEOUT, transport=self.transport)
+                self._loop = loop
+        return self._loop
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()).result(timeout=DATA_ACCESS_TIMEOUT * 2)
+
+    async def _await(self, coroutine):
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()))
+
+    async def _query(self, table: str, params: List[tuple], kind: str) -> list:
+        start = time.perf_counter()
+        try:
+            response = await self._client.get(table, params=params)
+        finally:
+            DB_QUERY_SECONDS.labels(table, kind).observe(time.perf_counter() - start)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("message") or response.text
+            except ValueError:
+                message = response.text
+            raise DataAccessError(f"{table}: {message}", response.status_code)
+        # Large results (a bot's embeddings) are decoded off the loop so other queries keep moving
+        if len(response.content) > 64 * 1024:
+            return await asyncio.get_running_loop().run_in_executor(None, json.loads, response.content)
+        return response.json()
+
+    async def _paged(self, table: str, columns: str, filters: Tuple[tuple, ...], order: str) -> list:
+        rows = []
+        while True:
+            page = await self._query(table, _params(columns, filters, order, PAGE_SIZE, len(rows)), "select")
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+
+    async def _shared(self, key: tuple, table: str, kind: str, run) -> list:
+        """Await run() (a coroutine function), or join a call with the same key already in flight."""
+        future = self._in_flight.get(key)
+        if future is not None:
+            DB_READS_SHARED.labels(table, kind).inc()
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            rows = await run()
+            future.set_result(rows)
+            return rows
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved in case nobody joined
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def _select(self, table: str, columns: str, filters: Dict[str, object], order: str, limit: int) -> list:
+        filters = tuple(sorted((filters or {}).items()))
+        key = ("select", table, columns, filters, order, limit)
+        if limit is None:
+            # Pages must come from one stable order, or rows could be skipped or repeated between them
+            return await self._shared(key, table, "select", lambda: self._paged(table, columns, filters, order or "id"))
+        return await self._shared(key, table, "select", lambda: self._query(table, _params(columns, filters, order, limit), "select"))
+
+    async def _flush(self, batch_key: tuple, batch: _Batch):
+        await asyncio.sleep(DATA_BATCH_WAIT_MS / 1000.0)
+        if self._batches.get(batch_key) is batch:
+            del self._batches[batch_key]
+        table, column, columns, filters = batch_key
+        values = list(batch.waiters)
+        params = _params(columns, filters, None, None)
+        params.append((column, f"in.({','.join(_quote(value) for value in values)})"))
+        try:
+            rows = await self._shared(("batch", table, columns, filters, column, tuple(values)), table, "batch", lambda: self._query(table, params, "batch"))
+        except Exception as e:
+            for futures in batch.waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        grouped = {}
+        for row in rows:
+            grouped.setdefault(_literal(row.get(column)), []).append(row)
+        for value, futures in batch.waiters.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(grouped.get(value, []))
+
+    async def _get_many(self, table: str, column: str, value, columns: str, filters: Dict[str, object]) -> list:
+        batch_key = (table, column, columns, tuple(sorted((filters or {}).items())))
+        batch = self._batches.get(batch_key)
+        if batch is None or len(batch.waiters) >= DATA_BATCH_MAX:
+            batch = _Batch()
+            self._batches[batch_key] = batch
+            asyncio.get_running_loop().create_task(self._flush(batch_key, batch))
+        elif batch.waiters:
+            DB_READS_SHARED.labels(table, "batch").inc()
+        future = asyncio.get_running_loop().create_future()
+        batch.waiters.setdefault(_literal(value), []).append(future)
+        return await future
+
+    def select(self, table: str, columns: str = "*", filters: Dict[str, object] = None, order: str = None, limit: int = None) -> list:
+        """
+        Rows of table matching every column == value in filters; identical concurrent calls share one query.
+        Without a limit every matching row is returned, read a page at a time in order (by id unless given).
+        """
+        return self._run(self._select(table, columns, filters, order, limit))
+
+    def get_many(self, table: str, column: str, value, columns: str = "*", filters: Dict[str, object] = None) -> list:
+        """
+        Rows with column == value (and the other filters). Lookups for the same table, column, columns and
+        filters are collected for DATA_BATCH_WAIT_MS and answered by one in_() query; columns must include column.
+        """
+        return self._run(self._get_many(table, column, value, columns, filters))
+
+    def get_one(self, table: str, column: str, value, columns: str = "*", filters: Dict[str, object] = None) -> Optional[dict]:
+        rows = self.get_many(table, column, value, columns, filters)
+        return rows[0] if rows else None
+
+    # Awaitable versions for async code; the queries still run on the private loop
+
+    async def select_async(self, table: str, columns: str = "*", filters: Dict[str, object] = None, order: str = None, limit: int = None) -> list:
+        return await self._await(self._select(table, columns, filters, order, limit))
+
+    async def get_one_async(self, table: str, column: str, value, columns: str = "*", filters: Dict[str, object] = None) -> Optional[dict]:
+        rows = await self._await(self._get_many(table, column, value, columns, filters))
+        return rows[0] if rows else None
+
+
+_data_access = None
+_data_access_lock = threading.Lock()
+
+
+def get_data_access() -> DataAccess:
+    global _data_access
+    with _data_access_lock:
+        if _data_access is None:
+            _data_access = DataAccess(SUPABASE_URL, SUPABASE_KEY)
+        return _data_access
+
+
+def set_transport(transport: httpx.AsyncBaseTransport):
+    """Send all data-access queries through transport instead of the network, e.g. an in-process fake."""
+    global _data_access
+    with _data_access_lock:
+        _data_access = DataAccess(SUPABASE_URL, SUPABASE_KEY, transport)
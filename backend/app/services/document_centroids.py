@@ -0,0 +1,127 @@
+"""
+Document-level centroid vectors for hierarchical retrieval.
+
+Every document gets one L2-normalised centroid per CENTROID_CHUNKS_PER_CENTROID chunks (at most
+CENTROIDS_PER_DOCUMENT), so a long document covering several topics is represented by several
+vectors. They are stored in document_centroids per embedding model and written whenever chunks are
+embedded: on upload, scrape, snapshot import and re-embedding.
+
+To compute centroids for bots ingested before they existed, run from the backend directory:
+    python -m app.services.document_centroids [bot_id ...]
+"""
+import os
+import sys
+from datetime import datetime
+from typing import Dict, List
+from uuid import uuid4
+
+import numpy as np
+
+from app.services.supabase_service import supabase, fetch_all_rows
+from app.services.embedding_versions import get_active_model
+
+# One centroid per this many chunks of a document, capped at CENTROIDS_PER_DOCUMENT
+CENTROID_CHUNKS_PER_CENTROID = int(os.getenv("CENTROID_CHUNKS_PER_CENTROID", "32"))
+CENTROIDS_PER_DOCUMENT = int(os.getenv("CENTROIDS_PER_DOCUMENT", "4"))
+# Spherical k-means rounds when a document gets more than one centroid
+CENTROID_KMEANS_ITERATIONS = 10
+# Rows per insert when storing the centroids of a whole bot
+_INSERT_BATCH = 500
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-8)
+
+
+def compute_centroids(embeddings) -> np.ndarray:
+    """L2-normalised centroids of one document's chunk vectors, as a (centroids, dim) float32 array."""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if vectors.ndim != 2 or len(vectors) == 0:
+        return np.empty((0, vectors.shape[-1] if vectors.ndim == 2 else 0), dtype=np.float32)
+    vectors = _normalize_rows(vectors)
+    k = min(max(1, CENTROIDS_PER_DOCUMENT), -(-len(vectors) // max(1, CENTROID_CHUNKS_PER_CENTROID)))
+    if k == 1:
+        return _normalize_rows(vectors.sum(axis=0, keepdims=True))
+    # Seeds spread evenly through the document, so its sections start out in different clusters
+    centroids = vectors[np.linspace(0, len(vectors) - 1, k).astype(int)].copy()
+    for _ in range(CENTROID_KMEANS_ITERATIONS):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(k):
+            members = vectors[assignment == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids = _normalize_rows(centroids)
+    return centroids
+
+
+def _centroid_rows(bot_id: str, document_id: str, model_id: str, embeddings, created_at: str) -> List[dict]:
+    chunk_count = len(embeddings)
+    return [
+        {
+            "id": str(uuid4()),
+            "bot_id": bot_id,
+            "document_id": document_id,
+            "model_id": model_id,
+            "centroid_index": i,
+            "centroid": centroid.tolist(),
+            "chunk_count": chunk_count,
+            "created_at": created_at,
+        }
+        for i, centroid in enumerate(compute_centroids(embeddings))
+    ]
+
+
+def store_document_centroids(bot_id: str, document_id: str, model_id: str, embeddings):
+    """Replace one document's centroids for an embedding model, from the chunk vectors just embedded."""
+    rows = _centroid_rows(bot_id, document_id, model_id, embeddings, datetime.utcnow().isoformat())
+    supabase.table("document_centroids").delete().eq("document_id", document_id).eq("model_id", model_id).execute()
+    if rows:
+        supabase.table("document_centroids").insert(rows).execute()
+
+
+def store_bot_centroids(bot_id: str, model_id: str, embeddings_by_document: Dict[str, list]):
+    """Replace all of a bot's centroids for an embedding model, given each document's chunk vectors."""
+    created_at = datetime.utcnow().isoformat()
+    rows = []
+    for document_id, embeddings in embeddings_by_document.items():
+        rows.extend(_centroid_rows(bot_id, document_id, model_id, embeddings, created_at))
+    supabase.table("document_centroids").delete().eq("bot_id", bot_id).eq("model_id", model_id).execute()
+    for start in range(0, len(rows), _INSERT_BATCH):
+        supabase.table("document_centroids").insert(rows[start:start + _INSERT_BATCH]).execute()
+
+
+def rebuild_bot_centroids(bot_id: str, model_id: str = None) -> int:
+    """Recompute a bot's centroids from its stored embeddings; returns the number of documents."""
+    model_id = model_id or get_active_model(bot_id)
+    rows = fetch_all_rows(
+        lambda: supabase.table("embeddings").select("document_id,embedding").eq("bot_id", bot_id).eq("model_id", model_id).order("id")
+    )
+    embeddings_by_document = {}
+    for row in rows:
+        embeddings_by_document.setdefault(row["document_id"], []).append(row["embedding"])
+    store_bot_centroids(bot_id, model_id, embeddings_by_document)
+    return len(embeddings_by_document)
+
+
+def fetch_bot_centroids(bot_id: str, model_id: str) -> List[dict]:
+    return fetch_all_rows(
+        lambda: supabase.table("document_centroids")
+        .select("document_id,centroid_index,centroid,chunk_count")
+        .eq("bot_id", bot_id)
+        .eq("model_id", model_id)
+        .order("id")
+    )
+
+
+def delete_bot_centroids(bot_id: str):
+    supabase.table("document_centroids").delete().eq("bot_id", bot_id).execute()
+
+
+def delete_model_centroids(bot_id: str, model_id: str):
+    supabase.table("document_centroids").delete().eq("bot_id", bot_id).eq("model_id", model_id).execute()
+
+
+if __name__ == "__main__":
+    bot_ids = sys.argv[1:] or [bot["id"] for bot in fetch_all_rows(lambda: supabase.table("bots").select("id").order("id"))]
+    for bot_id in bot_ids:
+        print(f"{bot_id}: centroids for {rebuild_bot_centroids(bot_id)} documents")
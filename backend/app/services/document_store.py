@@ -0,0 +1,167 @@
+"""
+Compressed storage for document bodies.
+
+documents.content_blob holds the extracted text compressed with zstd (or gzip when the zstandard
+package is not installed), base64-encoded so it travels through PostgREST as plain JSON.
+content_encoding names the codec and content_size is the uncompressed size in bytes. Rows written
+before compression keep their text in documents.content with no encoding; the accessors read both.
+
+To compress those older rows, run from the backend directory:
+    python -m app.services.document_store
+"""
+import base64
+import gzip
+import os
+import zlib
+from typing import Dict, Iterator, List, Optional
+
+from app.services.supabase_service import supabase, fetch_all_rows
+
+# Columns for listing documents; the body is only loaded by the accessors below
+DOCUMENT_METADATA_COLUMNS = "id,bot_id,name,type,content_encoding,content_size,created_at"
+_BODY_COLUMNS = "id,name,content,content_blob,content_encoding,content_size"
+# Codec for new documents: "zstd", "gzip" or "auto" (zstd when installed)
+DOCUMENT_COMPRESSION = os.getenv("DOCUMENT_COMPRESSION", "auto").lower()
+ZSTD_LEVEL = int(os.getenv("DOCUMENT_ZSTD_LEVEL", "10"))
+GZIP_LEVEL = int(os.getenv("DOCUMENT_GZIP_LEVEL", "6"))
+# Bytes per piece when streaming a document body
+STREAM_CHUNK_SIZE = 64 * 1024
+# Documents loaded per query by get_document_contents
+_CONTENT_BATCH = 50
+
+
+def _zstd():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def resolve_encoding(encoding: str = None) -> str:
+    encoding = (encoding or DOCUMENT_COMPRESSION).lower()
+    if encoding == "auto":
+        return "zstd" if _zstd() is not None else "gzip"
+    if encoding not in ("zstd", "gzip"):
+        raise ValueError(f"Unknown document compression: {encoding}")
+    return encoding
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return _zstd().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encode_content(text: str, encoding: str = None) -> dict:
+    """Document columns for a body: the compressed blob, its codec and the original size."""
+    encoding = resolve_encoding(encoding)
+    data = (text or "").encode("utf-8")
+    return {
+        "content": None,
+        "content_blob": base64.b64encode(compress(data, encoding)).decode("ascii"),
+        "content_encoding": encoding,
+        "content_size": len(data),
+    }
+
+
+def _blob(row: dict) -> bytes:
+    return base64.b64decode(row["content_blob"]) if row.get("content_blob") else b""
+
+
+def decode_content(row: dict) -> str:
+    encoding = row.get("content_encoding")
+    if not encoding:
+        return row.get("content") or ""
+    blob = _blob(row)
+    if encoding == "zstd":
+        data = _zstd().ZstdDecompressor().decompress(blob) if blob else b""
+    elif encoding == "gzip":
+        data = gzip.decompress(blob) if blob else b""
+    else:
+        raise ValueError(f"Unknown document compression: {encoding}")
+    return data.decode("utf-8")
+
+
+def get_document(document_id: str) -> Optional[dict]:
+    """Document metadata without the body."""
+    res = supabase.table("documents").select(DOCUMENT_METADATA_COLUMNS).eq("id", document_id).execute()
+    return res.data[0] if res.data else None
+
+
+def list_documents(bot_id: str) -> List[dict]:
+    return fetch_all_rows(lambda: supabase.table("documents").select(DOCUMENT_METADATA_COLUMNS).eq("bot_id", bot_id).order("created_at"))
+
+
+def load_document_body(document_id: str) -> Optional[dict]:
+    """Row with the stored (still compressed) body, for streaming or passing through as-is."""
+    res = supabase.table("documents").select(_BODY_COLUMNS).eq("id", document_id).execute()
+    return res.data[0] if res.data else None
+
+
+def get_document_content(document_id: str) -> Optional[str]:
+    """Lazily load and decompress one document's text; None if the document does not exist."""
+    row = load_document_body(document_id)
+    return decode_content(row) if row else None
+
+
+def get_document_contents(document_ids: List[str]) -> Dict[str, str]:
+    """Load the text of several documents with a few batched queries, as {document_id: text}."""
+    contents = {}
+    for start in range(0, len(document_ids), _CONTENT_BATCH):
+        batch = document_ids[start:start + _CONTENT_BATCH]
+        res = supabase.table("documents").select(_BODY_COLUMNS).in_("id", batch).execute()
+        for row in res.data or []:
+            contents[row["id"]] = decode_content(row)
+    return contents
+
+
+def iter_document_content(row: dict, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Decompress a document body piece by piece as UTF-8 bytes, without materialising the whole text."""
+    encoding = row.get("content_encoding")
+    if not encoding:
+        data = (row.get("content") or "").encode("utf-8")
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+        return
+    blob = _blob(row)
+    if encoding == "zstd":
+        reader = _zstd().ZstdDecompressor().stream_reader(blob)
+        while True:
+            piece = reader.read(chunk_size)
+            if not piece:
+                return
+            yield piece
+    if encoding != "gzip":
+        raise ValueError(f"Unknown document compression: {encoding}")
+    # wbits=31 reads the gzip header and trailer
+    decompressor = zlib.decompressobj(wbits=31)
+    for start in range(0, len(blob), chunk_size):
+        piece = decompressor.decompress(blob[start:start + chunk_size])
+        if piece:
+            yield piece
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def raw_blob(row: dict) -> bytes:
+    """The compressed body exactly as stored, e.g. to send with a matching Content-Encoding."""
+    return _blob(row)
+
+
+def compress_legacy_documents(batch_size: int = 100) -> int:
+    """Move bodies still stored uncompressed in documents.content into content_blob; returns the count."""
+    migrated = 0
+    while True:
+        res = supabase.table("documents").select("id,content").is_("content_encoding", "null").limit(batch_size).execute()
+        rows = res.data or []
+        for row in rows:
+            supabase.table("documents").update(encode_content(row.get("content") or "")).eq("id", row["id"]).execute()
+        migrated += len(rows)
+        if len(rows) < batch_size:
+            return migrated
+
+
+if __name__ == "__main__":
+    print(f"Compressed {compress_legacy_documents()} documents")
@@ -0,0 +1,274 @@
+import fcntl
+import json
+import mmap
+import os
+import time
+from contextlib import contextmanager
+from hashlib import sha1
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.services.supabase_service import supabase, fetch_all_rows
+from app.services.embedding_versions import get_active_model
+from app.services.document_centroids import compute_centroids, fetch_bot_centroids
+
+# On-disk arena of per-bot embedding segments, memory-mapped read-only by every worker on the node
+EMBEDDING_ARENA_ENABLED = os.getenv("EMBEDDING_ARENA_ENABLED", "true").lower() == "true"
+EMBEDDING_ARENA_DIR = os.getenv("EMBEDDING_ARENA_DIR", os.path.join("data", "embedding_arena"))
+# Seconds between version checks against the embeddings table for a bot
+ARENA_VERSION_CHECK_INTERVAL = float(os.getenv("ARENA_VERSION_CHECK_INTERVAL", "30"))
+# Supabase returns at most this many rows per request, so segments are built page by page
+ARENA_FETCH_PAGE_SIZE = int(os.getenv("ARENA_FETCH_PAGE_SIZE", "1000"))
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "manifest.lock"
+
+
+class ArenaSegment:
+    """
+    Read-only view of one bot's embeddings.
+    vectors are L2-normalised float32 rows, so cosine similarity is a plain dot product.
+    """
+
+    def __init__(self, bot_id: str, version: str, prefix: str):
+        self.bot_id = bot_id
+        self.version = version
+        self.vectors = np.load(prefix + ".vectors.npy", mmap_mode="r")
+        self.text_offsets = np.load(prefix + ".offsets.npy", mmap_mode="r")
+        with open(prefix + ".texts.bin", "rb") as f:
+            self._texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        with open(prefix + ".meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.ids = meta["ids"]
+        self.document_ids = meta["document_ids"]
+        self.chunk_indexes = meta["chunk_indexes"]
+        self.model_id = meta.get("model_id")
+        # Rows are sorted by document, so each document is one contiguous range of rows.
+        # Segments written before centroids existed have neither; hierarchical retrieval then scans everything.
+        self.documents = meta.get("documents")
+        self.document_ranges = np.asarray(meta["document_ranges"], dtype=np.int64) if "document_ranges" in meta else None
+        self.centroid_owners = np.asarray(meta["centroid_owners"], dtype=np.int64) if "centroid_owners" in meta else None
+        self.centroids = np.load(prefix + ".centroids.npy", mmap_mode="r") if self.centroid_owners is not None else None
+        self._rows_by_id = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def chunk_text(self, row: int) -> str:
+        return self._texts[int(self.text_offsets[row]):int(self.text_offsets[row + 1])].decode("utf-8")
+
+    def row_of(self, chunk_id: str) -> Optional[int]:
+        if self._rows_by_id is None:
+            self._rows_by_id = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        return self._rows_by_id.get(chunk_id)
+
+    def hit(self, row: int, score: float) -> dict:
+        return {
+            "id": self.ids[row],
+            "document_id": self.document_ids[row],
+            "chunk_index": self.chunk_indexes[row],
+            "chunk_text": self.chunk_text(row),
+            "score": score,
+        }
+
+
+# Segments mapped by this process: bot_id -> ArenaSegment, and when each bot was last version-checked
+_segments: Dict[str, ArenaSegment] = {}
+_checked_at: Dict[str, float] = {}
+
+
+def _path(name: str) -> str:
+    return os.path.join(EMBEDDING_ARENA_DIR, name)
+
+
+@contextmanager
+def _manifest_lock():
+    os.makedirs(EMBEDDING_ARENA_DIR, exist_ok=True)
+    with open(_path(LOCK_NAME), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_manifest() -> dict:
+    try:
+        with open(_path(MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_atomic(path: str, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def fetch_version(bot_id: str) -> Optional[str]:
+    """
+    Cheap version token for a bot's active embeddings: model ID, row count and the newest row.
+    None if the bot has none. Switching the bot to another embedding version changes the token.
+    """
+    model_id = get_active_model(bot_id)
+    res = (
+        supabase.table("embeddings")
+        .select("id,created_at", count="exact")
+        .eq("bot_id", bot_id)
+        .eq("model_id", model_id)
+        .order("created_at", desc=True)
+        .limit(1)
+        .execute()
+    )
+    if not res.data:
+        return None
+    newest = res.data[0]
+    return sha1(f"{model_id}:{res.count}:{newest['created_at']}:{newest['id']}".encode()).hexdigest()[:16]
+
+
+def _fetch_rows(bot_id: str, model_id: str) -> list:
+    return fetch_all_rows(
+        lambda: supabase.table("embeddings")
+        .select("id,document_id,chunk_index,chunk_text,embedding")
+        .eq("bot_id", bot_id)
+        .eq("model_id", model_id)
+        .order("id"),
+        ARENA_FETCH_PAGE_SIZE,
+    )
+
+
+def _segment_centroids(bot_id: str, model_id: str, document_ids: list, vectors: np.ndarray):
+    """
+    Per-document row ranges, and the stored centroids with the index of the document each belongs to.
+    Documents whose centroids are not stored (yet) get them computed from their rows here.
+    """
+    documents, ranges = [], []
+    for row, document_id in enumerate(document_ids):
+        if not documents or documents[-1] != document_id:
+            documents.append(document_id)
+            ranges.append([row, row])
+        ranges[-1][1] = row + 1
+    position = {document_id: i for i, document_id in enumerate(documents)}
+    stored = {}
+    for centroid in sorted(fetch_bot_centroids(bot_id, model_id), key=lambda c: c["centroid_index"]):
+        if centroid["document_id"] in position:
+            stored.setdefault(centroid["document_id"], []).append(centroid["centroid"])
+    centroids, owners = [], []
+    for i, document_id in enumerate(documents):
+        start, end = ranges[i]
+        document_centroids = np.asarray(stored[document_id], dtype=np.float32) if document_id in stored else compute_centroids(vectors[start:end])
+        centroids.extend(document_centroids)
+        owners.extend([i] * len(document_centroids))
+    matrix = np.array(centroids, dtype=np.float32).reshape(len(centroids), vectors.shape[1])
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-8
+    return documents, ranges, owners, matrix
+
+
+def _build_segment(bot_id: str, version: str) -> Optional[str]:
+    """Write a new segment for the bot and return its file prefix (relative to the arena dir)."""
+    model_id = get_active_model(bot_id)
+    rows = _fetch_rows(bot_id, model_id)
+    if not rows:
+        return None
+    rows.sort(key=lambda row: (row.get("document_id") or "", row.get("chunk_index") or 0))
+    vectors = np.array([row["embedding"] for row in rows], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-8
+    encoded = [row["chunk_text"].encode("utf-8") for row in rows]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(text) for text in encoded])
+    document_ids = [row.get("document_id") for row in rows]
+    documents, ranges, owners, centroids = _segment_centroids(bot_id, model_id, document_ids, vectors)
+    meta = {
+        "ids": [row["id"] for row in rows],
+        "document_ids": document_ids,
+        "chunk_indexes": [row.get("chunk_index") for row in rows],
+        "model_id": model_id,
+        "documents": documents,
+        "document_ranges": ranges,
+        "centroid_owners": owners,
+    }
+    name = f"{bot_id}-{version}"
+    prefix = _path(name)
+    _write_atomic(prefix + ".vectors.npy", lambda f: np.save(f, vectors))
+    _write_atomic(prefix + ".offsets.npy", lambda f: np.save(f, offsets))
+    _write_atomic(prefix + ".centroids.npy", lambda f: np.save(f, centroids))
+    _write_atomic(prefix + ".texts.bin", lambda f: f.write(b"".join(encoded)))
+    _write_atomic(prefix + ".meta.json", lambda f: f.write(json.dumps(meta).encode("utf-8")))
+    return name
+
+
+def _remove_segment_files(name: str):
+    # Workers that still map the old files keep their pages until they remap; unlinking is safe on POSIX
+    for suffix in (".vectors.npy", ".offsets.npy", ".centroids.npy", ".texts.bin", ".meta.json"):
+        try:
+            os.remove(_path(name) + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def refresh_segment(bot_id: str, version: str) -> Optional[ArenaSegment]:
+    """Make sure the arena holds the given version of the bot, building it if no other worker has yet."""
+    with _manifest_lock():
+        manifest = read_manifest()
+        entry = manifest.get(bot_id)
+        if entry and entry["version"] == version and os.path.exists(_path(entry["segment"]) + ".meta.json"):
+            return ArenaSegment(bot_id, version, _path(entry["segment"]))
+        name = _build_segment(bot_id, version)
+        if name is None:
+            manifest.pop(bot_id, None)
+        else:
+            manifest[bot_id] = {"version": version, "segment": name, "updated_at": time.time()}
+        _write_atomic(_path(MANIFEST_NAME), lambda f: f.write(json.dumps(manifest, indent=1).encode("utf-8")))
+        if entry and entry["segment"] != name:
+            _remove_segment_files(entry["segment"])
+        return ArenaSegment(bot_id, version, _path(name)) if name else None
+
+
+def _map_segment(bot_id: str, version: str) -> Optional[ArenaSegment]:
+    # The manifest is read without the lock, so a build elsewhere cannot hold up this lookup; files it
+    # names may be unlinked before they are opened, which raises FileNotFoundError
+    entry = read_manifest().get(bot_id)
+    if entry and entry["version"] == version and os.path.exists(_path(entry["segment"]) + ".meta.json"):
+        return ArenaSegment(bot_id, version, _path(entry["segment"]))
+    return refresh_segment(bot_id, version)
+
+
+def get_segment(bot_id: str) -> Optional[ArenaSegment]:
+    """
+    Return the mapped segment for a bot, or None if it has no embeddings.
+    The version is checked against Supabase at most every ARENA_VERSION_CHECK_INTERVAL seconds.
+    """
+    now = time.monotonic()
+    segment = _segments.get(bot_id)
+    # A segment from another embedding version must not be scored against this version's query vectors
+    fresh = now - _checked_at.get(bot_id, 0) < ARENA_VERSION_CHECK_INTERVAL
+    if segment is not None and fresh and segment.model_id == get_active_model(bot_id):
+        return segment
+    version = fetch_version(bot_id)
+    _checked_at[bot_id] = now
+    if version is None:
+        _segments.pop(bot_id, None)
+        return None
+    if segment is not None and segment.version == version:
+        return segment
+    try:
+        segment = _map_segment(bot_id, version)
+    except FileNotFoundError:
+        # Another worker replaced the segment between our reading the manifest and mapping its files
+        version = fetch_version(bot_id)
+        segment = _map_segment(bot_id, version) if version is not None else None
+    if segment is None:
+        _segments.pop(bot_id, None)
+    else:
+        _segments[bot_id] = segment
+    return segment
+
+
+def invalidate_segment(bot_id: str):
+    """Force a version check on the next lookup, e.g. right after this worker ingested new chunks."""
+    _checked_at.pop(bot_id, None)
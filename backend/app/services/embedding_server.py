@@ -0,0 +1,281 @@
+"""
+Shared embedding service for all uvicorn workers on a node.
+
+Run it next to the API, from the backend directory:
+    python -m app.services.embedding_server
+
+and set EMBEDDING_SERVER_SOCKET to the same path for the API workers. The model is then loaded once
+per node instead of once per worker, and concurrent requests from all workers are encoded together
+in batches. Workers that cannot reach the server encode in-process unless EMBEDDING_SERVER_FALLBACK=false;
+a server that is reachable but too slow to answer is an error, not a reason to load the model in the worker.
+The server only loads models in EMBEDDING_MODEL_ALLOWLIST.
+
+Protocol (Unix stream socket): every message is a 4-byte big-endian length, a JSON header of that
+length, and for successful responses rows * dim float32 values.
+    request:  {"model_id": "...", "texts": ["...", ...]}
+    response: {"ok": true, "rows": n, "dim": d} + payload, or {"ok": false, "error": "..."}
+"""
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+
+from app.services.embeddings import EMBEDDING_MODEL_ID, encode_texts, get_embedding_model, is_allowed_model
+from app.services.log import get_logger
+
+# Unix socket of the embedding server; unset means every worker encodes in-process
+EMBEDDING_SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET", "")
+# Encode in-process while the server is unreachable
+EMBEDDING_SERVER_FALLBACK = os.getenv("EMBEDDING_SERVER_FALLBACK", "true").lower() == "true"
+# Seconds a client waits for one response
+EMBEDDING_SERVER_TIMEOUT = float(os.getenv("EMBEDDING_SERVER_TIMEOUT", "60"))
+# Seconds a client stops trying the server after failing to reach it
+EMBEDDING_SERVER_RETRY_AFTER = float(os.getenv("EMBEDDING_SERVER_RETRY_AFTER", "5"))
+# Texts the server collects into one encode call, and how long it waits for more requests to join a batch
+EMBEDDING_SERVER_MAX_BATCH = int(os.getenv("EMBEDDING_SERVER_MAX_BATCH", "128"))
+EMBEDDING_SERVER_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_SERVER_BATCH_WAIT_MS", "5"))
+
+DEFAULT_SOCKET = "/tmp/botverse-embeddings.sock"
+_LENGTH = struct.Struct("!I")
+# Errors from connect() meaning no server is listening, the only case in which a worker encodes in-process
+_UNREACHABLE = (FileNotFoundError, ConnectionRefusedError)
+
+logger = get_logger("embedding_server")
+
+
+class EmbeddingServerError(RuntimeError):
+    """The embedding server received the request but could not encode it."""
+
+
+def _frame(header: dict, payload: bytes = b"") -> bytes:
+    data = json.dumps(header).encode("utf-8")
+    return _LENGTH.pack(len(data)) + data + payload
+
+
+# --- Server ---
+
+class _Batcher:
+    """Collects requests from all connections and encodes them together, one batch at a time."""
+
+    def __init__(self, max_batch: int, wait_seconds: float):
+        self.max_batch = max_batch
+        self.wait_seconds = wait_seconds
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # One encoder thread: batches run back to back and requests arriving meanwhile form the next batch
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-server")
+
+    async def submit(self, model_id: str, texts: List[str]) -> np.ndarray:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((model_id, texts, future))
+        return await future
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        pending = [await self.queue.get()]
+        size = len(pending[0][1])
+        deadline = loop.time() + self.wait_seconds
+        while size < self.max_batch:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            pending.append(item)
+            size += len(item[1])
+        return pending
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            by_model = {}
+            for item in await self._collect():
+                by_model.setdefault(item[0], []).append(item)
+            for model_id, items in by_model.items():
+                texts = [text for _, item_texts, _ in items for text in item_texts]
+                try:
+                    vectors = await loop.run_in_executor(self.executor, encode_texts, texts, model_id)
+                except Exception as e:
+                    for _, _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                start = 0
+                for _, item_texts, future in items:
+                    if not future.done():
+                        future.set_result(vectors[start:start + len(item_texts)])
+                    start += len(item_texts)
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, batcher: _Batcher):
+    try:
+        while True:
+            try:
+                (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+                request = json.loads(await reader.readexactly(length))
+            except asyncio.IncompleteReadError:
+                return
+            try:
+                model_id = request.get("model_id") or EMBEDDING_MODEL_ID
+                if not is_allowed_model(model_id):
+                    raise EmbeddingServerError(f"Model {model_id} is not allowed (see EMBEDDING_MODEL_ALLOWLIST)")
+                vectors = await batcher.submit(model_id, request["texts"])
+                vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+                rows, dim = vectors.shape if vectors.ndim == 2 and vectors.size else (0, 0)
+                writer.write(_frame({"ok": True, "rows": rows, "dim": dim}, vectors.tobytes() if rows else b""))
+            except Exception as e:
+                logger.error("Embedding request failed", extra={"error": str(e)})
+                writer.write(_frame({"ok": False, "error": str(e)}))
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+def _socket_in_use(path: str) -> bool:
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+async def serve(socket_path: str = None, preload: bool = True):
+    """Serve embeddings on a Unix socket until cancelled."""
+    socket_path = socket_path or EMBEDDING_SERVER_SOCKET or DEFAULT_SOCKET
+    if os.path.exists(socket_path):
+        if _socket_in_use(socket_path):
+            raise RuntimeError(f"An embedding server is already listening on {socket_path}")
+        # Left behind by a server that did not shut down cleanly
+        os.remove(socket_path)
+    batcher = _Batcher(EMBEDDING_SERVER_MAX_BATCH, EMBEDDING_SERVER_BATCH_WAIT_MS / 1000.0)
+    if preload:
+        await asyncio.get_running_loop().run_in_executor(batcher.executor, get_embedding_model, EMBEDDING_MODEL_ID)
+    server = await asyncio.start_unix_server(lambda reader, writer: _handle(reader, writer, batcher), path=socket_path)
+    os.chmod(socket_path, 0o660)
+    logger.info("Embedding server listening", extra={"socket": socket_path, "model_id": EMBEDDING_MODEL_ID})
+    try:
+        async with server:
+            await asyncio.gather(server.serve_forever(), batcher.run())
+    finally:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+# --- Client ---
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(min(size - len(buffer), 1 << 20))
+        if not chunk:
+            raise ConnectionError("Embedding server closed the connection")
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+
+class EmbeddingServerClient:
+    """Blocking client with one persistent connection per thread (endpoints run in the threadpool)."""
+
+    def __init__(self, socket_path: str, timeout: float = EMBEDDING_SERVER_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _request(self, sock: socket.socket, texts: List[str], model_id: str) -> np.ndarray:
+        sock.sendall(_frame({"model_id": model_id, "texts": texts}))
+        (length,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+        header = json.loads(_recv_exactly(sock, length))
+        if not header["ok"]:
+            raise EmbeddingServerError(header["error"])
+        payload = _recv_exactly(sock, header["rows"] * header["dim"] * 4)
+        return np.frombuffer(payload, dtype=np.float32).reshape(header["rows"], header["dim"])
+
+    def encode(self, texts: List[str], model_id: str = None) -> np.ndarray:
+        """
+        Encode on the server. Raises an _UNREACHABLE error if no server is listening, and
+        EmbeddingServerError if it fails or does not answer within the timeout.
+        """
+        sock = getattr(self._local, "sock", None)
+        reused = sock is not None
+        try:
+            return self._request(sock or self._connect(), texts, model_id or EMBEDDING_MODEL_ID)
+        except socket.timeout as e:
+            # The server may still be encoding; the connection is out of step, but sending again only adds load
+            self._close()
+            raise EmbeddingServerError(f"Embedding server did not answer within {self.timeout}s") from e
+        except OSError:
+            self._close()
+            if not reused:
+                raise
+        # The kept-alive connection may predate a server restart; try once on a fresh one
+        try:
+            return self._request(self._connect(), texts, model_id or EMBEDDING_MODEL_ID)
+        except socket.timeout as e:
+            self._close()
+            raise EmbeddingServerError(f"Embedding server did not answer within {self.timeout}s") from e
+        except OSError:
+            self._close()
+            raise
+
+
+_client = None
+_client_lock = threading.Lock()
+_unavailable_until = 0.0
+
+
+def get_embedding_client():
+    """The process-wide client, or None when no embedding server is configured."""
+    global _client
+    if not EMBEDDING_SERVER_SOCKET:
+        return None
+    with _client_lock:
+        if _client is None:
+            _client = EmbeddingServerClient(EMBEDDING_SERVER_SOCKET)
+        return _client
+
+
+def embed_texts(texts: List[str], model_id: str = None) -> np.ndarray:
+    """Embed through the shared server when one is configured and reachable, otherwise in this process."""
+    global _unavailable_until
+    client = get_embedding_client()
+    if client is not None and time.monotonic() >= _unavailable_until:
+        try:
+            return client.encode(texts, model_id)
+        except _UNREACHABLE as e:
+            if not EMBEDDING_SERVER_FALLBACK:
+                raise
+            _unavailable_until = time.monotonic() + EMBEDDING_SERVER_RETRY_AFTER
+            logger.warning("Embedding server unavailable, encoding in-process", extra={"socket": client.socket_path, "error": str(e)})
+    return encode_texts(texts, model_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -0,0 +1,43 @@
+import os
+import threading
+import time
+
+from app.services.supabase_service import supabase
+from app.services.data_access import get_data_access
+from app.services.gemini_service import EMBEDDING_MODEL_ID
+
+# Seconds a worker trusts its cached copy of a bot's active embedding model
+EMBEDDING_MODEL_CACHE_TTL = float(os.getenv("EMBEDDING_MODEL_CACHE_TTL", "10"))
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def get_active_model(bot_id: str) -> str:
+    """
+    Model ID of the embedding version a bot is served from (bots.embedding_model).
+    Query embeddings, retrieval and ingestion all use this, so a re-embedding job can fill a shadow
+    version under another model ID without affecting live traffic.
+    """
+    now = time.monotonic()
+    with _lock:
+        cached = _cache.get(bot_id)
+    if cached is not None and now - cached[1] < EMBEDDING_MODEL_CACHE_TTL:
+        return cached[0]
+    # Expiring entries for many bots are refreshed with one batched query
+    bot = get_data_access().get_one("bots", "id", bot_id, "id,embedding_model")
+    model_id = (bot.get("embedding_model") if bot else None) or EMBEDDING_MODEL_ID
+    with _lock:
+        _cache[bot_id] = (model_id, now)
+    return model_id
+
+
+def set_active_model(bot_id: str, model_id: str):
+    """Switch the version a bot is served from. A single-row update, so readers see either the old or the new model."""
+    supabase.table("bots").update({"embedding_model": model_id}).eq("id", bot_id).execute()
+    invalidate_active_model(bot_id)
+
+
+def invalidate_active_model(bot_id: str):
+    with _lock:
+        _cache.pop(bot_id, None)
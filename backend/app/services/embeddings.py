@@ -0,0 +1,48 @@
+import os
+import threading
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# HuggingFace embedding model; bots created from now on are embedded with it.
+# Existing bots keep the model recorded in bots.embedding_model until they are re-embedded.
+EMBEDDING_MODEL_ID = os.getenv("EMBEDDING_MODEL", "BAAI/bge-base-en-v1.5")
+# Comma-separated models this server may load, besides EMBEDDING_MODEL: re-embedding targets and the
+# models of imported snapshots must be listed here, and so must every model a bot is still served from
+EMBEDDING_MODEL_ALLOWLIST = frozenset(
+    [EMBEDDING_MODEL_ID] + [model.strip() for model in os.getenv("EMBEDDING_MODEL_ALLOWLIST", "").split(",") if model.strip()]
+)
+
+_load_lock = threading.Lock()
+
+
+def is_allowed_model(model_id: str) -> bool:
+    return model_id in EMBEDDING_MODEL_ALLOWLIST
+
+
+@lru_cache(maxsize=None)
+def _load_model(model_id: str):
+    # sentence_transformers pulls in torch, so it is only imported by the process that actually encodes
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_id)
+
+
+def get_embedding_model(model_id: str = EMBEDDING_MODEL_ID):
+    """Load a SentenceTransformer once per process; a re-embedding job may have two loaded at a time."""
+    with _load_lock:
+        return _load_model(model_id)
+
+
+def encode_texts(texts: List[str], model_id: str = None) -> np.ndarray:
+    """Embed texts with the given model (default EMBEDDING_MODEL_ID) as a float32 matrix, one row per text."""
+    model_id = model_id or EMBEDDING_MODEL_ID
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    # BGE models recommend this prompt prefix for retrieval tasks
+    if "bge" in model_id.lower():
+        texts = [f"Represent this sentence for retrieval: {text}" for text in texts]
+    return np.asarray(get_embedding_model(model_id).encode(texts, show_progress_bar=False), dtype=np.float32)
@@ -1,8 +1,10 @@
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
+from functools import lru_cache
 from typing import List
-from sentence_transformers import SentenceTransformer
+from app.services.embeddings import EMBEDDING_MODEL_ID
+from app.services.embedding_server import embed_texts
 
 load_dotenv()
 
@@ -14,22 +16,21 @@ genai.configure(api_key=GEMINI_API_KEY)
 
 
 
+@lru_cache(maxsize=None)
 def get_gemini_model(model_name="gemini-2.0-flash-lite"):
     """
     Returns a Gemini GenerativeModel for chatbot/generation tasks.
     Default is 'gemini-2.0-flash-lite' for better rate limits.
+    Models are cached, so repeated calls reuse the same client.
     """
     return genai.GenerativeModel(model_name)
 
-# HuggingFace BGE model for embeddings only
-bge_model = SentenceTransformer("BAAI/bge-base-en-v1.5")
-
-def get_text_embeddings(chunks: List[str]) -> List[list]:
+def get_text_embeddings(chunks: List[str], model_id: str = None) -> List[list]:
     """
-    Generate embeddings for a list of text chunks using BGE-Base-EN (HuggingFace).
+    Generate embeddings for a list of text chunks using BGE-Base-EN (HuggingFace),
+    or the given model ID when a bot is served from a different embedding version.
+    Goes through the shared embedding server when EMBEDDING_SERVER_SOCKET is set; the model is only
+    loaded into this process if it has to encode locally.
     Returns a list of embedding vectors (list of floats).
     """
-    # BGE models recommend this prompt prefix for retrieval tasks
-    processed_chunks = [f"Represent this sentence for retrieval: {chunk}" for chunk in chunks]
-    embeddings = bge_model.encode(processed_chunks, show_progress_bar=False)
-    return embeddings.tolist() 
\ No newline at end of file
+    return embed_texts(chunks, model_id or EMBEDDING_MODEL_ID).tolist()
@@ -0,0 +1,238 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional
+
+from app.services.context_packer import estimate_tokens
+from app.services.rate_limit import TokenBucket
+from app.services.log import get_logger
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-lite")
+# Concurrent Gemini calls across the whole worker, and per bot
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_MAX_CONCURRENCY_PER_BOT = int(os.getenv("GEMINI_MAX_CONCURRENCY_PER_BOT", "4"))
+# Our Gemini quota, in requests and tokens per minute (0 disables the limit)
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+# Seconds allowed for one attempt, and for the whole call including retries and waiting for quota
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "60"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "8"))
+# Start a second, hedged request if the first has not answered after this many seconds (0 disables hedging)
+GEMINI_HEDGE_AFTER = float(os.getenv("GEMINI_HEDGE_AFTER", "0"))
+
+logger = get_logger("generation")
+
+
+class GenerationError(Exception):
+    """Raised when Gemini could not produce an answer; status_code is the HTTP status to return."""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def error_status(error: Exception) -> Optional[int]:
+    """HTTP status carried by a Gemini client error, if any."""
+    if isinstance(error, GenerationError):
+        return error.status_code
+    for attr in ("code", "status_code"):
+        value = getattr(error, attr, None)
+        try:
+            if value is not None:
+                return int(value)
+        except (TypeError, ValueError):
+            continue
+    if isinstance(error, TimeoutError):
+        return 504
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    status = error_status(error)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _default_model_factory(model_name: str):
+    # Imported lazily so the client can be built against a fake model without the Gemini SDK configured
+    from app.services.gemini_service import get_gemini_model
+    return get_gemini_model(model_name)
+
+
+class GenerationClient:
+    """
+    Shared Gemini client.
+    Bounds concurrency globally and per bot, paces calls to the RPM/TPM quota with token buckets,
+    retries 429 and 5xx responses with exponential backoff and jitter, enforces per-attempt timeouts
+    and an overall deadline, and can hedge slow calls with a second request.
+    """
+
+    def __init__(
+        self,
+        model_factory: Callable = _default_model_factory,
+        model_name: str = GEMINI_MODEL,
+        max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+        max_concurrency_per_bot: int = GEMINI_MAX_CONCURRENCY_PER_BOT,
+        rpm: int = GEMINI_RPM,
+        tpm: int = GEMINI_TPM,
+        timeout: float = GEMINI_TIMEOUT,
+        deadline: float = GEMINI_DEADLINE,
+        max_retries: int = GEMINI_MAX_RETRIES,
+        backoff_base: float = GEMINI_BACKOFF_BASE,
+        backoff_max: float = GEMINI_BACKOFF_MAX,
+        hedge_after: float = GEMINI_HEDGE_AFTER,
+        sleep: Callable = time.sleep,
+    ):
+        self.model_factory = model_factory
+        self.model_name = model_name
+        self.max_concurrency_per_bot = max_concurrency_per_bot
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self._sleep = sleep
+        self._models: Dict[str, object] = {}
+        self._global = threading.BoundedSemaphore(max_concurrency)
+        self._per_bot: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(rpm, rpm / 60.0) if rpm > 0 else None
+        self._tokens = TokenBucket(tpm, tpm / 60.0) if tpm > 0 else None
+        # Attempts run on their own threads so a hung call can be abandoned at its timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="gemini")
+
+    def model(self, model_name: str = None):
+        model_name = model_name or self.model_name
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = self.model_factory(model_name)
+            return self._models[model_name]
+
+    def _bot_semaphore(self, bot_id: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if bot_id not in self._per_bot:
+                self._per_bot[bot_id] = threading.BoundedSemaphore(self.max_concurrency_per_bot)
+            return self._per_bot[bot_id]
+
+    def _take_quota(self, tokens: int, deadline_at: float):
+        for bucket, amount in ((self._requests, 1), (self._tokens, tokens)):
+            if bucket is None:
+                continue
+            if not bucket.acquire(amount, timeout=max(0.0, deadline_at - time.monotonic()), sleep=self._sleep):
+                raise GenerationError("Gemini quota exhausted, try again later.", status_code=429)
+
+    def _try_take_hedge_quota(self, tokens: int) -> bool:
+        # A hedge is a full second request, so it is charged against both the RPM and the TPM budget
+        if self._requests is not None and not self._requests.try_acquire():
+            return False
+        if self._tokens is not None and not self._tokens.try_acquire(min(tokens, self._tokens.capacity)):
+            if self._requests is not None:
+                self._requests.refund()
+            return False
+        return True
+
+    def _attempt(self, model, prompt: str, timeout: float):
+        return self._executor.submit(model.generate_content, prompt, request_options={"timeout": timeout})
+
+    def _call_once(self, model, prompt: str, prompt_tokens: int, deadline_at: float, hedge: bool):
+        timeout = min(self.timeout, deadline_at - time.monotonic())
+        if timeout <= 0:
+            raise GenerationError("Gemini call timed out.", status_code=504)
+        attempt_deadline = time.monotonic() + timeout
+        primary = self._attempt(model, prompt, timeout)
+        pending = {primary}
+        if hedge and self.hedge_after > 0:
+            done, _ = wait(pending, timeout=min(self.hedge_after, timeout))
+            # Only hedge when the quota has room, so hedges never push us into 429s
+            remaining = attempt_deadline - time.monotonic()
+            if not done and remaining > 0 and self._try_take_hedge_quota(prompt_tokens):
+                pending.add(self._attempt(model, prompt, remaining))
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, attempt_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                # Attempts still queued behind busy threads are dropped; running ones end at their own timeout
+                for future in pending:
+                    future.cancel()
+                break
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        if error is None:
+            raise GenerationError("Gemini call timed out.", status_code=504)
+        raise error
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0.5, 1.0) * min(self.backoff_max, self.backoff_base * (2 ** attempt))
+
+    def _generate_with_retries(self, model, prompt: str, deadline_at: float, hedge: bool):
+        prompt_tokens = estimate_tokens(prompt)
+        attempt = 0
+        while True:
+            if time.monotonic() >= deadline_at:
+                raise GenerationError("Gemini call timed out.", status_code=504)
+            self._take_quota(prompt_tokens, deadline_at)
+            try:
+                return self._call_once(model, prompt, prompt_tokens, deadline_at, hedge)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    if isinstance(e, GenerationError):
+                        raise
+                    raise GenerationError(f"Gemini API error: {e}", status_code=error_status(e) or 502) from e
+                delay = self._backoff(attempt)
+                if time.monotonic() + delay >= deadline_at:
+                    raise GenerationError(f"Gemini API error after {attempt + 1} attempts: {e}", status_code=error_status(e) or 504) from e
+                logger.warning("Gemini call failed, retrying", extra={"error": str(e), "attempt": attempt + 1, "delay_s": round(delay, 3)})
+                self._sleep(delay)
+                attempt += 1
+
+    def generate(self, prompt: str, bot_id: str = None, model_name: str = None, deadline: float = None, hedge: bool = True):
+        """Generate a response for prompt, raising GenerationError if Gemini cannot answer within the deadline."""
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        model = self.model(model_name)
+        bot_semaphore = self._bot_semaphore(bot_id) if bot_id else None
+        # The bot's slot is taken first, so calls queued behind a busy bot do not hold global slots other bots need
+        if bot_semaphore is not None and not bot_semaphore.acquire(timeout=max(0.0, deadline_at - time.monotonic())):
+            raise GenerationError("Too many concurrent Gemini calls for this bot.", status_code=503)
+        try:
+            if not self._global.acquire(timeout=max(0.0, deadline_at - time.monotonic())):
+                raise GenerationError("Too many concurrent Gemini calls.", status_code=503)
+            try:
+                return self._generate_with_retries(model, prompt, deadline_at, hedge)
+            finally:
+                self._global.release()
+        finally:
+            if bot_semaphore is not None:
+                bot_semaphore.release()
+
+
+_client: Optional[GenerationClient] = None
+_client_lock = threading.Lock()
+
+
+def get_generation_client() -> GenerationClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GenerationClient()
+        return _client
+
+
+def set_generation_client(client: GenerationClient):
+    """Replace the shared client, e.g. with one built around a local fake model."""
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def generate_text(prompt: str, bot_id: str = None, **kwargs):
+    """Generate with the shared client and return the Gemini response."""
+    return get_generation_client().generate(prompt, bot_id=bot_id, **kwargs)
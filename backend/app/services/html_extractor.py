@@ -0,0 +1,180 @@
+import os
+import re
+
+# Which parser backend to use for scraped pages: "auto", "selectolax", "lxml" or "bs4".
+# "auto" picks the fastest one that is installed.
+HTML_EXTRACTOR = os.getenv("HTML_EXTRACTOR", "auto")
+# Default for boilerplate removal when a scrape request does not say otherwise
+HTML_MAIN_CONTENT_ONLY = os.getenv("HTML_MAIN_CONTENT_ONLY", "false").lower() == "true"
+
+# Elements that never contain visible text
+NOISE_TAGS = ["script", "style", "noscript", "template"]
+# Page chrome that is dropped in main-content mode
+BOILERPLATE_TAGS = ["nav", "header", "footer", "aside", "form", "iframe", "svg", "dialog"]
+# class/id tokens that mark navigation menus, footers, cookie banners etc.
+BOILERPLATE_PATTERN = re.compile(
+    r"(?:^|[\s_-])(?:nav|navbar|navigation|menu|footer|header|sidebar|breadcrumbs?|cookies?|consent|"
+    r"gdpr|banner|popup|modal|newsletter|subscribe|social|share|related|advert|ads|promo)(?:$|[\s_-])",
+    re.IGNORECASE,
+)
+BOILERPLATE_ROLES = {"navigation", "banner", "contentinfo", "complementary", "dialog", "alertdialog", "search"}
+# Candidates for the main content container, in order of preference
+MAIN_CONTENT_SELECTORS = ["main", "article", "[role=main]", "#content", "#main", "#main-content", ".content", ".main-content"]
+# A main-content candidate shorter than this is ignored in favour of the body
+MIN_MAIN_CONTENT_CHARS = 200
+
+_WHITESPACE = re.compile(r"\s+")
+_KEEP_TAGS = {"html", "body", "main", "article"}
+
+
+def _normalize(parts) -> str:
+    return _WHITESPACE.sub(" ", " ".join(part.strip() for part in parts if part and part.strip())).strip()
+
+
+def _is_boilerplate(tag: str, attrs) -> bool:
+    if tag in _KEEP_TAGS:
+        return False
+    if tag in BOILERPLATE_TAGS:
+        return True
+    if (attrs.get("role") or "").lower() in BOILERPLATE_ROLES:
+        return True
+    marker = f"{attrs.get('id') or ''} {attrs.get('class') or ''}"
+    return bool(marker.strip()) and bool(BOILERPLATE_PATTERN.search(marker))
+
+
+def _extract_selectolax(html: str, main_content: bool) -> str:
+    from selectolax.lexbor import LexborHTMLParser
+
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(NOISE_TAGS)
+    root = tree.body or tree.root
+    if root is None:
+        return ""
+    if main_content:
+        # Collect first, then only decompose outermost matches so we never touch a freed child node
+        doomed = [node for node in root.traverse() if node.tag and node.tag[0].isalpha() and _is_boilerplate(node.tag, node.attributes)]
+        doomed_ids = set()
+        for node in doomed:
+            parent, nested = node.parent, False
+            while parent is not None:
+                if parent.mem_id in doomed_ids:
+                    nested = True
+                    break
+                parent = parent.parent
+            if not nested:
+                doomed_ids.add(node.mem_id)
+        for node in doomed:
+            if node.mem_id in doomed_ids:
+                node.decompose()
+        for selector in MAIN_CONTENT_SELECTORS:
+            candidate = tree.css_first(selector)
+            if candidate is not None:
+                text = candidate.text(separator=" ", strip=True)
+                if len(text) >= MIN_MAIN_CONTENT_CHARS:
+                    return _normalize([text])
+        root = tree.body or tree.root
+    return _normalize([root.text(separator=" ", strip=True)])
+
+
+def _extract_lxml(html: str, main_content: bool) -> str:
+    import lxml.html
+    from lxml import etree
+
+    if not html.strip():
+        return ""
+    try:
+        document = lxml.html.document_fromstring(html)
+    except (etree.ParserError, ValueError):
+        return ""
+    etree.strip_elements(document, *NOISE_TAGS, etree.Comment, etree.ProcessingInstruction, with_tail=False)
+    if main_content:
+        doomed = [el for el in document.iter() if isinstance(el.tag, str) and _is_boilerplate(el.tag, el.attrib)]
+        for el in doomed:
+            # drop_tree keeps the tail text; an element inside an already dropped subtree has no parent path to the root
+            if el.getroottree().getroot() is document and el.getparent() is not None:
+                el.drop_tree()
+        for selector in MAIN_CONTENT_SELECTORS:
+            candidates = _select_lxml(document, selector)
+            if candidates:
+                text = _normalize(candidates[0].itertext())
+                if len(text) >= MIN_MAIN_CONTENT_CHARS:
+                    return text
+    body = document.find("body")
+    return _normalize((body if body is not None else document).itertext())
+
+
+def _select_lxml(document, selector: str):
+    # The selectors in MAIN_CONTENT_SELECTORS are simple enough to map to XPath without cssselect
+    if selector.startswith("#"):
+        return document.xpath(f"//*[@id='{selector[1:]}']")
+    if selector.startswith("."):
+        return document.xpath(f"//*[contains(concat(' ', normalize-space(@class), ' '), ' {selector[1:]} ')]")
+    if selector.startswith("[role="):
+        return document.xpath(f"//*[@role='{selector[6:-1]}']")
+    return document.xpath(f"//{selector}")
+
+
+def _extract_bs4(html: str, main_content: bool) -> str:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    for element in soup(NOISE_TAGS):
+        element.extract()
+    if main_content:
+        for element in soup.find_all(lambda el: _is_boilerplate(el.name, {k: " ".join(v) if isinstance(v, list) else v for k, v in el.attrs.items()})):
+            element.extract()
+        for selector in MAIN_CONTENT_SELECTORS:
+            candidate = soup.select_one(selector)
+            if candidate is not None:
+                text = _normalize(candidate.stripped_strings)
+                if len(text) >= MIN_MAIN_CONTENT_CHARS:
+                    return text
+    return _normalize(soup.stripped_strings)
+
+
+EXTRACTORS = {
+    "selectolax": _extract_selectolax,
+    "lxml": _extract_lxml,
+    "bs4": _extract_bs4,
+}
+
+_BACKEND_MODULES = {
+    "selectolax": "selectolax.lexbor",
+    "lxml": "lxml.html",
+    "bs4": "bs4",
+}
+
+
+def available_backends() -> list:
+    """Return the installed extractor backends, fastest first."""
+    backends = []
+    for name, module in _BACKEND_MODULES.items():
+        try:
+            __import__(module)
+            backends.append(name)
+        except ImportError:
+            continue
+    return backends
+
+
+def resolve_backend(backend: str = None) -> str:
+    backend = (backend or HTML_EXTRACTOR).lower()
+    if backend == "auto":
+        installed = available_backends()
+        if not installed:
+            raise ValueError("No HTML parser backend is installed.")
+        return installed[0]
+    if backend not in EXTRACTORS:
+        raise ValueError(f"Unknown HTML extractor backend: {backend}")
+    return backend
+
+
+def extract_text(html: str, backend: str = None, main_content: bool = None) -> str:
+    """
+    Extract visible text from an HTML page.
+    With main_content=True navigation, footers, cookie banners and similar page chrome are dropped
+    and only the main content container is kept when one can be found.
+    """
+    if main_content is None:
+        main_content = HTML_MAIN_CONTENT_ONLY
+    return EXTRACTORS[resolve_backend(backend)](html, main_content)
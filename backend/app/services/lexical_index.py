@@ -0,0 +1,150 @@
+import math
+import os
+import re
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from app.services.supabase_service import supabase, fetch_all_rows
+from app.services.embedding_versions import get_active_model
+
+# BM25 parameters
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Seconds a worker trusts its cached copy of a bot's index before checking Supabase for a newer one
+LEXICAL_INDEX_CACHE_TTL = float(os.getenv("LEXICAL_INDEX_CACHE_TTL", "60"))
+
+# Keeps product codes and error strings such as "x200-eu-42" or "e_1042" together as one token
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART_PATTERN = re.compile(r"[-_./]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase and split text into terms.
+    Compound codes are indexed both whole and by their parts so "X200" also matches "X200-EU-42".
+    """
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = _PART_PATTERN.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class BM25Index:
+    """Inverted index over a bot's chunks, keyed by embedding row id."""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, chunk_id: str, text: str):
+        if chunk_id in self.doc_lengths:
+            return
+        terms = tokenize(text)
+        self.doc_lengths[chunk_id] = len(terms)
+        self.total_length += len(terms)
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+
+    def search(self, query: str, limit: int = 100) -> List[Tuple[str, float]]:
+        """Return up to limit (chunk_id, score) pairs, best first."""
+        if not self.doc_lengths:
+            return []
+        n_docs = len(self.doc_lengths)
+        avg_length = self.total_length / n_docs or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def to_dict(self) -> dict:
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "postings": self.postings,
+            "doc_lengths": self.doc_lengths,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        index = cls(k1=data.get("k1", BM25_K1), b=data.get("b", BM25_B))
+        index.postings = data.get("postings", {})
+        index.doc_lengths = data.get("doc_lengths", {})
+        index.total_length = sum(index.doc_lengths.values())
+        return index
+
+
+# bot_id -> (checked_at, updated_at, index)
+_index_cache: Dict[str, Tuple[float, str, BM25Index]] = {}
+
+
+def build_index(rows: List[dict]) -> BM25Index:
+    index = BM25Index()
+    for row in rows:
+        index.add(row["id"], row["chunk_text"])
+    return index
+
+
+def rebuild_bot_index(bot_id: str) -> BM25Index:
+    """
+    Build the BM25 index from all of the bot's active embedding rows and store it next to them in Supabase.
+    The rows are fetched page by page, since one select returns at most PAGE_SIZE rows and a partial index
+    would make the missing chunks unreachable in hybrid mode. Every call re-reads and re-writes the whole
+    index, so ingestion costs O(bot size) here, not O(new chunks).
+    """
+    model_id = get_active_model(bot_id)
+    rows = fetch_all_rows(
+        lambda: supabase.table("embeddings").select("id,chunk_text").eq("bot_id", bot_id).eq("model_id", model_id).order("id")
+    )
+    index = build_index(rows)
+    updated_at = datetime.utcnow().isoformat()
+    supabase.table("lexical_indexes").upsert({
+        "bot_id": bot_id,
+        "data": index.to_dict(),
+        "chunk_count": len(index),
+        "updated_at": updated_at,
+    }).execute()
+    _index_cache[bot_id] = (time.monotonic(), updated_at, index)
+    return index
+
+
+def delete_bot_index(bot_id: str):
+    supabase.table("lexical_indexes").delete().eq("bot_id", bot_id).execute()
+    _index_cache.pop(bot_id, None)
+
+
+def get_bot_index(bot_id: str):
+    """Return the bot's BM25 index, or None if it has not been built yet."""
+    cached = _index_cache.get(bot_id)
+    now = time.monotonic()
+    if cached and now - cached[0] < LEXICAL_INDEX_CACHE_TTL:
+        return cached[2]
+    if cached:
+        # Only pull the full index again if another worker rebuilt it
+        res = supabase.table("lexical_indexes").select("updated_at").eq("bot_id", bot_id).execute()
+        if res.data and res.data[0]["updated_at"] == cached[1]:
+            _index_cache[bot_id] = (now, cached[1], cached[2])
+            return cached[2]
+    res = supabase.table("lexical_indexes").select("data,updated_at").eq("bot_id", bot_id).execute()
+    if not res.data:
+        _index_cache.pop(bot_id, None)
+        return None
+    index = BM25Index.from_dict(res.data[0]["data"])
+    _index_cache[bot_id] = (now, res.data[0]["updated_at"], index)
+    return index
@@ -0,0 +1,96 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+# Stages of a chat request, in the order they run
+STAGES = ("queue", "embed", "fetch", "score", "memory", "prompt", "llm", "history")
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram(
+    "botverse_stage_seconds",
+    "Time spent in each stage of a request",
+    ["endpoint", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "botverse_request_seconds",
+    "End-to-end request latency",
+    ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_TOTAL = Counter(
+    "botverse_requests_total",
+    "Requests handled",
+    ["endpoint", "method", "status"],
+)
+ADMISSION_REJECTED = Counter(
+    "botverse_admission_rejected_total",
+    "Requests rejected with 429 by admission control",
+    ["endpoint", "reason"],
+)
+DB_QUERY_SECONDS = Histogram(
+    "botverse_db_query_seconds",
+    "Latency of Supabase reads made through the data-access layer",
+    ["table", "kind"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_READS_SHARED = Counter(
+    "botverse_db_reads_shared_total",
+    "Reads answered by a query another caller started: joined in flight or batched into one in_() query",
+    ["table", "kind"],
+)
+
+# Stage durations of the current request. The middleware sets a fresh dict per request; it is the
+# same object inside the threadpool that runs sync endpoints, so stages recorded there are visible.
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def start_request() -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record_stage(name: str, seconds: float):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one stage of the current request; repeated stages add up."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def observe_request(endpoint: str, method: str, status: int, seconds: float, timings: Dict[str, float]):
+    REQUEST_SECONDS.labels(endpoint, method, str(status)).observe(seconds)
+    REQUESTS_TOTAL.labels(endpoint, method, str(status)).inc()
+    for name, duration in timings.items():
+        STAGE_SECONDS.labels(endpoint, name).observe(duration)
+
+
+def server_timing_header(timings: Dict[str, float], total_seconds: float) -> str:
+    """Format stage timings as a Server-Timing header value (durations in milliseconds)."""
+    ordered = [name for name in STAGES if name in timings] + sorted(set(timings) - set(STAGES))
+    entries = [f"{name};dur={timings[name] * 1000:.1f}" for name in ordered]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def render_metrics():
+    """Return (body, content_type) for the /metrics endpoint."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # With several uvicorn workers each process writes its samples to this directory
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,59 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+    Holds up to capacity tokens and refills at rate tokens per second.
+    """
+
+    def __init__(self, capacity: float, rate: float, clock=time.monotonic):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, amount: float = 1.0) -> bool:
+        with self._lock:
+            self._refill(self._clock())
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return True
+            return False
+
+    def refund(self, amount: float = 1.0):
+        """Give back tokens taken for work that was not done."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        """Seconds until amount tokens will be available (0 if they are available now)."""
+        with self._lock:
+            self._refill(self._clock())
+            missing = min(amount, self.capacity) - self._tokens
+            if missing <= 0:
+                return 0.0
+            return missing / self.rate if self.rate > 0 else float("inf")
+
+    def acquire(self, amount: float = 1.0, timeout: float = None, sleep=time.sleep) -> bool:
+        """Block until amount tokens are taken or timeout seconds have passed."""
+        # A request bigger than the bucket can never fit, so it only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            if self.try_acquire(amount):
+                return True
+            wait = self.wait_time(amount)
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining <= 0 or wait > remaining:
+                    return False
+                wait = min(wait, remaining)
+            sleep(max(wait, 0.001))
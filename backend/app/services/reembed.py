@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+from uuid import uuid4
+
+from app.services.supabase_service import supabase, fetch_all_rows
+from app.services.gemini_service import get_text_embeddings
+from app.services.embedding_versions import EMBEDDING_MODEL_CACHE_TTL, get_active_model, set_active_model
+from app.services.lexical_index import rebuild_bot_index
+from app.services.document_centroids import rebuild_bot_centroids, delete_model_centroids
+from app.services.embedding_arena import invalidate_segment
+from app.services.rate_limit import TokenBucket
+from app.services.log import get_logger
+
+# Chunks encoded and inserted per step of a re-embedding job
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "64"))
+# Chunks per second a job may encode, so a migration does not starve live ingestion and query embedding (0 = unthrottled)
+REEMBED_CHUNKS_PER_SECOND = float(os.getenv("REEMBED_CHUNKS_PER_SECOND", "50"))
+# A job whose progress has not moved for this many seconds is treated as dead (its worker exited) and may be restarted
+REEMBED_STALE_AFTER = float(os.getenv("REEMBED_STALE_AFTER", "300"))
+# Seconds to keep the old version after switching, so workers with a cached model ID finish their requests
+# (never less than EMBEDDING_MODEL_CACHE_TTL)
+REEMBED_RETIRE_DELAY = float(os.getenv("REEMBED_RETIRE_DELAY", "30"))
+
+logger = get_logger("reembed")
+
+# Job statuses in order; a job in one of the first three still owns the bot's shadow version
+JOB_STATUSES = ("pending", "running", "switching", "done", "failed")
+ACTIVE_STATUSES = JOB_STATUSES[:3]
+
+# Jobs running in this process: bot_id -> thread
+_running = {}
+_running_lock = threading.Lock()
+
+
+class ReembedError(ValueError):
+    """A re-embedding job cannot be started for this bot."""
+
+
+def _chunk_key(row: dict):
+    return row["document_id"], row["chunk_index"]
+
+
+def _fetch_version(bot_id: str, model_id: str, columns: str) -> list:
+    return fetch_all_rows(
+        lambda: supabase.table("embeddings").select(columns).eq("bot_id", bot_id).eq("model_id", model_id).order("id")
+    )
+
+
+def get_job(bot_id: str) -> Optional[dict]:
+    """Latest re-embedding job for the bot, as stored in reembed_jobs; readable from any worker."""
+    res = supabase.table("reembed_jobs").select("*").eq("bot_id", bot_id).execute()
+    return res.data[0] if res.data else None
+
+
+def _is_stale(job: dict) -> bool:
+    updated_at = datetime.fromisoformat(str(job["updated_at"]).replace("Z", "+00:00")).replace(tzinfo=None)
+    return (datetime.utcnow() - updated_at).total_seconds() > REEMBED_STALE_AFTER
+
+
+def _save_job(job: dict):
+    job["updated_at"] = datetime.utcnow().isoformat()
+    supabase.table("reembed_jobs").upsert(dict(job)).execute()
+
+
+def _copy_missing(job: dict, bucket: Optional[TokenBucket]) -> int:
+    """
+    Embed every chunk of the serving version that the target version does not have yet.
+    Resumable: chunks already written to the shadow version by an earlier run are skipped.
+    """
+    bot_id, source, target = job["bot_id"], job["source_model"], job["target_model"]
+    done = {_chunk_key(row) for row in _fetch_version(bot_id, target, "document_id,chunk_index")}
+    pending = [row for row in _fetch_version(bot_id, source, "document_id,chunk_index,chunk_text") if _chunk_key(row) not in done]
+    job["total_chunks"] = len(done) + len(pending)
+    job["done_chunks"] = len(done)
+    _save_job(job)
+    for start in range(0, len(pending), REEMBED_BATCH_SIZE):
+        batch = pending[start:start + REEMBED_BATCH_SIZE]
+        if bucket is not None:
+            bucket.acquire(len(batch))
+        embeddings = get_text_embeddings([row["chunk_text"] for row in batch], model_id=target)
+        created_at = datetime.utcnow().isoformat()
+        supabase.table("embeddings").insert([
+            {
+                "id": str(uuid4()),
+                "document_id": row["document_id"],
+                "bot_id": bot_id,
+                "chunk_index": row["chunk_index"],
+                "chunk_text": row["chunk_text"],
+                "embedding": embedding,
+                "model_id": target,
+                "created_at": created_at,
+            }
+            for row, embedding in zip(batch, embeddings)
+        ]).execute()
+        job["done_chunks"] += len(batch)
+        _save_job(job)
+    return len(pending)
+
+
+def _drop_orphans(bot_id: str, source: str, target: str):
+    """Remove shadow chunks whose document was deleted or replaced while the job ran."""
+    live = {_chunk_key(row) for row in _fetch_version(bot_id, source, "document_id,chunk_index")}
+    orphans = [row["id"] for row in _fetch_version(bot_id, target, "id,document_id,chunk_index") if _chunk_key(row) not in live]
+    for start in range(0, len(orphans), REEMBED_BATCH_SIZE):
+        supabase.table("embeddings").delete().in_("id", orphans[start:start + REEMBED_BATCH_SIZE]).execute()
+
+
+def _run(job: dict):
+    bot_id, source, target = job["bot_id"], job["source_model"], job["target_model"]
+    bucket = TokenBucket(max(REEMBED_BATCH_SIZE, REEMBED_CHUNKS_PER_SECOND), REEMBED_CHUNKS_PER_SECOND) if REEMBED_CHUNKS_PER_SECOND > 0 else None
+    try:
+        job["status"] = "running"
+        # Uploads keep writing to the serving version while the job runs, so repeat until it has caught up
+        while _copy_missing(job, bucket):
+            pass
+        _drop_orphans(bot_id, source, target)
+        # Centroids for the new version are ready before any query is served from it
+        rebuild_bot_centroids(bot_id, target)
+
+        job["status"] = "switching"
+        _save_job(job)
+        set_active_model(bot_id, target)
+        # Ingestion that looked up the old model just before the switch may still have added chunks
+        if _copy_missing(job, bucket):
+            rebuild_bot_centroids(bot_id, target)
+        rebuild_bot_index(bot_id)
+        invalidate_segment(bot_id)
+
+        # Workers keep embedding uploads with the old model until their cached model ID expires
+        time.sleep(max(REEMBED_RETIRE_DELAY, EMBEDDING_MODEL_CACHE_TTL))
+        # Catch up on those before the old version is deleted, or their chunks would be lost
+        if _copy_missing(job, bucket):
+            rebuild_bot_centroids(bot_id, target)
+            rebuild_bot_index(bot_id)
+            invalidate_segment(bot_id)
+        supabase.table("embeddings").delete().eq("bot_id", bot_id).eq("model_id", source).execute()
+        delete_model_centroids(bot_id, source)
+        job["status"] = "done"
+        job["finished_at"] = datetime.utcnow().isoformat()
+        _save_job(job)
+        logger.info("Re-embedding finished", extra={"bot_id": bot_id, "target_model": target, "chunks": job["done_chunks"]})
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+        job["finished_at"] = datetime.utcnow().isoformat()
+        _save_job(job)
+        logger.error("Re-embedding failed", extra={"bot_id": bot_id, "target_model": target, "error": str(e)})
+    finally:
+        with _running_lock:
+            _running.pop(bot_id, None)
+
+
+def start_reembed(bot_id: str, target_model: str) -> dict:
+    """
+    Start re-embedding the bot with target_model in a background thread.
+    Chat keeps being served from the current version until every chunk exists in the new one.
+    """
+    source_model = get_active_model(bot_id)
+    if target_model == source_model:
+        raise ReembedError(f"Bot is already served from {target_model}.")
+    with _running_lock:
+        if bot_id in _running:
+            raise ReembedError("A re-embedding job is already running for this bot.")
+        previous = get_job(bot_id)
+        if previous and previous["status"] in ACTIVE_STATUSES and not _is_stale(previous):
+            raise ReembedError(f"Another worker is re-embedding this bot with {previous['target_model']}.")
+        job = {
+            "bot_id": bot_id,
+            "source_model": source_model,
+            "target_model": target_model,
+            "status": "pending",
+            "total_chunks": 0,
+            "done_chunks": 0,
+            "error": None,
+            "started_at": datetime.utcnow().isoformat(),
+            "finished_at": None,
+        }
+        _save_job(job)
+        thread = threading.Thread(target=_run, args=(job,), name=f"reembed-{bot_id}", daemon=True)
+        _running[bot_id] = thread
+        # The thread updates job as it goes, so the caller gets a copy taken before it starts
+        snapshot = dict(job)
+    thread.start()
+    return snapshot
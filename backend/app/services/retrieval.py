@@ -0,0 +1,264 @@
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from app.services.supabase_service import supabase, fetch_all_rows
+from app.services.data_access import get_data_access
+from app.services.lexical_index import get_bot_index
+from app.services.embedding_arena import EMBEDDING_ARENA_ENABLED, get_segment
+from app.services.embedding_versions import get_active_model
+from app.services.document_centroids import fetch_bot_centroids
+from app.services.metrics import stage
+
+RETRIEVAL_MODES = ("dense", "hybrid", "hierarchical")
+# Number of BM25 candidates that get dense-scored in hybrid mode
+LEXICAL_CANDIDATES = int(os.getenv("LEXICAL_CANDIDATES", "100"))
+# Reciprocal rank fusion constant; 60 is the value from the original RRF paper
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Documents whose chunks are scored in hierarchical mode, picked by their best centroid
+HIERARCHICAL_TOP_DOCUMENTS = int(os.getenv("HIERARCHICAL_TOP_DOCUMENTS", "8"))
+# Bots with fewer documents are scanned in full; picking documents would skip too little to pay off
+HIERARCHICAL_MIN_DOCUMENTS = int(os.getenv("HIERARCHICAL_MIN_DOCUMENTS", "16"))
+# Scan everything when no centroid is at least this similar to the query (0 disables the check)
+HIERARCHICAL_MIN_SCORE = float(os.getenv("HIERARCHICAL_MIN_SCORE", "0"))
+# Queries scored per matrix-matrix product in batch retrieval
+BATCH_BLOCK_SIZE = int(os.getenv("BATCH_BLOCK_SIZE", "256"))
+
+
+def cosine_scores(query_embedding, matrix: np.ndarray) -> np.ndarray:
+    """Cosine similarity of one query vector against every row of matrix."""
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    return (matrix @ query) / (norms + 1e-8)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=int)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k highest scores in every row of a 2-D score matrix, best first."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=int)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[tuple]:
+    """Merge several best-first id rankings into one list of (id, fused_score)."""
+    fused = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def _rows_to_matrix(rows: List[dict]) -> np.ndarray:
+    return np.array([row["embedding"] for row in rows], dtype=np.float32)
+
+
+def _row_hit(row: dict, score: float) -> dict:
+    return {
+        "id": row["id"],
+        "document_id": row.get("document_id"),
+        "chunk_index": row.get("chunk_index"),
+        "chunk_text": row["chunk_text"],
+        "score": score,
+    }
+
+
+def _normalize(query_embedding) -> np.ndarray:
+    query = np.asarray(query_embedding, dtype=np.float32)
+    return query / (np.linalg.norm(query) + 1e-8)
+
+
+def _fetch_embeddings(bot_id: str) -> List[dict]:
+    # Concurrent requests for the same bot share one paged read; the rows are shared, so they are only read
+    return get_data_access().select(
+        "embeddings", "id,document_id,chunk_index,chunk_text,embedding", {"bot_id": bot_id, "model_id": get_active_model(bot_id)}, order="id"
+    )
+
+
+def dense_search(bot_id: str, query_embedding, top_k: int) -> List[dict]:
+    """Score every chunk of the bot against the query embedding."""
+    if EMBEDDING_ARENA_ENABLED:
+        with stage("fetch"):
+            segment = get_segment(bot_id)
+        if segment is None:
+            return []
+        with stage("score"):
+            scores = segment.vectors @ _normalize(query_embedding)
+            return [segment.hit(i, float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+    with stage("fetch"):
+        rows = _fetch_embeddings(bot_id)
+    if not rows:
+        return []
+    with stage("score"):
+        scores = cosine_scores(query_embedding, _rows_to_matrix(rows))
+        return [_row_hit(rows[i], float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+
+def batch_dense_search(bot_id: str, query_embeddings, top_k: int, block_size: int = BATCH_BLOCK_SIZE) -> List[List[dict]]:
+    """
+    Dense top_k for many queries against one bot: the bot's vectors are loaded once and scored
+    with one matrix-matrix product per block of queries.
+    """
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-8)
+    with stage("fetch"):
+        if EMBEDDING_ARENA_ENABLED:
+            segment = get_segment(bot_id)
+            if segment is None:
+                return [[] for _ in range(len(queries))]
+            vectors, make_hit = segment.vectors, segment.hit
+        else:
+            rows = _fetch_embeddings(bot_id)
+            if not rows:
+                return [[] for _ in range(len(queries))]
+            vectors = _rows_to_matrix(rows)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-8
+
+            def make_hit(i, score):
+                return _row_hit(rows[i], score)
+    results = []
+    with stage("score"):
+        # Blocks keep the score matrix at block_size x chunks instead of queries x chunks
+        for start in range(0, len(queries), block_size):
+            scores = queries[start:start + block_size] @ vectors.T
+            for row, indices in enumerate(top_k_rows(scores, top_k)):
+                results.append([make_hit(i, float(scores[row, i])) for i in indices])
+    return results
+
+
+def hybrid_search(bot_id: str, query: str, query_embedding, top_k: int, lexical_candidates: int = LEXICAL_CANDIDATES) -> List[dict]:
+    """
+    BM25 prefilter followed by dense scoring of the candidates only, merged with reciprocal rank fusion.
+    Falls back to a full dense scan when the bot has no lexical index or nothing matches lexically.
+    """
+    with stage("fetch"):
+        index = get_bot_index(bot_id)
+    with stage("score"):
+        lexical_hits = index.search(query, lexical_candidates) if index is not None else []
+    if not lexical_hits:
+        return dense_search(bot_id, query_embedding, top_k)
+
+    candidate_ids = [chunk_id for chunk_id, _ in lexical_hits]
+    if EMBEDDING_ARENA_ENABLED:
+        with stage("fetch"):
+            segment = get_segment(bot_id)
+        if segment is None:
+            return []
+        rows = [row for row in (segment.row_of(chunk_id) for chunk_id in candidate_ids) if row is not None]
+        if not rows:
+            return dense_search(bot_id, query_embedding, top_k)
+        with stage("score"):
+            scores = segment.vectors[rows] @ _normalize(query_embedding)
+            dense_ranking = [segment.ids[rows[i]] for i in np.argsort(-scores)]
+            lexical_ranking = [segment.ids[row] for row in rows]
+            return [
+                segment.hit(segment.row_of(chunk_id), score)
+                for chunk_id, score in reciprocal_rank_fusion([dense_ranking, lexical_ranking])[:top_k]
+            ]
+
+    with stage("fetch"):
+        res = supabase.table("embeddings").select("id,document_id,chunk_index,chunk_text,embedding").in_("id", candidate_ids).execute()
+    rows = res.data or []
+    if not rows:
+        return dense_search(bot_id, query_embedding, top_k)
+
+    with stage("score"):
+        scores = cosine_scores(query_embedding, _rows_to_matrix(rows))
+        dense_ranking = [rows[i]["id"] for i in np.argsort(-scores)]
+        found = set(dense_ranking)
+        lexical_ranking = [chunk_id for chunk_id in candidate_ids if chunk_id in found]
+        rows_by_id = {row["id"]: row for row in rows}
+        return [_row_hit(rows_by_id[chunk_id], score) for chunk_id, score in reciprocal_rank_fusion([dense_ranking, lexical_ranking])[:top_k]]
+
+
+def _pick_documents(centroid_scores: np.ndarray, owners: np.ndarray, documents: int, top_documents: int) -> Optional[np.ndarray]:
+    """Indexes of the documents with the best centroids, or None if the query should scan every chunk."""
+    document_scores = np.full(documents, -np.inf, dtype=np.float32)
+    np.maximum.at(document_scores, owners, centroid_scores)
+    picked = top_k_indices(document_scores, top_documents)
+    if not len(picked) or document_scores[picked[0]] < HIERARCHICAL_MIN_SCORE:
+        return None
+    return picked
+
+
+def hierarchical_search(bot_id: str, query_embedding, top_k: int, top_documents: int = HIERARCHICAL_TOP_DOCUMENTS) -> List[dict]:
+    """
+    Score the query against per-document centroids first, then score only the chunks of the best
+    top_documents documents. Falls back to a full dense scan for small bots, bots without centroids,
+    queries no centroid matches well (HIERARCHICAL_MIN_SCORE) and picks with fewer than top_k chunks.
+    """
+    query = _normalize(query_embedding)
+    if EMBEDDING_ARENA_ENABLED:
+        with stage("fetch"):
+            segment = get_segment(bot_id)
+        if segment is None:
+            return []
+        if segment.centroids is None or len(segment.documents) < HIERARCHICAL_MIN_DOCUMENTS:
+            return dense_search(bot_id, query_embedding, top_k)
+        with stage("score"):
+            picked = _pick_documents(segment.centroids @ query, segment.centroid_owners, len(segment.documents), top_documents)
+            if picked is not None:
+                rows = np.concatenate([np.arange(*segment.document_ranges[d]) for d in picked])
+                if len(rows) >= top_k:
+                    scores = segment.vectors[rows] @ query
+                    return [segment.hit(int(rows[i]), float(scores[i])) for i in top_k_indices(scores, top_k)]
+        return dense_search(bot_id, query_embedding, top_k)
+
+    with stage("fetch"):
+        model_id = get_active_model(bot_id)
+        centroids = fetch_bot_centroids(bot_id, model_id)
+    documents = list(dict.fromkeys(centroid["document_id"] for centroid in centroids))
+    if len(documents) < HIERARCHICAL_MIN_DOCUMENTS:
+        return dense_search(bot_id, query_embedding, top_k)
+    with stage("score"):
+        position = {document_id: i for i, document_id in enumerate(documents)}
+        owners = np.array([position[centroid["document_id"]] for centroid in centroids])
+        matrix = np.array([centroid["centroid"] for centroid in centroids], dtype=np.float32)
+        picked = _pick_documents(cosine_scores(query, matrix), owners, len(documents), top_documents)
+        chunk_counts = {centroid["document_id"]: centroid.get("chunk_count") or 0 for centroid in centroids}
+    if picked is None or sum(chunk_counts[documents[d]] for d in picked) < top_k:
+        return dense_search(bot_id, query_embedding, top_k)
+    picked_ids = [documents[d] for d in picked]
+    with stage("fetch"):
+        # Paged: the picked documents can hold more chunks than one PostgREST response returns
+        rows = fetch_all_rows(
+            lambda: supabase.table("embeddings")
+            .select("id,document_id,chunk_index,chunk_text,embedding")
+            .eq("bot_id", bot_id)
+            .eq("model_id", model_id)
+            .in_("document_id", picked_ids)
+            .order("id")
+        )
+    if len(rows) < top_k:
+        return dense_search(bot_id, query_embedding, top_k)
+    with stage("score"):
+        scores = cosine_scores(query, _rows_to_matrix(rows))
+        return [_row_hit(rows[i], float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+
+def retrieve(bot_id: str, query: str, query_embedding, top_k: int, mode: str = "dense", lexical_candidates: int = LEXICAL_CANDIDATES, top_documents: int = HIERARCHICAL_TOP_DOCUMENTS) -> List[dict]:
+    """
+    Return the top_k chunks for a query as dicts with id, document_id, chunk_index, chunk_text and score, best first.
+    mode is "dense" (cosine over every chunk), "hybrid" (BM25 prefilter + dense + RRF) or
+    "hierarchical" (best documents by centroid, then cosine over their chunks).
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    if mode == "hybrid":
+        return hybrid_search(bot_id, query, query_embedding, top_k, lexical_candidates)
+    if mode == "hierarchical":
+        return hierarchical_search(bot_id, query_embedding, top_k, top_documents)
+    return dense_search(bot_id, query_embedding, top_k)
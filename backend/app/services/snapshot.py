@@ -0,0 +1,208 @@
+import io
+import json
+import os
+from datetime import datetime
+from uuid import uuid4
+
+import numpy as np
+
+from app.services.supabase_service import supabase, fetch_all_rows
+from app.services.embeddings import EMBEDDING_MODEL_ALLOWLIST, is_allowed_model
+from app.services.lexical_index import rebuild_bot_index, delete_bot_index
+from app.services.document_centroids import store_bot_centroids, delete_bot_centroids
+from app.services.embedding_versions import get_active_model
+from app.services.document_store import encode_content, get_document_contents
+
+SNAPSHOT_FORMAT_VERSION = 1
+# Rows per bulk insert when loading a snapshot
+SNAPSHOT_INSERT_BATCH = int(os.getenv("SNAPSHOT_INSERT_BATCH", "500"))
+
+
+class SnapshotError(ValueError):
+    """The archive is not a usable bot snapshot (bad format or incompatible embedding model)."""
+
+
+def _pack_texts(texts: list):
+    """Concatenate texts into one UTF-8 byte array plus offsets; np.savez_compressed deflates the bytes."""
+    encoded = [(text or "").encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) for item in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_texts(blob: np.ndarray, offsets: np.ndarray) -> list:
+    data = blob.tobytes()
+    if offsets.ndim != 1 or len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(data) or np.any(np.diff(offsets) < 0):
+        raise ValueError("text offsets do not match the text data")
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def export_bot(bot_id: str) -> bytes:
+    """Write the bot's documents, chunk texts and embedding matrix to a compressed NPZ archive."""
+    bot_res = supabase.table("bots").select("*").eq("id", bot_id).execute()
+    if not bot_res.data:
+        raise LookupError("Bot not found")
+    documents = fetch_all_rows(lambda: supabase.table("documents").select("id,name,type,created_at").eq("bot_id", bot_id).order("id"))
+    model_id = get_active_model(bot_id)
+    rows = fetch_all_rows(
+        lambda: supabase.table("embeddings").select("document_id,chunk_index,chunk_text,embedding")
+        .eq("bot_id", bot_id).eq("model_id", model_id).order("id")
+    )
+    position = {doc["id"]: i for i, doc in enumerate(documents)}
+    rows = [row for row in rows if row["document_id"] in position]
+    rows.sort(key=lambda row: (position[row["document_id"]], row["chunk_index"]))
+
+    embeddings = np.array([row["embedding"] for row in rows], dtype=np.float32)
+    dim = int(embeddings.shape[1]) if len(rows) else 0
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "model_id": model_id,
+        "dim": dim,
+        "bot": {"name": bot_res.data[0].get("name")},
+        "documents": [{"name": doc["name"], "type": doc["type"], "created_at": doc["created_at"]} for doc in documents],
+        "chunk_count": len(rows),
+        "exported_at": datetime.utcnow().isoformat(),
+    }
+    chunk_texts, chunk_text_offsets = _pack_texts([row["chunk_text"] for row in rows])
+    contents = get_document_contents([doc["id"] for doc in documents])
+    document_contents, document_content_offsets = _pack_texts([contents.get(doc["id"], "") for doc in documents])
+
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer,
+        manifest=np.frombuffer(json.dumps(manifest).encode("utf-8"), dtype=np.uint8),
+        embeddings=embeddings.reshape(len(rows), dim),
+        chunk_document=np.array([position[row["document_id"]] for row in rows], dtype=np.int32),
+        chunk_index=np.array([row["chunk_index"] for row in rows], dtype=np.int32),
+        chunk_texts=chunk_texts,
+        chunk_text_offsets=chunk_text_offsets,
+        document_contents=document_contents,
+        document_content_offsets=document_content_offsets,
+    )
+    return buffer.getvalue()
+
+
+def load_snapshot(data: bytes, check_model: bool = True) -> dict:
+    """Read and validate an archive written by export_bot."""
+    if not data.startswith(b"PK"):
+        raise SnapshotError("Not a valid bot snapshot: expected an .npz archive")
+    try:
+        with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+            manifest = json.loads(archive["manifest"].tobytes().decode("utf-8"))
+            snapshot = {
+                "manifest": manifest,
+                "embeddings": archive["embeddings"],
+                "chunk_document": archive["chunk_document"],
+                "chunk_index": archive["chunk_index"],
+                "chunk_texts": _unpack_texts(archive["chunk_texts"], archive["chunk_text_offsets"]),
+                "document_contents": _unpack_texts(archive["document_contents"], archive["document_content_offsets"]),
+            }
+    except (ValueError, KeyError, OSError) as e:
+        raise SnapshotError(f"Not a valid bot snapshot: {e}")
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format version: {manifest.get('format_version')}")
+    _check_consistent(snapshot)
+    if check_model:
+        check_compatible(manifest)
+    return snapshot
+
+
+def _check_consistent(snapshot: dict):
+    """Check that the arrays agree with the manifest and each other, so an import cannot fail halfway."""
+    manifest = snapshot["manifest"]
+    documents, chunk_count, dim = manifest.get("documents"), manifest.get("chunk_count"), manifest.get("dim")
+    if not isinstance(documents, list) or not all(isinstance(doc, dict) and "name" in doc and "type" in doc for doc in documents):
+        raise SnapshotError("Not a valid bot snapshot: bad document list")
+    if not isinstance(manifest.get("bot"), dict) or not isinstance(manifest.get("model_id"), str):
+        raise SnapshotError("Not a valid bot snapshot: missing bot or model")
+    if not isinstance(chunk_count, int) or not isinstance(dim, int) or chunk_count < 0 or dim < 0:
+        raise SnapshotError("Not a valid bot snapshot: bad chunk count or dimension")
+    embeddings = snapshot["embeddings"]
+    if embeddings.ndim != 2 or embeddings.shape != (chunk_count, dim if chunk_count else embeddings.shape[1]):
+        raise SnapshotError(f"Not a valid bot snapshot: embeddings are {embeddings.shape}, expected ({chunk_count}, {dim})")
+    if not np.issubdtype(embeddings.dtype, np.floating) or not np.all(np.isfinite(embeddings)):
+        raise SnapshotError("Not a valid bot snapshot: embeddings must be finite floats")
+    for name in ("chunk_document", "chunk_index"):
+        array = snapshot[name]
+        if array.ndim != 1 or len(array) != chunk_count or not np.issubdtype(array.dtype, np.integer):
+            raise SnapshotError(f"Not a valid bot snapshot: {name} does not have {chunk_count} entries")
+    if len(snapshot["chunk_texts"]) != chunk_count:
+        raise SnapshotError(f"Not a valid bot snapshot: {len(snapshot['chunk_texts'])} chunk texts for {chunk_count} chunks")
+    if chunk_count and (snapshot["chunk_document"].min() < 0 or snapshot["chunk_document"].max() >= len(documents)):
+        raise SnapshotError("Not a valid bot snapshot: a chunk refers to a document that is not in it")
+    if len(snapshot["document_contents"]) != len(documents):
+        raise SnapshotError(f"Not a valid bot snapshot: {len(snapshot['document_contents'])} document bodies for {len(documents)} documents")
+
+
+def check_compatible(manifest: dict):
+    """Refuse snapshots embedded with a model this server cannot serve; they would need re-embedding."""
+    if not is_allowed_model(manifest.get("model_id")):
+        raise SnapshotError(
+            f"Snapshot was embedded with {manifest.get('model_id')}, but this server only serves "
+            f"{', '.join(sorted(EMBEDDING_MODEL_ALLOWLIST))} (see EMBEDDING_MODEL_ALLOWLIST)."
+        )
+
+
+def _delete_bot(bot_id: str):
+    """Remove everything a failed import wrote."""
+    supabase.table("embeddings").delete().eq("bot_id", bot_id).execute()
+    delete_bot_centroids(bot_id)
+    delete_bot_index(bot_id)
+    supabase.table("documents").delete().eq("bot_id", bot_id).execute()
+    supabase.table("bots").delete().eq("id", bot_id).execute()
+
+
+def _insert_batched(table: str, rows: list):
+    for start in range(0, len(rows), SNAPSHOT_INSERT_BATCH):
+        supabase.table(table).insert(rows[start:start + SNAPSHOT_INSERT_BATCH]).execute()
+
+
+def import_snapshot(snapshot: dict, bot_name: str = None) -> dict:
+    """Bulk-load a snapshot into a new bot without running the embedding model."""
+    manifest = snapshot["manifest"]
+    bot_id = str(uuid4())
+    created_at = datetime.utcnow().isoformat()
+    name = bot_name or manifest["bot"].get("name") or f"Imported bot {bot_id[:8]}"
+    model_id = manifest["model_id"]
+    # The snapshot's model becomes the bot's active model, whatever this server's default is
+    supabase.table("bots").insert({"id": bot_id, "name": name, "embedding_model": model_id, "created_at": created_at}).execute()
+    try:
+        document_ids = [str(uuid4()) for _ in manifest["documents"]]
+        _insert_batched("documents", [
+            {
+                "id": document_ids[i],
+                "bot_id": bot_id,
+                "name": doc["name"],
+                "type": doc["type"],
+                **encode_content(snapshot["document_contents"][i]),
+                "created_at": created_at,
+            }
+            for i, doc in enumerate(manifest["documents"])
+        ])
+        _insert_batched("embeddings", [
+            {
+                "id": str(uuid4()),
+                "document_id": document_ids[int(snapshot["chunk_document"][i])],
+                "bot_id": bot_id,
+                "chunk_index": int(snapshot["chunk_index"][i]),
+                "chunk_text": snapshot["chunk_texts"][i],
+                "embedding": snapshot["embeddings"][i].tolist(),
+                "model_id": model_id,
+                "created_at": created_at,
+            }
+            for i in range(manifest["chunk_count"])
+        ])
+        embeddings_by_document = {}
+        for i in range(manifest["chunk_count"]):
+            embeddings_by_document.setdefault(document_ids[int(snapshot["chunk_document"][i])], []).append(snapshot["embeddings"][i])
+        store_bot_centroids(bot_id, model_id, embeddings_by_document)
+        rebuild_bot_index(bot_id)
+    except Exception:
+        _delete_bot(bot_id)
+        raise
+    return {"id": bot_id, "name": name, "created_at": created_at, "documents": len(document_ids), "chunks": manifest["chunk_count"]}
+
+
+def clone_bot(bot_id: str, bot_name: str = None) -> dict:
+    """Copy a bot's content and vectors into a new bot, which is served from the same embedding model."""
+    return import_snapshot(load_snapshot(export_bot(bot_id), check_model=False), bot_name)
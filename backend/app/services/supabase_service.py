@@ -10,4 +10,21 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("Supabase credentials are not set in environment variables.")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY) 
\ No newline at end of file
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# Supabase returns at most this many rows per request
+PAGE_SIZE = 1000
+
+def fetch_all_rows(build_query, page_size: int = PAGE_SIZE) -> list:
+    """
+    Page through a select with .range() and return every row.
+    build_query must return a fresh, ordered query builder on each call.
+    """
+    rows = []
+    start = 0
+    while True:
+        res = build_query().range(start, start + page_size - 1).execute()
+        rows.extend(res.data or [])
+        if not res.data or len(res.data) < page_size:
+            return rows
+        start += page_size
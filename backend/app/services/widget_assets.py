@@ -0,0 +1,150 @@
+"""
+Build step and lookup for the embeddable widget's static assets.
+
+The sources in app/widget are copied to WIDGET_ASSET_DIR under content-hashed names
+(widget.3f9c2a1b7d04.js), each with a brotli (.br) and gzip (.gz) variant next to it, and a
+manifest.json mapping source names to hashed ones. A changed file gets a new URL, so the files
+can be served with an immutable Cache-Control and cached by browsers and CDNs for good.
+
+Run the build as part of a deploy, from the backend directory:
+    python -m app.services.widget_assets
+A worker that finds no build, or one older than the sources, builds the assets itself on first use.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from typing import Optional, Tuple
+
+from app.services.log import get_logger
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "widget")
+WIDGET_ASSET_DIR = os.getenv("WIDGET_ASSET_DIR", "static/widget")
+# Files shipped to browsers, with the media type they are served as
+WIDGET_ASSETS = {
+    "loader.js": "application/javascript",
+    "widget.js": "application/javascript",
+    "widget.css": "text/css",
+}
+# Hex digits of the content hash kept in file names
+HASH_LENGTH = 12
+# Variants in order of preference, as (Content-Encoding, file suffix)
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+logger = get_logger("widget_assets")
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def _brotli():
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+
+def _write(path: str, data: bytes):
+    # Write then rename, so a worker never serves a half-written file while another one builds
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _hashed_name(name: str, data: bytes) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def build_assets(output_dir: str = None) -> dict:
+    """Write the hashed and precompressed assets and the manifest; returns the manifest."""
+    output_dir = output_dir or WIDGET_ASSET_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    brotli = _brotli()
+    if brotli is None:
+        logger.warning("brotli is not installed, widget assets are only precompressed with gzip")
+    files = {}
+    for name, media_type in WIDGET_ASSETS.items():
+        with open(os.path.join(SOURCE_DIR, name), "rb") as f:
+            data = f.read()
+        hashed = _hashed_name(name, data)
+        path = os.path.join(output_dir, hashed)
+        _write(path, data)
+        encodings = ["gzip"]
+        _write(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(path + ".br", brotli.compress(data, quality=11))
+            encodings.insert(0, "br")
+        files[name] = {"file": hashed, "media_type": media_type, "size": len(data), "encodings": encodings}
+    manifest = {"files": files}
+    _write(os.path.join(output_dir, "manifest.json"), json.dumps(manifest, indent=2).encode("utf-8"))
+    return manifest
+
+
+def _is_current(manifest: dict) -> bool:
+    for name in WIDGET_ASSETS:
+        entry = manifest.get("files", {}).get(name)
+        with open(os.path.join(SOURCE_DIR, name), "rb") as f:
+            if entry is None or entry["file"] != _hashed_name(name, f.read()):
+                return False
+        if not os.path.exists(os.path.join(WIDGET_ASSET_DIR, entry["file"])):
+            return False
+    return True
+
+
+def get_manifest() -> dict:
+    """The asset manifest, loaded once per worker; (re)builds the assets if the build is missing or stale."""
+    global _manifest
+    if _manifest is not None:
+        return _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            path = os.path.join(WIDGET_ASSET_DIR, "manifest.json")
+            try:
+                with open(path) as f:
+                    manifest = json.load(f)
+            except FileNotFoundError:
+                manifest = None
+            if manifest is None or not _is_current(manifest):
+                logger.info("Widget assets missing or out of date, building them", extra={"dir": WIDGET_ASSET_DIR})
+                manifest = build_assets()
+            _manifest = manifest
+    return _manifest
+
+
+def asset_url(name: str) -> str:
+    """Path of the hashed asset built from a source file, e.g. /embed/static/widget.3f9c2a1b7d04.js."""
+    return f"/embed/static/{get_manifest()['files'][name]['file']}"
+
+
+def _variant(entry: dict, accept_encoding: str) -> Tuple[str, str, Optional[str]]:
+    path = os.path.join(WIDGET_ASSET_DIR, entry["file"])
+    accepted = {value.split(";")[0].strip() for value in accept_encoding.split(",")}
+    for encoding, suffix in _ENCODINGS:
+        if encoding in accepted and encoding in entry["encodings"]:
+            return path + suffix, entry["media_type"], encoding
+    return path, entry["media_type"], None
+
+
+def resolve_asset(filename: str, accept_encoding: str = "") -> Optional[Tuple[str, str, Optional[str]]]:
+    """
+    (path, media type, Content-Encoding) of the best variant of a hashed file for the client's
+    Accept-Encoding, or None for names the build did not produce.
+    """
+    for entry in get_manifest()["files"].values():
+        if entry["file"] == filename:
+            return _variant(entry, accept_encoding)
+    return None
+
+
+def resolve_source(name: str, accept_encoding: str = "") -> Tuple[str, str, Optional[str]]:
+    """Like resolve_asset, for the current build of a source file such as "loader.js"."""
+    return _variant(get_manifest()["files"][name], accept_encoding)
+
+
+if __name__ == "__main__":
+    for name, info in build_assets()["files"].items():
+        print(f"{name} -> {info['file']} ({', '.join(info['encodings'])})")
@@ -0,0 +1,26 @@
+(function() {
+    'use strict';
+
+    window.ChatbotWidget = {
+        init: function(config) {
+            const { token, containerId, apiUrl } = config;
+            const container = document.getElementById(containerId);
+
+            if (!container) {
+                console.error('Chatbot widget container not found:', containerId);
+                return;
+            }
+
+            // Create iframe
+            const iframe = document.createElement('iframe');
+            iframe.src = `${apiUrl}/embed/widget/${token}`;
+            iframe.style.width = '100%';
+            iframe.style.height = '600px';
+            iframe.style.border = 'none';
+            iframe.style.borderRadius = '10px';
+            iframe.style.boxShadow = '0 4px 12px rgba(0,0,0,0.15)';
+
+            container.appendChild(iframe);
+        }
+    };
+})();
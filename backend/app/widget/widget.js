@@ -0,0 +1,128 @@
+(function() {
+    'use strict';
+
+    // Per-widget settings come from data attributes, so this file is the same for every bot and can be cached for good
+    const API_URL = document.body.dataset.apiUrl;
+    const EMBED_TOKEN = document.body.dataset.embedToken;
+    const BOT_ID = document.body.dataset.botId;
+
+    const chatMessages = document.getElementById('chatMessages');
+    const messageInput = document.getElementById('messageInput');
+    const sendButton = document.getElementById('sendButton');
+    const chatForm = document.getElementById('chatForm');
+    const typingIndicator = document.getElementById('typingIndicator');
+
+    // One conversation per browser tab, so the bot remembers earlier questions
+    const SESSION_KEY = `botverse-session-${BOT_ID}`;
+    let fallbackSessionId = null;
+
+    function newSessionId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    }
+
+    function getSessionId() {
+        try {
+            let sessionId = sessionStorage.getItem(SESSION_KEY);
+            if (!sessionId) {
+                sessionId = newSessionId();
+                sessionStorage.setItem(SESSION_KEY, sessionId);
+            }
+            return sessionId;
+        } catch (e) {
+            // Storage can be blocked for third-party iframes; keep the session for this page view
+            fallbackSessionId = fallbackSessionId || newSessionId();
+            return fallbackSessionId;
+        }
+    }
+
+    function addMessage(content, isUser = false) {
+        const messageDiv = document.createElement('div');
+        messageDiv.className = `message ${isUser ? 'user' : 'bot'}`;
+
+        messageDiv.innerHTML = `
+            <div class="avatar ${isUser ? 'user' : 'bot'}">
+                ${isUser ? '👤' : '🤖'}
+            </div>
+            <div class="message-bubble">
+                ${content}
+            </div>
+        `;
+
+        chatMessages.appendChild(messageDiv);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+
+    function showTyping() {
+        typingIndicator.style.display = 'block';
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+
+    function hideTyping() {
+        typingIndicator.style.display = 'none';
+    }
+
+    function showError(message) {
+        const errorDiv = document.createElement('div');
+        errorDiv.className = 'error-message';
+        errorDiv.textContent = message;
+        chatMessages.appendChild(errorDiv);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+
+    async function sendMessage(userMessage) {
+        try {
+            showTyping();
+            sendButton.disabled = true;
+
+            const response = await fetch(`${API_URL}/embed/chat`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    bot_id: BOT_ID,
+                    user_query: userMessage,
+                    embed_token: EMBED_TOKEN,
+                    session_id: getSessionId()
+                })
+            });
+
+            if (!response.ok) {
+                throw new Error('Failed to get response');
+            }
+
+            const data = await response.json();
+            hideTyping();
+            addMessage(data.answer, false);
+
+        } catch (error) {
+            hideTyping();
+            showError('Sorry, I encountered an error. Please try again.');
+            console.error('Chat error:', error);
+        } finally {
+            sendButton.disabled = false;
+        }
+    }
+
+    chatForm.addEventListener('submit', async (e) => {
+        e.preventDefault();
+
+        const message = messageInput.value.trim();
+        if (!message) return;
+
+        addMessage(message, true);
+        messageInput.value = '';
+
+        await sendMessage(message);
+    });
+
+    messageInput.addEventListener('keypress', (e) => {
+        if (e.key === 'Enter' && !e.shiftKey) {
+            e.preventDefault();
+            chatForm.dispatchEvent(new Event('submit'));
+        }
+    });
+})();
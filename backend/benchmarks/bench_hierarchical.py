@@ -0,0 +1,118 @@
+"""
+Recall and latency of hierarchical retrieval (best documents by centroid, then their chunks)
+against the flat dense scan, on a synthetic bot whose documents each cover a few sub-topics.
+
+Run from the backend directory:
+    python -m benchmarks.bench_hierarchical [--documents 300] [--top-documents 2,4,8,16] [--no-arena]
+
+Recall@k is the share of the flat scan's top k chunks that hierarchical retrieval also returns.
+"""
+import argparse
+import math
+import os
+import statistics
+import time
+
+import numpy as np
+
+from benchmarks.fakes import FakeSupabase, install_fakes
+
+
+def seed_vectors(db: FakeSupabase, bot_id: str, args, rng: np.random.Generator) -> list:
+    """Insert documents whose chunks cluster around a few sections per document; returns every chunk vector."""
+    from app.services.document_centroids import store_document_centroids
+    from app.services.gemini_service import EMBEDDING_MODEL_ID
+
+    db.table("bots").insert({"id": bot_id, "name": "Hierarchical benchmark", "embedding_model": EMBEDDING_MODEL_ID, "created_at": "2024-01-01T00:00:00"}).execute()
+    all_vectors = []
+    for d in range(args.documents):
+        doc_id = f"{bot_id}-doc-{d}"
+        chunks = int(rng.integers(max(1, args.chunks_per_document // 4), args.chunks_per_document * 2))
+        center = rng.normal(size=args.dim)
+        sections = center + rng.normal(scale=args.section_spread, size=(args.sections, args.dim))
+        vectors = sections[rng.integers(0, args.sections, size=chunks)] + rng.normal(scale=args.chunk_spread, size=(chunks, args.dim))
+        vectors = vectors.astype(np.float32)
+        db.table("documents").insert({"id": doc_id, "bot_id": bot_id, "name": f"doc-{d}.txt", "type": "txt", "created_at": "2024-01-01T00:00:00"}).execute()
+        db.table("embeddings").insert([
+            {
+                "id": f"{doc_id}-chunk-{i}",
+                "document_id": doc_id,
+                "bot_id": bot_id,
+                "chunk_index": i,
+                "chunk_text": f"chunk {i} of document {d}",
+                "embedding": vector.tolist(),
+                "model_id": EMBEDDING_MODEL_ID,
+                "created_at": "2024-01-01T00:00:00",
+            }
+            for i, vector in enumerate(vectors)
+        ]).execute()
+        store_document_centroids(bot_id, doc_id, EMBEDDING_MODEL_ID, vectors)
+        all_vectors.extend(vectors)
+    return all_vectors
+
+
+def p95(latencies: list) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=300)
+    parser.add_argument("--chunks-per-document", type=int, default=20, help="average; actual counts vary between a quarter and twice this")
+    parser.add_argument("--sections", type=int, default=3, help="sub-topics per document")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--section-spread", type=float, default=1.5, help="distance of a document's sections from its center")
+    parser.add_argument("--chunk-spread", type=float, default=1.2, help="distance of chunks from their section")
+    parser.add_argument("--query-noise", type=float, default=1.5, help="distance of a query from the chunk it was drawn from")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--top-documents", type=lambda value: [int(v) for v in value.split(",")], default=[2, 4, 8, 16])
+    parser.add_argument("--no-arena", action="store_true", help="read vectors from (fake) Supabase instead of the embedding arena")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ["EMBEDDING_ARENA_ENABLED"] = "false" if args.no_arena else "true"
+    os.environ["HIERARCHICAL_MIN_DOCUMENTS"] = "1"
+    db = FakeSupabase()
+    install_fakes(db)
+    from app.services.retrieval import retrieve
+
+    rng = np.random.default_rng(args.seed)
+    bot_id = "bench-hierarchical"
+    vectors = seed_vectors(db, bot_id, args, rng)
+    queries = [vectors[i] + rng.normal(scale=args.query_noise, size=args.dim).astype(np.float32) for i in rng.integers(0, len(vectors), size=args.queries)]
+    print(f"{args.documents} documents, {len(vectors)} chunks, dim {args.dim}, {args.queries} queries, top_k {args.top_k}, {'supabase' if args.no_arena else 'arena'}")
+
+    # Warm the arena / caches so the first timed query does not pay for building the segment
+    retrieve(bot_id, "", queries[0], args.top_k, mode="dense")
+    retrieve(bot_id, "", queries[0], args.top_k, mode="hierarchical")
+
+    flat, flat_ms = [], []
+    for query in queries:
+        hits, ms = timed(retrieve, bot_id, "", query, args.top_k, mode="dense")
+        flat.append({hit["id"] for hit in hits})
+        flat_ms.append(ms)
+    flat_mean = statistics.mean(flat_ms)
+
+    print(f"{'mode':<22}{'recall@k':>10}{'mean ms':>10}{'p95 ms':>10}{'speedup':>10}")
+    print(f"{'flat':<22}{1.0:>10.3f}{flat_mean:>10.2f}{p95(flat_ms):>10.2f}{1.0:>9.1f}x")
+    for top_documents in args.top_documents:
+        recalls, latencies = [], []
+        for query, expected in zip(queries, flat):
+            hits, ms = timed(retrieve, bot_id, "", query, args.top_k, mode="hierarchical", top_documents=top_documents)
+            recalls.append(len(expected & {hit["id"] for hit in hits}) / max(1, len(expected)))
+            latencies.append(ms)
+        mean_ms = statistics.mean(latencies)
+        label = f"hierarchical/M={top_documents}"
+        print(f"{label:<22}{statistics.mean(recalls):>10.3f}{mean_ms:>10.2f}{p95(latencies):>10.2f}{flat_mean / mean_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
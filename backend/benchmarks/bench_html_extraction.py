@@ -0,0 +1,76 @@
+"""
+Compare HTML text extraction backends on the saved pages in benchmarks/fixtures/html.
+
+Run from the backend directory:
+    python -m benchmarks.bench_html_extraction [--iterations 50] [--fixtures DIR]
+
+"bs4/full" is the extractor /scrape used before the pluggable extractor was added. Each extractor
+gets one untimed warmup pass over the pages before the timed iterations.
+"""
+import argparse
+import math
+import os
+import statistics
+import time
+
+from app.services.file_parser import chunk_text
+from app.services.html_extractor import available_backends, extract_text
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "html")
+
+
+def load_fixtures(directory: str) -> dict:
+    pages = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), encoding="utf-8", errors="replace") as f:
+                pages[name] = f.read()
+    return pages
+
+
+def p95(timings: list) -> float:
+    """Nearest-rank 95th percentile: the smallest value at least 95% of the timings are at or below."""
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+
+def bench(pages: dict, backend: str, main_content: bool, iterations: int) -> dict:
+    # Untimed warmup pass: the first call imports the parser and fills its caches
+    texts = [extract_text(html, backend=backend, main_content=main_content) for html in pages.values()]
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for html in pages.values():
+            extract_text(html, backend=backend, main_content=main_content)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "mean_ms": statistics.mean(timings),
+        "p95_ms": p95(timings),
+        "chars": sum(len(t) for t in texts),
+        "chunks": sum(len(chunk_text(t)) for t in texts),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    args = parser.parse_args()
+
+    pages = load_fixtures(args.fixtures)
+    if not pages:
+        raise SystemExit(f"No HTML fixtures found in {args.fixtures}")
+    print(f"{len(pages)} pages, {sum(len(p) for p in pages.values()) / 1024:.1f} KiB, {args.iterations} iterations")
+
+    baseline = bench(pages, "bs4", False, args.iterations)
+    print(f"{'extractor':<22}{'mean ms':>10}{'p95 ms':>10}{'speedup':>10}{'chars':>10}{'chunks':>10}")
+    for backend in available_backends():
+        for main_content in (False, True):
+            result = baseline if (backend, main_content) == ("bs4", False) else bench(pages, backend, main_content, args.iterations)
+            label = f"{backend}/{'main' if main_content else 'full'}"
+            speedup = baseline["mean_ms"] / result["mean_ms"] if result["mean_ms"] else float("inf")
+            print(f"{label:<22}{result['mean_ms']:>10.2f}{result['p95_ms']:>10.2f}{speedup:>9.1f}x{result['chars']:>10}{result['chunks']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+End-to-end load and latency benchmark for the FastAPI app, run fully in-process against
+fake Supabase tables, a fake Gemini model and a fake embedding model.
+
+Run from the backend directory:
+    python -m benchmarks.bench_load --chunks 2000 --concurrency 1,8,32 --requests 200
+    python -m benchmarks.bench_load --compare benchmarks/results/<earlier run>.json
+
+Each run is saved to benchmarks/results/<timestamp>-<commit>.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.fakes import FakeSupabase, install_fake_web, install_fakes
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "html")
+SCENARIOS = ("chat", "embed_chat", "upload", "scrape")
+
+VOCABULARY = (
+    "account billing invoice refund subscription plan upgrade downgrade password login security token "
+    "device firmware install configure reset network router wifi bluetooth battery charger warranty "
+    "shipping delivery tracking return exchange order payment card bank transfer support ticket agent "
+    "latency outage status region backup restore export import report dashboard widget integration api"
+).split()
+
+
+def synthetic_text(words: int, rng: random.Random) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def seed_bot(db: FakeSupabase, documents: int, chunks_per_document: int, seed: int = 0) -> dict:
+    """Create a bot with synthetic documents, embeddings, a lexical index and an embed token."""
+    from app.services.file_parser import chunk_text
+    from app.services.gemini_service import get_text_embeddings, EMBEDDING_MODEL_ID
+    from app.services.lexical_index import rebuild_bot_index
+    from app.services.document_store import encode_content
+    from app.services.document_centroids import store_document_centroids
+
+    rng = random.Random(seed)
+    bot_id = f"bench-bot-{seed}"
+    created_at = datetime.utcnow().isoformat()
+    db.table("bots").insert({"id": bot_id, "name": "Benchmark bot", "embedding_model": EMBEDDING_MODEL_ID, "created_at": created_at}).execute()
+    embed_token = f"bench-token-{seed}"
+    db.table("embed_tokens").insert({"bot_id": bot_id, "embed_token": embed_token, "is_active": True, "created_at": created_at}).execute()
+    for d in range(documents):
+        # chunk_text makes 500-character chunks with a 450-character stride; ~6.5 characters per word
+        text = synthetic_text(chunks_per_document * 70, rng)
+        doc_id = f"{bot_id}-doc-{d}"
+        db.table("documents").insert({"id": doc_id, "bot_id": bot_id, "name": f"doc-{d}.txt", "type": "txt", **encode_content(text), "created_at": created_at}).execute()
+        chunks = chunk_text(text)
+        embeddings = get_text_embeddings(chunks)
+        db.table("embeddings").insert([
+            {
+                "id": f"{doc_id}-chunk-{i}",
+                "document_id": doc_id,
+                "bot_id": bot_id,
+                "chunk_index": i,
+                "chunk_text": chunk,
+                "embedding": embedding,
+                "model_id": EMBEDDING_MODEL_ID,
+                "created_at": created_at,
+            }
+            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+        ]).execute()
+        store_document_centroids(bot_id, doc_id, EMBEDDING_MODEL_ID, embeddings)
+    rebuild_bot_index(bot_id)
+    chunk_count = sum(1 for row in db.tables["embeddings"] if row["bot_id"] == bot_id)
+    return {"bot_id": bot_id, "embed_token": embed_token, "chunks": chunk_count}
+
+
+def make_request(scenario: str, bot: dict, rng: random.Random) -> dict:
+    query = synthetic_text(rng.randint(5, 15), rng)
+    if scenario == "chat":
+        return {"method": "POST", "url": "/chat", "json": {"bot_id": bot["bot_id"], "user_query": query}}
+    if scenario == "embed_chat":
+        return {"method": "POST", "url": "/embed/chat", "json": {"bot_id": bot["bot_id"], "user_query": query, "embed_token": bot["embed_token"]}}
+    if scenario == "upload":
+        content = synthetic_text(rng.randint(500, 3000), rng).encode("utf-8")
+        return {"method": "POST", "url": "/upload", "files": {"file": ("bench.txt", content, "text/plain")}}
+    if scenario == "scrape":
+        return {"method": "POST", "url": "/scrape", "json": {"url": "http://bench.example/page"}}
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def run_level(client, scenario: str, bot: dict, concurrency: int, total: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    requests = [make_request(scenario, bot, rng) for _ in range(total)]
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                request = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            response = await client.request(**request)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "mean_ms": statistics.mean(latencies) if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "throughput_rps": total / elapsed if elapsed else 0.0,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline.get('git_commit')} ({baseline_path}):")
+    print(f"{'scenario':<12}{'conc':>6}{'p50 Δ':>10}{'p95 Δ':>10}{'p99 Δ':>10}{'rps Δ':>10}")
+    for result in current["results"]:
+        old = previous.get((result["scenario"], result["concurrency"]))
+        if old is None:
+            continue
+
+        def delta(key):
+            return f"{(result[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else "n/a"
+
+        print(f"{result['scenario']:<12}{result['concurrency']:>6}{delta('p50_ms'):>10}{delta('p95_ms'):>10}{delta('p99_ms'):>10}{delta('throughput_rps'):>10}")
+
+
+async def main_async(args):
+    db = FakeSupabase(latency_ms=args.supabase_latency_ms)
+    # The real quota would dominate every latency number, so it is off unless asked for
+    os.environ["GEMINI_RPM"] = str(args.gemini_rpm)
+    # All benchmark traffic comes from one embed token and one IP, which the per-caller limits would shed
+    os.environ.setdefault("EMBED_TOKEN_RATE", "0")
+    os.environ.setdefault("EMBED_IP_RATE", "0")
+    install_fakes(db, gemini_latency_ms=args.gemini_latency_ms, embed_call_ms=args.embed_call_ms, embed_per_text_ms=args.embed_per_text_ms, gemini_error_rate=args.gemini_error_rate)
+    pages = [open(os.path.join(FIXTURES_DIR, name), encoding="utf-8").read() for name in sorted(os.listdir(FIXTURES_DIR)) if name.endswith(".html")]
+    install_fake_web(pages)
+
+    import httpx
+    from app.main import app
+
+    chunks_per_document = max(1, args.chunks // args.documents)
+    bot = seed_bot(db, args.documents, chunks_per_document, seed=args.seed)
+    print(f"Seeded bot with {bot['chunks']} chunks in {args.documents} documents")
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                if args.warmup:
+                    await run_level(client, scenario, bot, min(concurrency, args.warmup), args.warmup, seed=args.seed + 1)
+                result = await run_level(client, scenario, bot, concurrency, args.requests, seed=args.seed)
+                results.append(result)
+                print(
+                    f"{scenario:<12} c={concurrency:<4} p50={result['p50_ms']:8.1f}ms p95={result['p95_ms']:8.1f}ms "
+                    f"p99={result['p99_ms']:8.1f}ms {result['throughput_rps']:8.1f} req/s errors={result['errors']}"
+                )
+
+    run = {
+        "git_commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        "chunks": bot["chunks"],
+        "results": results,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{run['git_commit']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nSaved results to {path}")
+    if args.compare:
+        compare(run, args.compare)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000, help="approximate number of chunks in the synthetic bot")
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=lambda value: [int(v) for v in value.split(",")], default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300.0)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-rpm", type=int, default=0, help="Gemini requests-per-minute quota to model (0 = unlimited)")
+    parser.add_argument("--supabase-latency-ms", type=float, default=2.0)
+    parser.add_argument("--embed-call-ms", type=float, default=5.0)
+    parser.add_argument("--embed-per-text-ms", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=RESULTS_DIR)
+    parser.add_argument("--compare", help="earlier results file to compare this run with")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main_async(parse_args(sys.argv[1:])))
@@ -0,0 +1,354 @@
+"""
+In-process fakes for Supabase, Gemini and the BGE embedding model.
+
+install_fakes() must run before anything under app/ is imported: the services create their
+clients at import time, so the fakes are put in sys.modules in place of the real SDKs.
+"""
+import asyncio
+import copy
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import types
+import zlib
+from uuid import uuid4
+
+import httpx
+import numpy as np
+
+EMBEDDING_DIM = 768
+# Primary keys of tables that are upserted by something other than "id"
+UPSERT_KEYS = {"lexical_indexes": ("bot_id",), "reembed_jobs": ("bot_id",), "chat_sessions": ("bot_id", "session_id")}
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeAPIError(Exception):
+    """Stand-in for postgrest's APIError."""
+
+    def __init__(self, message: str, code: str = None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+class FakeQuery:
+    """Subset of the postgrest query builder used by the backend."""
+
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.operation = "select"
+        self.columns = "*"
+        self.payload = None
+        self.filters = []
+        self.ordering = []
+        self.row_limit = None
+        self.row_range = None
+        self.row_offset = 0
+        self.count = None
+
+    def select(self, columns: str = "*", count: str = None):
+        self.columns = columns
+        self.count = count
+        return self
+
+    def insert(self, payload):
+        self.operation, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload):
+        self.operation, self.payload = "upsert", payload
+        return self
+
+    def update(self, payload):
+        self.operation, self.payload = "update", payload
+        return self
+
+    def delete(self):
+        self.operation = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda row: row.get(column) != value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def is_(self, column, value):
+        expected = None if value in (None, "null") else value
+        self.filters.append(lambda row: row.get(column) is expected)
+        return self
+
+    def order(self, column, desc: bool = False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count: int):
+        self.row_limit = count
+        return self
+
+    def range(self, start: int, end: int):
+        self.row_range = (start, end)
+        return self
+
+    def offset(self, count: int):
+        self.row_offset = count
+        return self
+
+    def _project(self, row: dict) -> dict:
+        if self.columns.strip() == "*":
+            return copy.deepcopy(row)
+        return {column.strip(): copy.deepcopy(row.get(column.strip())) for column in self.columns.split(",")}
+
+    def execute(self) -> FakeResponse:
+        self.db.simulate_latency()
+        with self.db.lock:
+            rows = self.db.tables.setdefault(self.table, [])
+            if self.operation in ("insert", "upsert"):
+                payload = self.payload if isinstance(self.payload, list) else [self.payload]
+                inserted = []
+                for item in payload:
+                    item = copy.deepcopy(item)
+                    if self.table not in UPSERT_KEYS:
+                        item.setdefault("id", str(uuid4()))
+                    keys = UPSERT_KEYS.get(self.table, ("id",))
+                    if self.operation == "upsert":
+                        rows[:] = [row for row in rows if any(row.get(key) != item.get(key) for key in keys)]
+                    elif self.table in UPSERT_KEYS and any(all(row.get(key) == item.get(key) for key in keys) for row in rows):
+                        raise FakeAPIError(f"duplicate key value violates unique constraint on {self.table}", code="23505")
+                    rows.append(item)
+                    inserted.append(copy.deepcopy(item))
+                return FakeResponse(inserted)
+            matched = [row for row in rows if all(check(row) for check in self.filters)]
+            if self.operation == "delete":
+                doomed = {id(row) for row in matched}
+                rows[:] = [row for row in rows if id(row) not in doomed]
+                return FakeResponse([copy.deepcopy(row) for row in matched])
+            if self.operation == "update":
+                for row in matched:
+                    row.update(copy.deepcopy(self.payload))
+                return FakeResponse([copy.deepcopy(row) for row in matched])
+            total = len(matched)
+            for column, desc in reversed(self.ordering):
+                matched.sort(key=lambda row: (row.get(column) is None, row.get(column) or ""), reverse=desc)
+            if self.row_range is not None:
+                matched = matched[self.row_range[0]:self.row_range[1] + 1]
+            matched = matched[self.row_offset:]
+            if self.row_limit is not None:
+                matched = matched[:self.row_limit]
+            if self.db.max_rows is not None:
+                matched = matched[:self.db.max_rows]
+            return FakeResponse([self._project(row) for row in matched], total if self.count else None)
+
+
+class FakeSupabase:
+    """
+    Thread-safe in-memory tables with a simulated round-trip latency per query.
+    max_rows caps the rows a select returns, like PostgREST's max-rows setting (1000 on Supabase).
+    """
+
+    def __init__(self, latency_ms: float = 0.0, max_rows: int = None):
+        self.tables = {}
+        self.max_rows = max_rows
+        self.lock = threading.RLock()
+        self.latency_ms = latency_ms
+        self.queries = 0
+
+    def simulate_latency(self):
+        with self.lock:
+            self.queries += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+
+def _postgrest_literal(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _postgrest_list(text: str) -> set:
+    """Values of an in.(...) operand, which may be double-quoted with backslash escapes."""
+    values, current, quoted, escaped, was_quoted = set(), [], False, False, False
+    for char in text[1:-1]:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif quoted and char == "\\":
+            escaped = True
+        elif char == '"':
+            quoted, was_quoted = not quoted, True
+        elif char == "," and not quoted:
+            values.add("".join(current) if was_quoted else "".join(current).strip())
+            current, was_quoted = [], False
+        else:
+            current.append(char)
+    if current or was_quoted:
+        values.add("".join(current) if was_quoted else "".join(current).strip())
+    return values
+
+
+class FakePostgrestTransport(httpx.AsyncBaseTransport):
+    """Answers the data-access layer's PostgREST reads (GET /rest/v1/<table>) from a FakeSupabase."""
+
+    def __init__(self, db: FakeSupabase):
+        self.db = db
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        query = self.db.table(request.url.path.rstrip("/").rsplit("/", 1)[-1])
+        for key, value in request.url.params.multi_items():
+            if key == "select":
+                query.select(value)
+            elif key == "order":
+                for part in value.split(","):
+                    column, _, direction = part.partition(".")
+                    query.order(column, desc=direction.startswith("desc"))
+            elif key == "limit":
+                query.limit(int(value))
+            elif key == "offset":
+                query.offset(int(value))
+            else:
+                operator, _, operand = value.partition(".")
+                if operator == "eq":
+                    query.filters.append(lambda row, column=key, operand=operand: _postgrest_literal(row.get(column)) == operand)
+                elif operator == "in":
+                    query.filters.append(lambda row, column=key, values=_postgrest_list(operand): _postgrest_literal(row.get(column)) in values)
+                else:
+                    return httpx.Response(400, json={"message": f"Unsupported filter {value}"})
+        # execute() sleeps for the simulated latency; a thread keeps that off the caller's event loop
+        res = await asyncio.to_thread(query.execute)
+        return httpx.Response(200, json=res.data)
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class FakeGenerationResponse:
+    def __init__(self, text: str, prompt_tokens: int):
+        self.text = text
+        self.usage_metadata = FakeUsage(prompt_tokens, len(text) // 4)
+
+
+class FakeGeminiModel:
+    """
+    Stand-in for genai.GenerativeModel.
+    Latency is log-normal around latency_ms plus a per-prompt-token cost, which is how Gemini behaves.
+    """
+
+    def __init__(self, model_name: str = "fake-gemini", latency_ms: float = 300.0, ms_per_1k_prompt_tokens: float = 20.0, error_rate: float = 0.0):
+        self.model_name = model_name
+        self.latency_ms = latency_ms
+        self.ms_per_1k_prompt_tokens = ms_per_1k_prompt_tokens
+        self.error_rate = error_rate
+
+    def generate_content(self, prompt, request_options=None, **kwargs):
+        prompt_tokens = max(1, len(str(prompt)) // 4)
+        delay = random.lognormvariate(math.log(max(self.latency_ms, 1.0)), 0.35) + prompt_tokens * self.ms_per_1k_prompt_tokens / 1000.0
+        time.sleep(delay / 1000.0)
+        if self.error_rate and random.random() < self.error_rate:
+            error = RuntimeError("429 Resource has been exhausted (fake)")
+            error.code = 429
+            raise error
+        return FakeGenerationResponse(f"Fake answer based on {prompt_tokens} prompt tokens.", prompt_tokens)
+
+
+class FakeSentenceTransformer:
+    """
+    Deterministic hashed bag-of-words embeddings, so retrieval still ranks related text higher.
+    Simulates the encoder cost with a fixed per-call and per-text latency.
+    """
+
+    def __init__(self, model_name: str = "fake-bge", dim: int = EMBEDDING_DIM, call_ms: float = 5.0, per_text_ms: float = 2.0, **kwargs):
+        self.model_name = model_name
+        self.dim = dim
+        self.call_ms = call_ms
+        self.per_text_ms = per_text_ms
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, show_progress_bar: bool = False, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        time.sleep((self.call_ms + self.per_text_ms * len(texts)) / 1000.0)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                h = zlib.crc32(word.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 1 else -1.0
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-8
+        return vectors
+
+
+class FakeHTTPResponse:
+    def __init__(self, text: str, status_code: int = 200):
+        self.text = text
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+def install_fakes(db: FakeSupabase, gemini_latency_ms: float = 300.0, embed_call_ms: float = 5.0, embed_per_text_ms: float = 2.0, gemini_error_rate: float = 0.0):
+    """Replace the Supabase, Gemini and sentence-transformers SDKs with the fakes above."""
+    os.environ.setdefault("SUPABASE_URL", "http://supabase.fake")
+    os.environ.setdefault("SUPABASE_KEY", "fake-key")
+    os.environ.setdefault("GEMINI_API_KEY", "fake-key")
+    os.environ.setdefault("EMBEDDING_ARENA_DIR", tempfile.mkdtemp(prefix="bench-arena-"))
+
+    supabase_module = types.ModuleType("supabase")
+    supabase_module.Client = FakeSupabase
+    supabase_module.create_client = lambda url, key, *args, **kwargs: db
+    sys.modules["supabase"] = supabase_module
+
+    genai = types.ModuleType("google.generativeai")
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = lambda model_name, *args, **kwargs: FakeGeminiModel(model_name, latency_ms=gemini_latency_ms, error_rate=gemini_error_rate)
+    try:
+        import google
+    except ImportError:
+        google = types.ModuleType("google")
+        google.__path__ = []
+        sys.modules["google"] = google
+    google.generativeai = genai
+    sys.modules["google.generativeai"] = genai
+
+    sentence_transformers = types.ModuleType("sentence_transformers")
+    sentence_transformers.SentenceTransformer = lambda model_name, *args, **kwargs: FakeSentenceTransformer(model_name, call_ms=embed_call_ms, per_text_ms=embed_per_text_ms)
+    sys.modules["sentence_transformers"] = sentence_transformers
+
+    # The data-access layer talks to PostgREST over HTTP rather than through the SDK
+    from app.services.data_access import set_transport
+    set_transport(FakePostgrestTransport(db))
+
+
+def install_fake_web(pages: list):
+    """Make requests.get, as used by /scrape, return one of the given HTML pages."""
+    import requests
+
+    requests.get = lambda url, *args, **kwargs: FakeHTTPResponse(random.choice(pages))
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# Tests run from the backend directory or the repository root; app and benchmarks import as top-level packages
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeSupabase, install_fakes
+
+# Per-IP and per-token limits on /embed/chat would answer repeated test requests with 429
+os.environ.setdefault("EMBED_IP_RATE", "0")
+os.environ.setdefault("EMBED_TOKEN_RATE", "0")
+# The services create their clients at import time, so the fakes go in before any test imports app
+_db = FakeSupabase(max_rows=1000)
+install_fakes(_db, gemini_latency_ms=1, embed_call_ms=0, embed_per_text_ms=0)
+
+
+@pytest.fixture
+def db():
+    """The fake Supabase behind the app, emptied for each test."""
+    with _db.lock:
+        _db.tables.clear()
+    yield _db
+    with _db.lock:
+        _db.tables.clear()
@@ -0,0 +1,34 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.context_packer import MAX_CONTEXT_TOKEN_BUDGET, MAX_TOP_K, pack_context
+
+client = TestClient(app)
+
+ENDPOINTS = [
+    ("/chat", {"bot_id": "bot", "user_query": "hello"}),
+    ("/chat/batch", {"bot_id": "bot", "queries": ["hello"]}),
+    ("/embed/chat", {"bot_id": "bot", "user_query": "hello", "embed_token": "token"}),
+]
+REJECTED = [
+    {"token_budget": 0},
+    {"token_budget": -100},
+    {"token_budget": MAX_CONTEXT_TOKEN_BUDGET + 1},
+    {"top_k": 0},
+    {"top_k": -1},
+    {"top_k": MAX_TOP_K + 1},
+]
+
+
+@pytest.mark.parametrize("path,body", ENDPOINTS)
+@pytest.mark.parametrize("fields", REJECTED)
+def test_out_of_range_budget_and_top_k_are_rejected(path, body, fields):
+    response = client.post(path, json={**body, **fields})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"][-1] == next(iter(fields))
+
+
+def test_pack_context_sends_nothing_for_an_empty_budget():
+    hits = [{"id": "a", "chunk_text": "some retrieved text " * 20}]
+    assert pack_context(hits, 0) == ([], 0)
@@ -0,0 +1,70 @@
+from app.services import conversation
+from app.services.conversation import load_session, record_turn
+
+
+def _turns(n, start=0):
+    return [{"user": f"question {i}", "bot": f"answer {i}"} for i in range(start, start + n)]
+
+
+def _store(db, bot_id, session_id, **fields):
+    row = {"bot_id": bot_id, "session_id": session_id, "summary": "", "summarized_turns": 0, "turns": [], "version": 0, "updated_at": "2024-01-01T00:00:00"}
+    row.update(fields)
+    db.table("chat_sessions").upsert(row).execute()
+
+
+def test_turn_recorded_after_a_summary_keeps_the_summary(db):
+    _store(db, "bot", "s1", turns=_turns(4))
+    session = load_session("bot", "s1")
+    # A background summary folds the first turn while this request is being answered
+    _store(db, "bot", "s1", summary="earlier summary", summarized_turns=1, turns=_turns(3, start=1), version=1)
+
+    record_turn(session, "question 4", "answer 4")
+
+    stored = load_session("bot", "s1")
+    assert stored["summary"] == "earlier summary"
+    assert stored["summarized_turns"] == 1
+    assert stored["turns"] == _turns(4, start=1)
+    assert session["version"] == stored["version"] == 2
+
+
+def test_concurrent_first_turns_are_both_kept(db):
+    first, second = load_session("bot", "s2"), load_session("bot", "s2")
+    record_turn(first, "question 0", "answer 0")
+    record_turn(second, "question 1", "answer 1")
+    assert load_session("bot", "s2")["turns"] == _turns(2)
+
+
+def test_fold_keeps_turns_answered_while_summarizing(db, monkeypatch):
+    monkeypatch.setattr(conversation, "MEMORY_RECENT_TURNS", 2)
+    _store(db, "bot", "s3", turns=_turns(4))
+
+    def summarize(prompt, bot_id=None):
+        record_turn(load_session("bot", "s3"), "question 4", "answer 4")
+        return "new summary"
+
+    monkeypatch.setattr(conversation, "generate_text", summarize)
+    # Registered as in progress, as record_turn does, so the turn above does not start a second summary
+    conversation._summarizing.add(("bot", "s3"))
+    conversation._fold_turns("bot", "s3")
+
+    stored = load_session("bot", "s3")
+    assert stored["summary"] == "new summary"
+    assert stored["summarized_turns"] == 2
+    assert stored["turns"] == _turns(3, start=2)
+
+
+def test_fold_is_dropped_when_its_turns_were_already_folded(db, monkeypatch):
+    monkeypatch.setattr(conversation, "MEMORY_RECENT_TURNS", 2)
+    _store(db, "bot", "s4", turns=_turns(4))
+
+    def summarize(prompt, bot_id=None):
+        # Another worker folds the same turns first
+        _store(db, "bot", "s4", summary="other summary", summarized_turns=2, turns=_turns(2, start=2), version=1)
+        return "late summary"
+
+    monkeypatch.setattr(conversation, "generate_text", summarize)
+    conversation._fold_turns("bot", "s4")
+
+    stored = load_session("bot", "s4")
+    assert stored["summary"] == "other summary"
+    assert stored["turns"] == _turns(2, start=2)
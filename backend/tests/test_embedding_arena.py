@@ -0,0 +1,41 @@
+from app.services import embedding_arena
+from app.services.embeddings import EMBEDDING_MODEL_ID
+
+
+def _chunk(bot_id, i):
+    return {
+        "id": f"{bot_id}-chunk-{i:03d}",
+        "document_id": f"{bot_id}-doc",
+        "bot_id": bot_id,
+        "chunk_index": i,
+        "chunk_text": f"chunk {i}",
+        "embedding": [float(i + 1), 1.0, 0.0, 0.0],
+        "model_id": EMBEDDING_MODEL_ID,
+        "created_at": f"2024-01-01T00:00:{i:02d}",
+    }
+
+
+def test_segment_replaced_while_mapping_is_retried(db, monkeypatch):
+    bot_id = "arena-bot"
+    db.table("bots").insert({"id": bot_id, "name": "Arena bot", "embedding_model": EMBEDDING_MODEL_ID}).execute()
+    db.table("embeddings").insert([_chunk(bot_id, i) for i in range(3)]).execute()
+    assert len(embedding_arena.get_segment(bot_id)) == 3
+
+    # A worker that has not mapped the bot yet finds it in the manifest, and just before it opens the
+    # files another worker ingests a chunk and replaces (and unlinks) the segment
+    embedding_arena._segments.pop(bot_id, None)
+    embedding_arena._checked_at.pop(bot_id, None)
+    arena_segment = embedding_arena.ArenaSegment
+    calls = []
+
+    def racing_segment(*args):
+        if not calls:
+            calls.append(args)
+            db.table("embeddings").insert(_chunk(bot_id, 3)).execute()
+            embedding_arena.refresh_segment(bot_id, embedding_arena.fetch_version(bot_id))
+        return arena_segment(*args)
+
+    monkeypatch.setattr(embedding_arena, "ArenaSegment", racing_segment)
+    segment = embedding_arena.get_segment(bot_id)
+    assert calls
+    assert len(segment) == 4
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+
+from app.services import embedding_server
+from app.services.embedding_server import EmbeddingServerClient, EmbeddingServerError
+from app.services.embeddings import EMBEDDING_MODEL_ID
+
+
+@pytest.fixture
+def server_socket():
+    """Path of an embedding server running on a background event loop."""
+    path = os.path.join(tempfile.mkdtemp(prefix="embedding-server-"), "server.sock")
+    loop = asyncio.new_event_loop()
+    loop.create_task(embedding_server.serve(path, preload=False))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.01)
+    yield path
+
+    async def shutdown():
+        # Connection handlers are cancelled with the server, so none is left pending when the loop stops
+        tasks = [other for other in asyncio.all_tasks() if other is not asyncio.current_task()]
+        for other in tasks:
+            other.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def test_server_encodes_allowed_models(server_socket):
+    vectors = EmbeddingServerClient(server_socket).encode(["hello", "world"], EMBEDDING_MODEL_ID)
+    assert vectors.shape[0] == 2
+
+
+def test_server_rejects_models_not_on_the_allowlist(server_socket):
+    with pytest.raises(EmbeddingServerError, match="not allowed"):
+        EmbeddingServerClient(server_socket).encode(["hello"], "someone/else")
+
+
+def test_slow_server_raises_instead_of_encoding_in_process(monkeypatch):
+    path = os.path.join(tempfile.mkdtemp(prefix="embedding-server-"), "slow.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    # Accepts connections but never answers
+    listener.listen()
+    monkeypatch.setattr(embedding_server, "EMBEDDING_SERVER_SOCKET", path)
+    monkeypatch.setattr(embedding_server, "_client", EmbeddingServerClient(path, timeout=0.2))
+    monkeypatch.setattr(embedding_server, "encode_texts", lambda *args: pytest.fail("encoded in-process"))
+    try:
+        with pytest.raises(EmbeddingServerError):
+            embedding_server.embed_texts(["hello"])
+    finally:
+        listener.close()
+
+
+def test_unreachable_server_falls_back_to_in_process(monkeypatch):
+    path = os.path.join(tempfile.mkdtemp(prefix="embedding-server-"), "missing.sock")
+    monkeypatch.setattr(embedding_server, "EMBEDDING_SERVER_SOCKET", path)
+    monkeypatch.setattr(embedding_server, "_client", None)
+    monkeypatch.setattr(embedding_server, "_unavailable_until", 0.0)
+    monkeypatch.setattr(embedding_server, "encode_texts", lambda texts, model_id: ["in-process"] * len(texts))
+    assert embedding_server.embed_texts(["hello"]) == ["in-process"]
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from app.services.context_packer import estimate_tokens
+from app.services.generation_client import GenerationClient, GenerationError
+
+
+class SlowModel:
+    """Answers after latency seconds, or raises error; records when each call started."""
+
+    def __init__(self, latency: float, error: Exception = None):
+        self.latency = latency
+        self.error = error
+        self.started = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, request_options=None):
+        with self._lock:
+            self.started.append(time.monotonic())
+        time.sleep(self.latency)
+        if self.error is not None:
+            raise self.error
+        return f"answer to {prompt}"
+
+
+def make_client(model, **kwargs):
+    options = dict(max_concurrency=4, max_concurrency_per_bot=1, rpm=0, tpm=0, timeout=5, deadline=5, backoff_base=0)
+    options.update(kwargs)
+    return GenerationClient(model_factory=lambda name: model, **options)
+
+
+def test_busy_bot_does_not_block_other_bots():
+    client = make_client(SlowModel(0.3), max_concurrency=2)
+    hot = [threading.Thread(target=lambda: client.generate("hot", bot_id="hot", deadline=3)) for _ in range(4)]
+    for thread in hot:
+        thread.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    assert client.generate("quiet", bot_id="quiet", deadline=1) == "answer to quiet"
+    assert time.monotonic() - start < 0.6
+    for thread in hot:
+        thread.join()
+
+
+def test_hedge_is_charged_against_token_budget():
+    prompt = "x" * 400
+    tokens = estimate_tokens(prompt)
+    model = SlowModel(0.2)
+    # Room for the primary call's tokens but not for a hedge's
+    client = make_client(model, rpm=600, tpm=int(tokens * 1.5), hedge_after=0.05)
+    client.generate(prompt, bot_id="bot")
+    assert len(model.started) == 1
+
+    model = SlowModel(0.2)
+    client = make_client(model, rpm=600, tpm=tokens * 10, hedge_after=0.05)
+    client.generate(prompt, bot_id="bot")
+    assert len(model.started) == 2
+    assert client._tokens._tokens < tokens * 10 - tokens * 1.5
+
+
+def test_no_attempt_starts_after_deadline():
+    error = RuntimeError("503 unavailable")
+    error.code = 503
+    model = SlowModel(0.15, error)
+    client = make_client(model, max_retries=10)
+    start = time.monotonic()
+    with pytest.raises(GenerationError):
+        client.generate("question", bot_id="bot", deadline=0.4)
+    time.sleep(0.3)
+    assert model.started
+    assert all(started < start + 0.4 for started in model.started)
@@ -0,0 +1,52 @@
+from app.services import reembed
+from app.services.embeddings import EMBEDDING_MODEL_ID
+
+TARGET_MODEL = "BAAI/bge-small-en-v1.5"
+
+
+def _chunk(bot_id, document_id, index, model_id):
+    return {
+        "id": f"{document_id}-{index}-{model_id}",
+        "document_id": document_id,
+        "bot_id": bot_id,
+        "chunk_index": index,
+        "chunk_text": f"chunk {index} of {document_id}",
+        "embedding": [0.0] * 4,
+        "model_id": model_id,
+    }
+
+
+def test_chunks_uploaded_with_the_old_model_after_the_switch_are_kept(db, monkeypatch):
+    bot_id = "reembed-bot"
+    db.table("bots").insert({"id": bot_id, "name": "Re-embed bot", "embedding_model": EMBEDDING_MODEL_ID}).execute()
+    db.table("embeddings").insert([_chunk(bot_id, "doc-1", i, EMBEDDING_MODEL_ID) for i in range(3)]).execute()
+
+    uploaded = []
+
+    def late_upload(seconds):
+        # During the retire delay, a worker whose cached model ID has not expired embeds a new document with the old model
+        switched = db.table("bots").select("embedding_model").eq("id", bot_id).execute().data[0]["embedding_model"] == TARGET_MODEL
+        if switched and not uploaded:
+            uploaded.append(seconds)
+            db.table("embeddings").insert([_chunk(bot_id, "doc-2", i, EMBEDDING_MODEL_ID) for i in range(2)]).execute()
+
+    monkeypatch.setattr(reembed, "REEMBED_CHUNKS_PER_SECOND", 0)
+    monkeypatch.setattr(reembed.time, "sleep", late_upload)
+    job = {
+        "bot_id": bot_id,
+        "source_model": EMBEDDING_MODEL_ID,
+        "target_model": TARGET_MODEL,
+        "status": "pending",
+        "total_chunks": 0,
+        "done_chunks": 0,
+        "error": None,
+        "started_at": None,
+        "finished_at": None,
+    }
+    reembed._run(job)
+
+    assert job["status"] == "done", job["error"]
+    assert uploaded
+    rows = db.table("embeddings").select("document_id,chunk_index,model_id").eq("bot_id", bot_id).execute().data
+    assert {row["model_id"] for row in rows} == {TARGET_MODEL}
+    assert sorted((row["document_id"], row["chunk_index"]) for row in rows) == [("doc-1", 0), ("doc-1", 1), ("doc-1", 2), ("doc-2", 0), ("doc-2", 1)]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from app.services import retrieval
+from app.services.embeddings import EMBEDDING_MODEL_ID
+
+DIM = 16
+
+
+@pytest.fixture
+def large_bot(db, monkeypatch):
+    """A bot with more chunks than PostgREST returns in one response, read from Supabase rather than the arena."""
+    monkeypatch.setattr(retrieval, "EMBEDDING_ARENA_ENABLED", False)
+    bot_id = "large-bot"
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(2500, DIM)).astype(np.float32)
+    db.table("bots").insert({"id": bot_id, "name": "Large bot", "embedding_model": EMBEDDING_MODEL_ID}).execute()
+    db.table("embeddings").insert([
+        {
+            "id": f"chunk-{i:05d}",
+            "document_id": f"doc-{i // 100}",
+            "bot_id": bot_id,
+            "chunk_index": i % 100,
+            "chunk_text": f"chunk {i}",
+            "embedding": vector.tolist(),
+            "model_id": EMBEDDING_MODEL_ID,
+        }
+        for i, vector in enumerate(vectors)
+    ]).execute()
+    return bot_id, vectors
+
+
+def test_fetch_embeddings_reads_every_page(large_bot):
+    bot_id, vectors = large_bot
+    rows = retrieval._fetch_embeddings(bot_id)
+    assert len(rows) == len(vectors)
+    assert len({row["id"] for row in rows}) == len(vectors)
+
+
+def test_dense_search_finds_chunks_past_the_first_page(large_bot):
+    bot_id, vectors = large_bot
+    hits = retrieval.dense_search(bot_id, vectors[2345], top_k=1)
+    assert hits[0]["id"] == "chunk-02345"
+
+
+def test_batch_dense_search_finds_chunks_past_the_first_page(large_bot):
+    bot_id, vectors = large_bot
+    results = retrieval.batch_dense_search(bot_id, vectors[[10, 1500, 2499]], top_k=1)
+    assert [hits[0]["id"] for hits in results] == ["chunk-00010", "chunk-01500", "chunk-02499"]